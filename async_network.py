@@ -0,0 +1,215 @@
+# async_network.py
+
+import asyncio
+import struct
+import threading
+
+from peer_connection import PeerProtocol, HANDSHAKE_LENGTH, KEEP_ALIVE_INTERVAL
+from rate_limiter import reserve, refund
+
+
+class AsyncPeerConnection(PeerProtocol, asyncio.BufferedProtocol):
+    """
+    Peer wire protocol driven by an asyncio event loop. All connections
+    share the single loop thread owned by AsyncNetwork.
+    """
+
+    def __init__(self, network, ip, port, piece_manager, peer_id, info_hash, client, is_incoming=False, verbose=False):
+        PeerProtocol.__init__(self, ip, port, piece_manager, peer_id, info_hash, client, is_incoming=is_incoming, verbose=verbose)
+        self.network = network
+        self.transport = None
+        self.handshake_done = False
+        self.keep_alive_handle = None
+        # (piece_index, begin) -> (timer handle, length) of blocks waiting
+        # for the upload rate limit; only touched on the loop thread
+        self.queued_uploads = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.is_incoming:
+            self.ip, self.port = transport.get_extra_info('peername')[:2]
+            if self.verbose:
+                print(f"Incoming connection from {self.ip}:{self.port}")
+        else:
+            transport.write(self.build_handshake())
+            if self.verbose:
+                print(f"Sent handshake to {self.ip}:{self.port}")
+        with self.client.lock:
+            self.client.connected_peers.append(self)
+
+    def connection_lost(self, exc):
+        if self.keep_alive_handle is not None:
+            self.keep_alive_handle.cancel()
+        self.cancel_uploads_now()
+        if exc is not None and self.verbose:
+            print(f"Connection error with peer {self.ip}:{self.port} - {exc}")
+        self.on_connection_closed()
+
+    def get_buffer(self, sizehint):
+        # The loop reads straight into our message buffer
+        if not self.handshake_done:
+            return self.receive_buffer.reserve(HANDSHAKE_LENGTH)
+        return self.receive_buffer.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.receive_buffer.buffer_updated(nbytes)
+        if self.download_buckets:
+            # Stop reading until the download limit allows more
+            delay = reserve(self.download_buckets, nbytes)
+            if delay > 0:
+                self.transport.pause_reading()
+                self.network.loop.call_later(delay, self.resume_reading)
+        try:
+            if not self.handshake_done:
+                if len(self.receive_buffer) < HANDSHAKE_LENGTH:
+                    return
+                self.check_handshake(bytes(self.receive_buffer.take(HANDSHAKE_LENGTH)))
+                if self.is_incoming:
+                    # Send handshake back
+                    self.transport.write(self.build_handshake())
+                    if self.verbose:
+                        print(f"Sent handshake to peer {self.ip}:{self.port}")
+                self.handshake_done = True
+                self.keep_alive_handle = self.network.loop.call_later(KEEP_ALIVE_INTERVAL, self.keep_alive)
+                self.on_handshake_complete()
+            for msg_id, payload in self.receive_buffer.messages():
+                if msg_id is None:
+                    continue  # Keep-alive
+                self.handle_message(msg_id, payload)
+                if not self.running:
+                    break
+            if not self.running:
+                self.transport.close()
+        except Exception as e:
+            if self.verbose:
+                print(f"Error in communication with peer {self.ip}:{self.port} - {e}")
+            self.transport.close()
+
+    def resume_reading(self):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def keep_alive(self):
+        self.write(struct.pack('!I', 0))
+        if self.verbose:
+            print(f"Sent keep-alive to {self.ip}:{self.port}")
+        self.keep_alive_handle = self.network.loop.call_later(KEEP_ALIVE_INTERVAL, self.keep_alive)
+
+    def wake(self):
+        self.network.call_soon(self.request_pieces)
+
+    def write(self, data):
+        # May be called from other threads; transports are loop-only
+        self.network.call_soon(self.write_now, data)
+
+    def write_now(self, data):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def send_message(self, msg_id, payload=b''):
+        msg = struct.pack('!IB', 1 + len(payload), msg_id) + payload
+        self.write(msg)
+        if self.verbose:
+            print(f"Sent message ID {msg_id} to {self.ip}:{self.port}")
+
+    def send_buffers(self, buffers):
+        self.network.call_soon(self.write_lines_now, buffers)
+
+    def send_buffers_after(self, delay, buffers, block=None):
+        # Called on the loop thread; later blocks have later delays, so they
+        # still go out in order
+        if delay > 0:
+            handle = self.network.loop.call_later(delay, self.write_queued, block, buffers)
+            if block is not None:
+                self.queued_uploads[block[:2]] = (handle, block[2])
+        else:
+            self.send_buffers(buffers)
+
+    def write_queued(self, block, buffers):
+        if block is not None:
+            self.queued_uploads.pop(block[:2], None)
+        self.write_lines_now(buffers)
+
+    def cancel_upload(self, piece_index, begin):
+        # Called on the loop thread (CANCEL); the block's bytes go back to
+        # the rate limit and out of the upload totals
+        queued = self.queued_uploads.pop((piece_index, begin), None)
+        if queued is None:
+            return
+        handle, length = queued
+        handle.cancel()
+        refund(self.upload_buckets, length)
+        self.piece_manager.uploaded -= length
+        self.bytes_uploaded -= length
+        if self.verbose:
+            print(f"Dropped queued upload of piece {piece_index} (offset {begin}) to {self.ip}:{self.port}.")
+
+    def cancel_uploads(self):
+        # May be called from the choker's thread
+        self.network.call_soon(self.cancel_uploads_now)
+
+    def cancel_uploads_now(self):
+        for piece_index, begin in list(self.queued_uploads):
+            self.cancel_upload(piece_index, begin)
+
+    def write_lines_now(self, buffers):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.writelines(buffers)
+
+
+class AsyncNetwork:
+    """
+    Runs an asyncio event loop in a background thread and creates
+    AsyncPeerConnection instances for incoming and outgoing connections.
+    Selected with NodeClient(network='asyncio').
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread_id = None
+        self.server = None
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        self.thread_id = threading.get_ident()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def call_soon(self, callback, *args):
+        if threading.get_ident() == self.thread_id:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def create_peer(self, ip, port, is_incoming):
+        client = self.client
+        return AsyncPeerConnection(self, ip, port, client.piece_manager, client.peer_id, client.info_hash, client,
+                                   is_incoming=is_incoming, verbose=client.verbose)
+
+    def listen(self, port):
+        future = asyncio.run_coroutine_threadsafe(
+            self.loop.create_server(lambda: self.create_peer(None, None, True), '', port), self.loop)
+        self.server = future.result()
+
+    def connect(self, ip, port):
+        peer = self.create_peer(ip, port, False)
+        asyncio.run_coroutine_threadsafe(self.open_connection(peer), self.loop)
+
+    async def open_connection(self, peer):
+        try:
+            if self.client.verbose:
+                print(f"Outgoing connection to {peer.ip}:{peer.port}")
+            await self.loop.create_connection(lambda: peer, peer.ip, peer.port)
+        except OSError as e:
+            if self.client.verbose:
+                print(f"Failed to connect to peer {peer.ip}:{peer.port} - {e}")
+            peer.on_connection_closed()
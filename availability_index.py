@@ -0,0 +1,133 @@
+# availability_index.py
+
+import random
+from bitfield import iter_set_bits
+
+
+class AvailabilityIndex:
+    """
+    Availability counts (the number of connected peers that have each piece)
+    and the set of pieces we still want to request, all held as int masks
+    like peer bitfields. The counts are bit-sliced: bit i of planes[k] is bit
+    k of piece i's count, so a whole peer mask is added or subtracted with a
+    ripple carry over a handful of planes instead of one update per piece.
+
+    The rarest wanted piece a peer has is found with mask operations too:
+    starting from the wanted pieces the peer has, each plane from the top
+    down keeps only the candidates whose bit is clear (when any are), which
+    leaves exactly the candidates of the lowest count. One of those is
+    taken from a random starting point, so peers do not all chase the same
+    pieces.
+    """
+
+    def __init__(self, total_pieces, wanted=0):
+        self.total_pieces = total_pieces
+        self.wanted = wanted  # Bit i set while piece i is missing and unrequested
+        self.planes = []
+
+    def __len__(self):
+        return self.wanted.bit_count()
+
+    def __contains__(self, index):
+        return (self.wanted >> index) & 1 == 1
+
+    def __iter__(self):
+        # Wanted pieces, rarest first
+        counts = self.counts()
+        return iter(sorted(iter_set_bits(self.wanted, self.total_pieces), key=counts.__getitem__))
+
+    def add(self, index):
+        self.wanted |= 1 << index
+
+    def discard(self, index):
+        self.wanted &= ~(1 << index)
+
+    def available(self):
+        # Pieces at least one counted peer has
+        mask = 0
+        for plane in self.planes:
+            mask |= plane
+        return mask
+
+    def unavailable(self):
+        # Wanted pieces no counted peer has
+        return (self.wanted & ~self.available()).bit_count()
+
+    def count(self, index):
+        return sum(((plane >> index) & 1) << k for k, plane in enumerate(self.planes))
+
+    def counts(self):
+        # Every piece's count, as a list
+        counts = [0] * self.total_pieces
+        for k, plane in enumerate(self.planes):
+            for index in iter_set_bits(plane, self.total_pieces):
+                counts[index] += 1 << k
+        return counts
+
+    def add_mask(self, mask):
+        # Add one to the count of every piece in the mask
+        carry = mask
+        planes = self.planes
+        for k, plane in enumerate(planes):
+            if not carry:
+                return
+            planes[k] = plane ^ carry
+            carry &= plane
+        if carry:
+            planes.append(carry)
+
+    def subtract_mask(self, mask):
+        # Subtract one from the count of every piece in the mask; counts
+        # already at zero stay there
+        borrow = mask & self.available()
+        planes = self.planes
+        for k, plane in enumerate(planes):
+            if not borrow:
+                break
+            planes[k] = plane ^ borrow
+            borrow &= ~plane
+        while planes and not planes[-1]:
+            planes.pop()
+
+    def increment(self, index):
+        self.add_mask(1 << index)
+
+    def decrement(self, index):
+        self.subtract_mask(1 << index)
+
+    def replace_counts(self, planes):
+        """
+        Replace every count with those in `planes` (e.g. from another index)
+        and return how many pieces had a different count.
+        """
+        changed = 0
+        for k in range(max(len(self.planes), len(planes))):
+            old = self.planes[k] if k < len(self.planes) else 0
+            new = planes[k] if k < len(planes) else 0
+            changed |= old ^ new
+        self.planes = list(planes)
+        return changed.bit_count()
+
+    def pick(self, peer_mask=None, include_unavailable=False):
+        """
+        Return the rarest wanted piece in peer_mask, or the rarest wanted
+        piece overall if peer_mask is None. Pieces no partial peer has
+        (count 0) are skipped when a peer mask is given, unless
+        include_unavailable is set, e.g. because a seed is connected.
+        """
+        candidates = self.wanted
+        if peer_mask is not None:
+            candidates &= peer_mask
+            if not include_unavailable:
+                candidates &= self.available()
+        if not candidates:
+            return None
+        for plane in reversed(self.planes):
+            lower = candidates & ~plane
+            if lower:
+                candidates = lower
+        start = random.randrange(self.total_pieces)
+        after = candidates >> start
+        if after:
+            return start + (after & -after).bit_length() - 1
+        return (candidates & -candidates).bit_length() - 1
@@ -0,0 +1,110 @@
+# bench_bitfield.py
+#
+# Times BITFIELD handling (availability update) and the "is this peer
+# interesting" check for a large torrent, old per-index loops versus the
+# bit-mask implementation in PieceManager/PeerProtocol. A repeated BITFIELD
+# from the same peer first subtracts what it sent before.
+#
+#   python benchmarks/bench_bitfield.py --pieces 50000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bitfield import bitfield_to_mask
+from piece_manager import PieceManager
+
+
+def has_piece_in_bitfield(bitfield, index):
+    byte_index = index // 8
+    bit_index = index % 8
+    if byte_index >= len(bitfield):
+        return False
+    return (bitfield[byte_index] >> (7 - bit_index)) & 1
+
+
+def old_update(availability, bitfield, total_pieces):
+    for index in range(total_pieces):
+        if has_piece_in_bitfield(bitfield, index):
+            availability[index] += 1
+
+
+def old_interesting(missing_pieces, bitfield):
+    for index in missing_pieces:
+        if has_piece_in_bitfield(bitfield, index):
+            return True
+    return False
+
+
+def make_bitfield(total_pieces, fraction, rnd):
+    bitfield = bytearray((total_pieces + 7) // 8)
+    for index in range(total_pieces):
+        if rnd.random() < fraction:
+            bitfield[index // 8] |= 1 << (7 - index % 8)
+    return bytes(bitfield)
+
+
+def new_peer():
+    # Stand-in for a connection; the piece manager keeps its mask on it
+    return types.SimpleNamespace(peer_pieces=0, peer_is_seed=False)
+
+
+def report(name, seconds):
+    print(f"{name:<40} {seconds * 1e6:12.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bitfield processing.')
+    parser.add_argument('--pieces', type=int, default=50000, help='Number of pieces')
+    parser.add_argument('--repeat', type=int, default=20, help='Timing repetitions')
+    args = parser.parse_args()
+
+    total_pieces = args.pieces
+    piece_length = 16384
+    metainfo = {b'info': {b'name': b'bench', b'piece length': piece_length,
+                          b'length': total_pieces * piece_length, b'pieces': b'\x00' * 20 * total_pieces}}
+    rnd = random.Random(0)
+    seed = make_bitfield(total_pieces, 1.0, rnd)
+    sparse = make_bitfield(total_pieces, 0.01, rnd)
+    half = make_bitfield(total_pieces, 0.5, rnd)
+
+    with tempfile.TemporaryDirectory() as directory:
+        piece_manager = PieceManager(metainfo, directory)
+        # We are missing only the last piece, which the sparse peer lacks
+        piece_manager.missing_pieces = {total_pieces - 1}
+        piece_manager.missing_mask = 1 << (total_pieces - 1)
+        sparse = bytearray(sparse)
+        sparse[-1] &= ~(1 << (7 - (total_pieces - 1) % 8)) & 0xFF
+        sparse = bytes(sparse)
+        availability = [0] * total_pieces
+
+        for name, bitfield in (('seed', seed), ('1% peer', sparse), ('50% peer', half)):
+            old = min(timeit.repeat(lambda: old_update(availability, bitfield, total_pieces), number=1, repeat=args.repeat))
+            report(f"BITFIELD ({name}), per-index loop", old)
+            new = min(timeit.repeat(lambda: piece_manager.add_peer_bitfield(new_peer(), bitfield_to_mask(bitfield, total_pieces)),
+                                    number=1, repeat=args.repeat))
+            report(f"BITFIELD ({name}), bit mask", new)
+
+        peer = new_peer()
+        half_mask = bitfield_to_mask(half, total_pieces)
+        piece_manager.add_peer_bitfield(peer, half_mask)
+        new = min(timeit.repeat(lambda: piece_manager.add_peer_bitfield(peer, half_mask), number=1, repeat=args.repeat))
+        report("BITFIELD (50% peer, repeated), bit mask", new)
+
+        full_missing = set(range(total_pieces - 1)) | {total_pieces - 1}
+        old = min(timeit.repeat(lambda: old_interesting(full_missing, sparse), number=1, repeat=args.repeat))
+        report("interest check, scan of missing pieces", old)
+        mask = bitfield_to_mask(sparse, total_pieces)
+        new = min(timeit.repeat(lambda: (mask & piece_manager.missing_mask) != 0, number=1, repeat=args.repeat))
+        report("interest check, mask AND", new)
+        piece_manager.storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# bench_create_torrent.py
+#
+# Builds a torrent for a synthetic multi-file tree with create_torrent.py,
+# reporting throughput and peak Python memory per worker count, and checks
+# the result against PieceManager's own recheck. --compare-old also times
+# the previous approach (concatenate every file in memory, hash serially).
+#
+#   python benchmarks/bench_create_torrent.py --size 4096 --files 64 --workers 1,2,4
+#   python benchmarks/bench_create_torrent.py --size 256 --files 64 --compare-old
+
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bencodepy
+from create_torrent import create_torrent, get_files
+from piece_manager import PieceManager
+
+CHUNK = 8 << 20
+
+
+def make_tree(root, size, files):
+    # Files of varying length in a few subdirectories, filled with random data
+    os.makedirs(root)
+    weights = [1 + i % 7 for i in range(files)]
+    lengths = [size * weight // sum(weights) for weight in weights]
+    lengths[-1] += size - sum(lengths)
+    for i, length in enumerate(lengths):
+        directory = os.path.join(root, f'dir{i % 4}')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'file{i:04d}.bin'), 'wb') as f:
+            while length:
+                chunk = min(length, CHUNK)
+                f.write(os.urandom(chunk))
+                length -= chunk
+
+
+def old_create(root, piece_length):
+    # What VM/create_torrent.py does: build the whole payload, then hash
+    contents = b''
+    for filepath, components, length in get_files(root):
+        with open(filepath, 'rb') as f:
+            contents += f.read()
+    return b''.join(hashlib.sha1(contents[i:i + piece_length]).digest()
+                    for i in range(0, len(contents), piece_length))
+
+
+def timed(function, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Torrent creation benchmark')
+    parser.add_argument('--size', type=int, default=4096, help='Payload size in MiB')
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts')
+    parser.add_argument('--compare-old', action='store_true', help='Also time the in-memory builder')
+    args = parser.parse_args()
+
+    out = sys.__stdout__
+    size = args.size << 20
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, 'tree')
+        make_tree(root, size, args.files)
+        torrent_path = os.path.join(directory, 'tree.torrent')
+        sys.stdout = io.StringIO()  # Silence progress output
+        print(f"{args.size} MiB in {args.files} files, {os.cpu_count()} cores", file=out)
+
+        torrent = None
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            torrent, elapsed, peak = timed(create_torrent, root, 'http://127.0.0.1/announce', torrent_path, None, workers)
+            print(f"  {workers:3d} workers: {elapsed:7.2f} s  {size / elapsed / 1e9:5.2f} GB/s  "
+                  f"peak memory {peak / (1 << 20):6.1f} MiB", file=out)
+        piece_length = torrent[b'info'][b'piece length']
+        print(f"  piece length {piece_length}, {len(torrent[b'info'][b'pieces']) // 20} pieces", file=out)
+
+        if args.compare_old:
+            pieces, elapsed, peak = timed(old_create, root, piece_length)
+            assert pieces == torrent[b'info'][b'pieces']
+            print(f"  in-memory: {elapsed:7.2f} s  {size / elapsed / 1e9:5.2f} GB/s  "
+                  f"peak memory {peak / (1 << 20):6.1f} MiB", file=out)
+
+        # The client must accept every piece of the source tree
+        with open(torrent_path, 'rb') as f:
+            metainfo = bencodepy.decode(f.read())
+        piece_manager = PieceManager(metainfo, directory)
+        piece_manager.load_pieces_from_file()
+        print(f"  recheck by PieceManager: {len(piece_manager.pieces)}/{piece_manager.total_pieces} pieces valid", file=out)
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# bench_endgame.py
+#
+# One leecher downloads from a fast seeder and a slow one. Without endgame
+# the blocks handed to the slow seeder decide the completion time; with it
+# they are requested again from the fast seeder and cancelled at the slow one.
+#
+#   python benchmarks/bench_endgame.py --size 8 --slow-rate 64
+#   python benchmarks/bench_endgame.py --size 8 --slow-rate 64 --no-endgame
+#
+# A very slow peer (e.g. --slow-rate 0.5 --no-endgame) exercises the block
+# request deadlines instead.
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simple_tracker
+from bench_swarm import make_torrent
+from node_client import NodeClient
+from piece_manager import PieceManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark endgame mode on localhost.')
+    parser.add_argument('--size', type=int, default=8, help='Payload size in MiB')
+    parser.add_argument('--piece-length', type=int, default=256 * 1024, help='Piece length in bytes')
+    parser.add_argument('--slow-rate', type=float, default=64, help='Slow seeder upload rate in KiB/s')
+    parser.add_argument('--port', type=int, default=19300, help='Tracker port; peers use the ports above it')
+    parser.add_argument('--timeout', type=float, default=300, help='Give up after this many seconds')
+    parser.add_argument('--no-endgame', action='store_true', help='Disable endgame for comparison')
+    args = parser.parse_args()
+
+    NodeClient.get_external_ip = lambda self: '127.0.0.1'
+    simple_tracker.TrackerHandler.log_message = lambda *a: None
+    if args.no_endgame:
+        PieceManager.next_endgame_block = lambda self, has_piece, outstanding: None
+
+    directory = tempfile.mkdtemp(prefix='bench_endgame_')
+    torrent_file, data = make_torrent(directory, 'payload.bin', args.size << 20, args.piece_length,
+                                      f'http://127.0.0.1:{args.port}/announce')
+
+    # Client output would drown the report
+    sys.stdout = io.StringIO()
+    threading.Thread(target=simple_tracker.run_tracker, kwargs={'port': args.port}, daemon=True).start()
+    time.sleep(0.5)
+    for port, rate in ((args.port + 1, 0), (args.port + 2, args.slow_rate * 1024)):
+        seeder = NodeClient(torrent_file, port, directory, role='seeder', max_upload_speed=int(rate))
+        threading.Thread(target=seeder.start, daemon=True).start()
+    time.sleep(0.5)
+
+    leecher_directory = os.path.join(directory, 'leecher')
+    os.makedirs(leecher_directory)
+    leecher = NodeClient(torrent_file, args.port + 3, leecher_directory)
+    start = time.time()
+    threading.Thread(target=leecher.start, daemon=True).start()
+    while time.time() - start < args.timeout:
+        if leecher.piece_manager and leecher.piece_manager.is_complete():
+            break
+        time.sleep(0.01)
+    elapsed = time.time() - start
+    leecher.piece_manager.storage.flush()
+
+    out = sys.__stdout__
+    with open(os.path.join(leecher_directory, 'payload.bin'), 'rb') as f:
+        ok = f.read() == data
+    metrics = leecher.get_metrics()
+    print(f"endgame: {'off' if args.no_endgame else 'on'}, slow seeder: {args.slow_rate:g} KiB/s", file=out)
+    print(f"completion: {elapsed:.2f} s  {'ok' if ok else 'CORRUPT'}", file=out)
+    print(f"endgame requests: {metrics['endgame_requests']}, cancels sent: {metrics['cancels_sent']}, "
+          f"request timeouts: {metrics['request_timeouts']}", file=out)
+    print(f"redundant bytes: {metrics['redundant_bytes']} ({metrics['redundant_bytes'] / len(data):.2%} of payload)", file=out)
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# bench_framing.py
+#
+# Compares the old recvall-based message framing (three recvall calls per
+# message, each growing its result with data += packet) against
+# MessageBuffer, reporting recv syscalls and allocations per MB received.
+#
+#   python benchmarks/bench_framing.py --size 64
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_buffer import MessageBuffer
+
+MESSAGE_PIECE = 7
+
+
+class Counter:
+    def __init__(self):
+        self.syscalls = 0
+        self.allocations = 0
+        self.allocated_bytes = 0
+
+
+def old_framing(sock, total, counter):
+    def recvall(n):
+        data = b''
+        while len(data) < n:
+            packet = sock.recv(n - len(data))
+            counter.syscalls += 1
+            counter.allocations += 1  # bytes object returned by recv
+            counter.allocated_bytes += len(packet)
+            if not packet:
+                raise Exception("Connection closed")
+            if data:
+                counter.allocations += 1  # data += packet builds a new bytes object
+                counter.allocated_bytes += len(data) + len(packet)
+            data += packet
+        return data
+
+    received = 0
+    while received < total:
+        length = struct.unpack('!I', recvall(4))[0]
+        msg_id = struct.unpack('!B', recvall(1))[0]
+        payload = recvall(length - 1)
+        received += 4 + length
+
+
+def buffered_framing(sock, total, counter):
+    buffer = MessageBuffer()
+    received = 0
+    while received < total:
+        size_before = len(buffer.data)
+        buffer.recv_into(sock)
+        if len(buffer.data) != size_before:
+            counter.allocations += 1
+            counter.allocated_bytes += len(buffer.data)
+        for msg_id, payload in buffer.messages():
+            counter.allocations += 1  # memoryview for the payload, no data copied
+            received += 5 + len(payload)
+    counter.syscalls = buffer.recv_calls
+
+
+def run(name, reader, stream):
+    a, b = socket.socketpair()
+    a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    b.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sender = threading.Thread(target=a.sendall, args=(stream,))
+    counter = Counter()
+    sender.start()
+    start = time.perf_counter()
+    reader(b, len(stream), counter)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    a.close()
+    b.close()
+    mb = len(stream) / (1 << 20)
+    print(f"{name:<9} {mb / elapsed:8.1f} MB/s  {counter.syscalls / mb:8.1f} recv/MB  "
+          f"{counter.allocations / mb:8.1f} allocations/MB  {counter.allocated_bytes / len(stream):6.2f} bytes allocated per byte")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark peer wire message framing.')
+    parser.add_argument('--size', type=int, default=64, help='Stream size in MiB')
+    parser.add_argument('--block', type=int, default=16384, help='PIECE payload size in bytes')
+    args = parser.parse_args()
+
+    payload = b'\x00' * 8 + os.urandom(args.block)
+    message = struct.pack('!IB', 1 + len(payload), MESSAGE_PIECE) + payload
+    stream = message * ((args.size << 20) // len(message))
+    run('recvall', old_framing, stream)
+    run('buffered', buffered_framing, stream)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# bench_hashing.py
+#
+# Piece hash verification throughput. Times a full recheck
+# (PieceManager.load_pieces_from_file) with 1..N hash workers, in GB/s and
+# GB/s per core, and how long add_piece holds its caller for the block
+# that completes a piece now that the hash runs in the pool.
+#
+#   python benchmarks/bench_hashing.py --size 512 --workers 1,2,4
+
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from piece_manager import BLOCK_SIZE, PieceManager
+
+
+def make_payload(directory, name, size, piece_length):
+    data = os.urandom(size)
+    with open(os.path.join(directory, name), 'wb') as f:
+        f.write(data)
+    pieces = b''.join(hashlib.sha1(data[i:i + piece_length]).digest() for i in range(0, size, piece_length))
+    metainfo = {b'info': {b'name': name.encode('utf-8'), b'length': size, b'piece length': piece_length, b'pieces': pieces}}
+    return metainfo, data
+
+
+def bench_recheck(metainfo, directory, workers, size):
+    piece_manager = PieceManager(metainfo, directory, hash_workers=workers)
+    piece_manager.load_pieces_from_file()  # Warm the page cache
+    piece_manager = PieceManager(metainfo, directory, hash_workers=workers)
+    started = time.perf_counter()
+    piece_manager.load_pieces_from_file()
+    elapsed = time.perf_counter() - started
+    assert piece_manager.is_complete()
+    return size / elapsed / 1e9
+
+
+def bench_completion(metainfo, directory, data, piece_length, pieces):
+    # Deliver pieces block by block and time the add_piece calls that
+    # complete a piece, i.e. the ones that used to hash under the lock
+    verified = threading.Semaphore(0)
+    piece_manager = PieceManager(metainfo, directory, on_piece_verified=lambda index, valid: verified.release())
+    last_block = []
+    for index in range(pieces):
+        offset = index * piece_length
+        for begin in range(0, piece_length, BLOCK_SIZE):
+            block = data[offset + begin:offset + begin + BLOCK_SIZE]
+            started = time.perf_counter()
+            piece_manager.add_piece(index, begin, block)
+            if begin + BLOCK_SIZE >= piece_length:
+                last_block.append(time.perf_counter() - started)
+    for _ in range(pieces):
+        verified.acquire()
+    assert len(piece_manager.pieces) == pieces
+    started = time.perf_counter()
+    for index in range(pieces):
+        hashlib.sha1(data[index * piece_length:(index + 1) * piece_length]).digest()
+    inline = (time.perf_counter() - started) / pieces
+    last_block.sort()
+    return last_block[len(last_block) // 2], inline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Piece hash verification benchmark')
+    parser.add_argument('--size', type=int, default=512, help='Payload size in MiB')
+    parser.add_argument('--piece-length', type=int, default=512 * 1024)
+    parser.add_argument('--workers', default=None,
+                        help='Comma-separated worker counts (default: 1 up to the core count)')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if args.workers:
+        worker_counts = [int(workers) for workers in args.workers.split(',')]
+    else:
+        worker_counts = sorted({1, 2, 4, cores} & set(range(1, cores + 1)))
+    size = args.size << 20
+
+    out = sys.__stdout__
+    with tempfile.TemporaryDirectory() as directory:
+        metainfo, data = make_payload(directory, 'payload.bin', size, args.piece_length)
+        sys.stdout = io.StringIO()  # Silence the piece manager's progress output
+        print(f"recheck of {args.size} MiB, {cores} cores", file=out)
+        for workers in worker_counts:
+            rate = bench_recheck(metainfo, directory, workers, size)
+            print(f"  {workers:3d} workers: {rate:6.2f} GB/s  ({rate / min(workers, cores):.2f} GB/s per core)", file=out)
+
+        with tempfile.TemporaryDirectory() as download_directory:
+            pieces = min(64, size // args.piece_length)
+            median, inline = bench_completion(metainfo, download_directory, data, args.piece_length, pieces)
+        print(f"add_piece for the last block of a piece: {median * 1e6:.1f} us median "
+              f"(hashing the piece inline: {inline * 1e6:.1f} us)", file=out)
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
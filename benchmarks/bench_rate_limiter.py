@@ -0,0 +1,116 @@
+# bench_rate_limiter.py
+#
+# Checks the token bucket limiter: the cost of a reservation, the rate
+# achieved by several threads sharing one bucket, and the end-to-end rate of
+# a local transfer with --max-upload-speed / --max-download-speed applied.
+#
+#   python benchmarks/bench_rate_limiter.py --rate 2048 --seconds 4
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simple_tracker
+from bench_swarm import make_torrent
+from node_client import NodeClient
+from rate_limiter import TokenBucket, make_buckets, reserve
+
+BLOCK_SIZE = 16384
+
+
+def report(name, target, achieved):
+    error = (achieved - target) / target
+    print(f"{name:<44} {achieved / 1024:10.1f} KiB/s  ({error:+.2%})")
+
+
+def shared_bucket_rate(rate, seconds, threads, per_peer_rate=0):
+    bucket = TokenBucket(rate)
+    moved = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def worker(i):
+        buckets = make_buckets(bucket, per_peer_rate)
+        while time.monotonic() < deadline:
+            delay = reserve(buckets, BLOCK_SIZE)
+            if delay > 0:
+                time.sleep(delay)
+            moved[i] += BLOCK_SIZE
+
+    start = time.monotonic()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(moved) / (time.monotonic() - start)
+
+
+def transfer_rate(args, network, port, **limits):
+    # One seeder, one leecher; returns the leecher's download rate
+    directory = tempfile.mkdtemp(prefix='bench_rate_limiter_')
+    size = int(args.rate * 1024 * args.seconds)
+    # A torrent of its own per run, so peers from earlier runs cannot join
+    torrent_file, data = make_torrent(directory, f'payload{port}.bin', size, 256 * 1024,
+                                      f'http://127.0.0.1:{port}/announce')
+    threading.Thread(target=simple_tracker.run_tracker, kwargs={'port': port}, daemon=True).start()
+    time.sleep(0.5)
+    seeder = NodeClient(torrent_file, port + 1, directory, role='seeder', network=network,
+                        max_upload_speed=limits.get('upload', 0))
+    threading.Thread(target=seeder.start, daemon=True).start()
+    time.sleep(0.5)
+    leecher_directory = os.path.join(directory, 'leecher')
+    os.makedirs(leecher_directory)
+    leecher = NodeClient(torrent_file, port + 2, leecher_directory, network=network,
+                         max_download_speed=limits.get('download', 0))
+    threading.Thread(target=leecher.start, daemon=True).start()
+    while not (leecher.piece_manager and leecher.piece_manager.downloaded):
+        time.sleep(0.001)
+    # Measure from the first verified piece, after connection setup
+    start, first = time.monotonic(), leecher.piece_manager.downloaded
+    while not leecher.piece_manager.is_complete():
+        time.sleep(0.001)
+    return (leecher.piece_manager.downloaded - first) / (time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the token bucket rate limiter.')
+    parser.add_argument('--rate', type=float, default=2048, help='Target rate in KiB/s')
+    parser.add_argument('--seconds', type=float, default=4, help='Duration of each accuracy run')
+    parser.add_argument('--port', type=int, default=19500, help='First tracker port for the transfer runs')
+    args = parser.parse_args()
+    rate = args.rate * 1024
+
+    bucket = TokenBucket(1e12)
+    calls = 200000
+    seconds = timeit.timeit(lambda: bucket.reserve(BLOCK_SIZE), number=calls)
+    print(f"TokenBucket.reserve: {seconds / calls * 1e9:.0f} ns per call")
+
+    report("shared bucket, 1 thread", rate, shared_bucket_rate(rate, args.seconds, 1))
+    report("shared bucket, 8 threads", rate, shared_bucket_rate(rate, args.seconds, 8))
+    report("per-peer buckets (rate/4), 2 threads", rate / 2,
+           shared_bucket_rate(rate, args.seconds, 2, per_peer_rate=rate / 4))
+
+    # Keep the transfers local and quiet
+    NodeClient.get_external_ip = lambda self: '127.0.0.1'
+    simple_tracker.TrackerHandler.log_message = lambda *a: None
+    out = sys.stdout
+    port = args.port
+    for network in ('thread', 'asyncio'):
+        for direction in ('upload', 'download'):
+            sys.stdout = io.StringIO()  # Client output would drown the report
+            achieved = transfer_rate(args, network, port, **{direction: int(rate)})
+            sys.stdout = out
+            report(f"transfer, {network}, max {direction} speed", rate, achieved)
+            port += 10
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
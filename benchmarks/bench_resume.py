@@ -0,0 +1,113 @@
+# bench_resume.py
+#
+# Times NodeClient.load_torrent for a multi-file seeder: a full rehash
+# (--no-resume behaviour), a start from the resume file, and a start after
+# one file was modified. Also checks that a leecher's verified and partial
+# pieces survive a restart.
+#
+#   python benchmarks/bench_resume.py --size 256 --files 8
+
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bencodepy
+import hashlib
+from node_client import NodeClient
+from piece_manager import BLOCK_SIZE
+
+NodeClient.get_external_ip = lambda self: '127.0.0.1'
+
+
+def make_torrent(directory, name, size, files, piece_length):
+    # Files are written in the order PieceManager maps them (sorted paths)
+    root = os.path.join(directory, name)
+    os.makedirs(root)
+    rnd = random.Random(0)
+    file_length = size // files
+    entries = []
+    digest = b''
+    pending = b''
+    for i in range(files):
+        data = rnd.randbytes(file_length)
+        with open(os.path.join(root, f'file{i:03d}.bin'), 'wb') as f:
+            f.write(data)
+        entries.append({b'length': file_length, b'path': [f'file{i:03d}.bin'.encode('utf-8')]})
+        pending += data
+        while len(pending) >= piece_length:
+            digest += hashlib.sha1(pending[:piece_length]).digest()
+            pending = pending[piece_length:]
+    if pending:
+        digest += hashlib.sha1(pending).digest()
+    metainfo = {
+        b'announce': b'http://127.0.0.1:1/announce',
+        b'info': {b'name': name.encode('utf-8'), b'files': entries, b'piece length': piece_length, b'pieces': digest},
+    }
+    torrent_file = os.path.join(directory, name + '.torrent')
+    with open(torrent_file, 'wb') as f:
+        f.write(bencodepy.encode(metainfo))
+    return torrent_file
+
+
+def timed_load(torrent_file, directory, role, resume=True):
+    client = NodeClient(torrent_file, 0, directory, role=role, resume=resume)
+    started = time.perf_counter()
+    client.load_torrent(torrent_file)
+    return client, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fast-resume benchmark')
+    parser.add_argument('--size', type=int, default=256, help='Payload size in MiB')
+    parser.add_argument('--files', type=int, default=8, help='Number of files')
+    parser.add_argument('--piece-length', type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    out = sys.__stdout__
+    with tempfile.TemporaryDirectory() as directory:
+        torrent_file = make_torrent(directory, 'payload', args.size << 20, args.files, args.piece_length)
+        sys.stdout = io.StringIO()  # Silence the client's progress output
+
+        client, full = timed_load(torrent_file, directory, 'seeder', resume=False)
+        total = client.piece_manager.total_pieces
+        print(f"full rehash:         {full:8.3f} s  ({len(client.piece_manager.pieces)}/{total} pieces)", file=out)
+
+        timed_load(torrent_file, directory, 'seeder')  # Writes the resume file
+        client, resumed = timed_load(torrent_file, directory, 'seeder')
+        print(f"resume:              {resumed:8.3f} s  ({len(client.piece_manager.pieces)}/{total} pieces)", file=out)
+
+        # Change one file's mtime; only its pieces are hashed again
+        changed = client.piece_manager.storage.file_path(0)
+        os.utime(changed, ns=(time.time_ns(), time.time_ns()))
+        client, touched = timed_load(torrent_file, directory, 'seeder')
+        print(f"resume, 1 file changed: {touched:5.3f} s  ({len(client.piece_manager.pieces)}/{total} pieces)", file=out)
+
+        # Leecher restart: drop half the pieces and leave one piece half received
+        piece_manager = client.piece_manager
+        dropped = list(range(0, total, 2))
+        with piece_manager.lock:
+            for index in dropped:
+                piece_manager.pieces.discard(index)
+                piece_manager.missing_pieces.add(index)
+                piece_manager.missing_mask |= 1 << index
+                piece_manager.availability_index.add(index)
+        partial_index = dropped[0]
+        half = args.piece_length // 2
+        piece_manager.add_piece(partial_index, 0, piece_manager.storage.read(0, half))
+        client.resume_data.save()
+        client, leecher = timed_load(torrent_file, directory, 'leecher')
+        piece_manager = client.piece_manager
+        received = piece_manager.pieces_data_received.get(partial_index, 0)
+        print(f"leecher restart:     {leecher:8.3f} s  ({len(piece_manager.pieces)}/{total} pieces, "
+              f"{bin(received).count('1')}/{half // BLOCK_SIZE} blocks of piece {partial_index} kept)", file=out)
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# bench_swarm.py
+#
+# Runs a local swarm (tracker, one seeder and several leechers on 127.0.0.1)
+# and reports how long the leechers take to complete and how much of the data
+# they got from each other rather than from the seeder.
+#
+#   python benchmarks/bench_swarm.py --leechers 6 --size 16 --seed-rate 4
+#   python benchmarks/bench_swarm.py --leechers 6 --size 16 --seed-rate 4 --no-have
+#
+# Choking policies: tit-for-tat over N slots against unchoking everyone
+#
+#   python benchmarks/bench_swarm.py --leechers 12 --stagger 0 --leecher-rate 2 --upload-slots 4
+#   python benchmarks/bench_swarm.py --leechers 12 --stagger 0 --leecher-rate 2 --upload-slots 0
+#
+# Super-seeding: compare the seeder upload needed before the swarm has a full copy
+#
+#   python benchmarks/bench_swarm.py --leechers 6 --stagger 0 --leecher-rate 2 --super-seed
+
+import argparse
+import hashlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bencodepy
+import simple_tracker
+from node_client import NodeClient
+
+
+def make_torrent(directory, name, size, piece_length, announce):
+    data = random.Random(0).randbytes(size)
+    with open(os.path.join(directory, name), 'wb') as f:
+        f.write(data)
+    pieces = b''.join(hashlib.sha1(data[i:i + piece_length]).digest() for i in range(0, size, piece_length))
+    metainfo = {
+        b'announce': announce.encode('utf-8'),
+        b'info': {b'name': name.encode('utf-8'), b'length': size, b'piece length': piece_length, b'pieces': pieces},
+    }
+    torrent_file = os.path.join(directory, name + '.torrent')
+    with open(torrent_file, 'wb') as f:
+        f.write(bencodepy.encode(metainfo))
+    return torrent_file, data
+
+
+def check_finished(seeder, leechers, started, finished, full_copy):
+    # Record each leecher's download time, measured from its own start, and
+    # what the seeder had uploaded when the leechers first held a full copy
+    for i, leecher in enumerate(leechers):
+        if i not in finished and leecher.piece_manager and leecher.piece_manager.is_complete():
+            finished[i] = time.time() - started[i]
+    if not full_copy:
+        swarm_mask = 0
+        for leecher in leechers:
+            if leecher.piece_manager:
+                swarm_mask |= leecher.piece_manager.get_have_mask()
+        if swarm_mask == seeder.piece_manager.full_mask:
+            full_copy['seeder_uploaded'] = seeder.piece_manager.uploaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark swarm completion time on localhost.')
+    parser.add_argument('--leechers', type=int, default=6, help='Number of leechers')
+    parser.add_argument('--size', type=int, default=16, help='Payload size in MiB')
+    parser.add_argument('--piece-length', type=int, default=256 * 1024, help='Piece length in bytes')
+    parser.add_argument('--stagger', type=float, default=1.0, help='Seconds between leecher starts')
+    parser.add_argument('--seed-rate', type=float, default=4, help='Seeder upload rate in MiB/s (0 = unlimited)')
+    parser.add_argument('--leecher-rate', type=float, default=0, help='Leecher upload rate in MiB/s (0 = unlimited)')
+    parser.add_argument('--upload-slots', type=int, default=4, help='Unchoked peers per client (0 = unchoke all interested)')
+    parser.add_argument('--port', type=int, default=19000, help='Tracker port; peers use the ports above it')
+    parser.add_argument('--network', choices=['thread', 'asyncio'], default='thread', help='Networking core')
+    parser.add_argument('--timeout', type=float, default=300, help='Give up after this many seconds')
+    parser.add_argument('--super-seed', action='store_true', help='Run the seeder in super-seeding mode')
+    parser.add_argument('--no-have', action='store_true', help='Disable HAVE broadcasting for comparison')
+    args = parser.parse_args()
+
+    # Keep the run local and quiet
+    NodeClient.get_external_ip = lambda self: '127.0.0.1'
+    simple_tracker.TrackerHandler.log_message = lambda *a: None
+    if args.no_have:
+        NodeClient.broadcast_haves = lambda self: self.pending_haves.clear()
+
+    directory = tempfile.mkdtemp(prefix='bench_swarm_')
+    torrent_file, data = make_torrent(directory, 'payload.bin', args.size << 20, args.piece_length,
+                                      f'http://127.0.0.1:{args.port}/announce')
+
+    # Client output would drown the report
+    sys.stdout = io.StringIO()
+    threading.Thread(target=simple_tracker.run_tracker, kwargs={'port': args.port}, daemon=True).start()
+    time.sleep(0.5)
+    # Limit the seeder so it is the bottleneck and leechers have to share
+    seeder = NodeClient(torrent_file, args.port + 1, directory, role='seeder', network=args.network,
+                        max_upload_speed=int(args.seed_rate * (1 << 20)), upload_slots=args.upload_slots,
+                        super_seed=args.super_seed)
+    threading.Thread(target=seeder.start, daemon=True).start()
+    time.sleep(0.5)
+
+    leechers = []
+    started = []
+    finished = {}
+    full_copy = {}
+    for i in range(args.leechers):
+        leecher_directory = os.path.join(directory, f'leecher{i}')
+        os.makedirs(leecher_directory)
+        leecher = NodeClient(torrent_file, args.port + 2 + i, leecher_directory, network=args.network,
+                             max_upload_speed=int(args.leecher_rate * (1 << 20)), upload_slots=args.upload_slots)
+        leechers.append(leecher)
+        started.append(time.time())
+        threading.Thread(target=leecher.start, daemon=True).start()
+        # Poll completion while the remaining leechers join
+        deadline = time.time() + args.stagger
+        while time.time() < deadline:
+            check_finished(seeder, leechers, started, finished, full_copy)
+            time.sleep(0.01)
+    while len(finished) < len(leechers) and time.time() - started[0] < args.timeout:
+        check_finished(seeder, leechers, started, finished, full_copy)
+        time.sleep(0.01)
+    for leecher in leechers:
+        leecher.piece_manager.storage.flush()
+    report(directory, leechers, started, finished, data, args)
+    if full_copy:
+        uploaded = full_copy['seeder_uploaded']
+        print(f"seeder uploaded before the leechers held a full copy: {uploaded / (1 << 20):.1f} MiB "
+              f"({uploaded / len(data):.2f} copies)", file=sys.__stdout__)
+    os._exit(0)
+
+
+def report(directory, leechers, started, finished, data, args):
+    out = sys.__stdout__
+    total = len(data) * len(leechers)
+    from_leechers = sum(leecher.piece_manager.uploaded for leecher in leechers)
+    print(f"HAVE broadcast: {'off' if args.no_have else 'on'}, network: {args.network}, seeder upload: {args.seed_rate or 'unlimited'} MiB/s, "
+          f"leecher upload: {args.leecher_rate or 'unlimited'} MiB/s, upload slots: {args.upload_slots or 'all'}"
+          f"{', super-seeding' if args.super_seed else ''}", file=out)
+    for i, leecher in enumerate(leechers):
+        path = os.path.join(directory, f'leecher{i}', 'payload.bin')
+        with open(path, 'rb') as f:
+            ok = f.read() == data
+        elapsed = finished.get(i)
+        status = f"{elapsed:7.2f} s" if elapsed is not None else "    timeout"
+        print(f"leecher {i}: {status}  {'ok' if ok else 'CORRUPT'}  haves sent {leecher.haves_sent}", file=out)
+    if len(finished) == len(leechers):
+        print(f"mean download time: {sum(finished.values()) / len(finished):.2f} s", file=out)
+        print(f"swarm completion: {max(started[i] + finished[i] for i in finished) - started[0]:.2f} s", file=out)
+    print(f"served by leechers: {from_leechers / total:.1%} of {total >> 20} MiB downloaded", file=out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# bench_tracker.py
+#
+# Tracker announce throughput. Times the TrackerState core (O(1) upsert and
+# expiry) against the old linear peer list, measures memory per peer, then
+# runs simple_tracker.py in a subprocess and drives it over HTTP with a
+# multi-process load generator using keep-alive connections. --slow-client
+# also holds one connection open mid-request, which stalls every announce
+# on a single-threaded server.
+#
+#   python benchmarks/bench_tracker.py --peers 100000 --torrents 1000
+#   python benchmarks/bench_tracker.py --clients 8 --duration 5 --slow-client
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tracker_state import TrackerState
+
+SERVERS = {
+    'threaded': "import simple_tracker; simple_tracker.run_tracker(port={port})",
+    # The previous server: single-threaded HTTP/1.0, one connection per announce
+    'single': ("import http.server, simple_tracker\n"
+               "simple_tracker.TrackerHandler.protocol_version = 'HTTP/1.0'\n"
+               "class Server(http.server.HTTPServer):\n"
+               "    def __init__(self, address, handler):\n"
+               "        super().__init__(address, handler)\n"
+               "        self.state = simple_tracker.TrackerState()\n"
+               "simple_tracker.run_tracker(server_class=Server, port={port})"),
+}
+
+
+def bench_core(peers, torrents):
+    rnd = random.Random(0)
+    announces = [(f'torrent{rnd.randrange(torrents)}', f'peer{i}', '10.0.0.1', 6881) for i in range(peers)]
+
+    # Old simple_tracker: one list of dicts, searched with `not in`, for a tenth of the peers
+    old_peers = []
+    count = peers // 10
+    started = time.perf_counter()
+    for info_hash, peer_id, ip, port in announces[:count]:
+        peer = {'ip': ip, 'port': port, 'peer_id': peer_id}
+        if peer not in old_peers:
+            old_peers.append(peer)
+    old_rate = count / (time.perf_counter() - started)
+
+    state = TrackerState()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for info_hash, peer_id, ip, port in announces:
+        state.announce(info_hash, peer_id, ip, port, left=1)
+    new_rate = peers / (time.perf_counter() - started)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Re-announces of existing peers, then everything expiring at once
+    started = time.perf_counter()
+    for info_hash, peer_id, ip, port in announces:
+        state.announce(info_hash, peer_id, ip, port, left=0)
+    upsert_rate = peers / (time.perf_counter() - started)
+    started = time.perf_counter()
+    state.announce('torrent0', 'late', '10.0.0.2', 6881, now=time.time() + state.peer_timeout + 1)
+    expire_time = time.perf_counter() - started
+
+    print(f"core, {peers} peers in {torrents} torrents")
+    print(f"  old list, first {count} peers: {old_rate:12.0f} announces/s")
+    print(f"  new peers:                    {new_rate:12.0f} announces/s")
+    print(f"  re-announces:                 {upsert_rate:12.0f} announces/s")
+    print(f"  memory:                       {memory / peers:12.0f} bytes per peer")
+    print(f"  expiring {state.expired} peers:     {expire_time * 1e3:12.1f} ms")
+
+
+def load_client(port, torrents, duration, seed, results):
+    rnd = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    deadline = time.time() + duration
+    done = 0
+    while time.time() < deadline:
+        query = urllib.parse.urlencode({
+            'info_hash': f'torrent{rnd.randrange(torrents)}', 'peer_id': f'peer{seed}-{rnd.randrange(50)}',
+            'port': 6881, 'left': rnd.randrange(2), 'uploaded': 0, 'downloaded': 0,
+        })
+        connection.request('GET', '/announce?' + query)
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            done += 1
+    results.put(done)
+
+
+def cpu_time(pid):
+    # User + system CPU seconds of a process (Linux only; None elsewhere)
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def wait_for_port(port):
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"tracker on port {port} did not start")
+
+
+def bench_http(server, port, clients, torrents, duration, slow_client):
+    tracker = subprocess.Popen([sys.executable, '-c', SERVERS[server].format(port=port)], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        slow = None
+        if slow_client:
+            # Half a request line, never finished
+            slow = socket.create_connection(('127.0.0.1', port))
+            slow.sendall(b'GET /announce?info_hash=')
+        cpu_before = cpu_time(tracker.pid)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=load_client, args=(port, torrents, duration, seed, results))
+                   for seed in range(clients)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(duration + 10)
+        done = sum(results.get(timeout=1) for worker in workers if worker.exitcode == 0)
+        cpu_after = cpu_time(tracker.pid)
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        if slow is not None:
+            slow.close()
+        line = f"  {server:<9} {clients} clients{' + slow client' if slow_client else ''}: {done / duration:8.0f} announces/s"
+        if cpu_before is not None and done:
+            # The load generator shares the machine, so also report what one
+            # announce costs the tracker itself
+            per_announce = (cpu_after - cpu_before) / done
+            line += f", {per_announce * 1e6:5.0f} us tracker CPU each ({1 / per_announce:6.0f}/s per core)"
+        print(line)
+    finally:
+        tracker.terminate()
+        tracker.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tracker benchmark')
+    parser.add_argument('--peers', type=int, default=100000, help='Peers for the core benchmark')
+    parser.add_argument('--torrents', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=8, help='Load generator processes')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=19700)
+    parser.add_argument('--slow-client', action='store_true')
+    args = parser.parse_args()
+
+    bench_core(args.peers, args.torrents)
+    print(f"HTTP, {os.cpu_count()} cores")
+    for offset, server in enumerate(SERVERS):
+        bench_http(server, args.port + offset, args.clients, args.torrents, args.duration, args.slow_client)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# bench_tracker_peers.py
+#
+# Announce response size and build time by swarm size: the old response
+# (every other peer as a dict) against a numwant sample as dicts and in
+# compact (BEP 23) form through simple_tracker.announce_response, which
+# serves the swarm's cached blob when every other peer fits in numwant,
+# otherwise joins the sampled peers' cached entries, and formats the
+# response around them. 'encoded' builds the same compact sample and bencodes the response;
+# 'churn' has one peer join and one leave before every compact announce.
+#
+#   python benchmarks/bench_tracker_peers.py --sizes 10,100,1000,10000,100000
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bencodepy
+from simple_tracker import announce_response
+from tracker_state import TrackerState
+
+
+def old_response(state, info_hash, peer_id, ip, port):
+    # Previous simple_tracker: register, then list every other peer
+    state.announce(info_hash, peer_id, ip, port, left=1, numwant=0)
+    swarm = state.swarms[info_hash]
+    return bencodepy.encode({
+        b'interval': state.interval,
+        b'peers': [{'ip': peer.ip.encode('utf-8'), 'port': peer.port}
+                   for peer in swarm.peers.values() if peer.peer_id != peer_id],
+    })
+
+
+def encoded_compact_response(state, info_hash, peer_id, ip, port, numwant):
+    peers, complete, incomplete = state.announce(info_hash, peer_id, ip, port, left=1, numwant=numwant)
+    return bencodepy.encode({
+        b'interval': state.interval,
+        b'complete': complete,
+        b'incomplete': incomplete,
+        b'peers': b''.join(peer.compact for peer in peers),
+    })
+
+
+def churn_response(state, query, churn):
+    # Keep the swarm size constant: one new peer joins, the previous one leaves
+    n = next(churn)
+    state.announce('torrent', f'churn{n}', '10.255.0.1', 6881, left=1)
+    state.announce('torrent', f'churn{n - 1}', '10.255.0.1', 6881, event='stopped')
+    return announce_response(state, query, '10.0.0.0')
+
+
+def timed(function, repeat):
+    function()  # Warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = function()
+    return len(body), (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tracker response size benchmark')
+    parser.add_argument('--sizes', default='10,100,1000,10000,100000', help='Comma-separated swarm sizes')
+    parser.add_argument('--numwant', type=int, default=50)
+    args = parser.parse_args()
+
+    # A compact 'stopped' for a torrent the tracker no longer knows (e.g. after
+    # a restart) must still get a well-formed response
+    body = announce_response(TrackerState(), {'info_hash': ['gone'], 'peer_id': ['peer0'], 'port': ['6881'],
+                                              'event': ['stopped'], 'compact': ['1']}, '10.0.0.0')
+    assert bencodepy.decode(body)[b'peers'] == b'', body
+
+    print(f"{'swarm':>8} {'response':<14} {'bytes':>10} {'latency':>12}")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        state = TrackerState()
+        for i in range(size):
+            state.announce('torrent', f'peer{i}', f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', 6881, left=1)
+        repeat = max(20, 20000 // size)
+        query = {'info_hash': ['torrent'], 'peer_id': ['peer0'], 'port': ['6881'], 'left': ['1'],
+                 'numwant': [str(args.numwant)]}
+        compact_query = dict(query, compact=['1'])
+        churn = itertools.count(1)
+        cases = [
+            ('all, dict', lambda: old_response(state, 'torrent', 'peer0', '10.0.0.0', 6881)),
+            (f'{args.numwant}, dict', lambda: announce_response(state, query, '10.0.0.0')),
+            (f'{args.numwant}, encoded', lambda: encoded_compact_response(state, 'torrent', 'peer0', '10.0.0.0', 6881,
+                                                                     args.numwant)),
+            (f'{args.numwant}, compact', lambda: announce_response(state, compact_query, '10.0.0.0')),
+            (f'{args.numwant}, churn', lambda: churn_response(state, compact_query, churn)),
+        ]
+        for name, function in cases:
+            nbytes, latency = timed(function, repeat)
+            print(f"{size:8d} {name:<14} {nbytes:10d} {latency * 1e6:10.1f}us")
+
+
+if __name__ == '__main__':
+    main()
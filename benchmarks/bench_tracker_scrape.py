@@ -0,0 +1,71 @@
+# bench_tracker_scrape.py
+#
+# Scrape cost by registry size: simple_tracker.scrape_response, which reads
+# the counters announce keeps up to date, against counting one torrent's
+# seeders and leechers by walking the peer dict. Also times a multi-hash
+# scrape and an announce, which is what a dashboard polled before.
+#
+#   python benchmarks/bench_tracker_scrape.py --sizes 1000,10000,100000,1000000
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_tracker import announce_response, scrape_response
+from tracker_state import TrackerState
+
+TORRENTS = 100
+
+
+def walk_counts(state, info_hash):
+    # Without counters: look at every registered peer
+    seeders = leechers = 0
+    for (peer_hash, _), peer in state.peers.items():
+        if peer_hash == info_hash:
+            if peer.seeding:
+                seeders += 1
+            else:
+                leechers += 1
+    return seeders, leechers
+
+
+def timed(function, repeat):
+    function()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tracker scrape benchmark')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='Comma-separated peer counts')
+    parser.add_argument('--hashes', type=int, default=50, help='Info hashes in the multi-hash scrape')
+    args = parser.parse_args()
+
+    print(f"{'peers':>8} {'case':<22} {'latency':>12}")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        state = TrackerState()
+        for i in range(size):
+            state.announce(f'torrent{i % TORRENTS}', f'peer{i}', f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+                           6881, left=i % 3, event='completed' if i % 3 == 0 else None)
+        query = {'info_hash': ['torrent0']}
+        many = {'info_hash': [f'torrent{i % TORRENTS}' for i in range(args.hashes)]}
+        announce = {'info_hash': ['torrent0'], 'peer_id': ['peer0'], 'port': ['6881'], 'left': ['0'],
+                    'compact': ['1']}
+        repeat = max(5, 200000 // size)
+        cases = [
+            ('walk peers, 1 hash', lambda: walk_counts(state, 'torrent0')),
+            ('scrape, 1 hash', lambda: scrape_response(state, query)),
+            (f'scrape, {args.hashes} hashes', lambda: scrape_response(state, many)),
+            ('announce (polling)', lambda: announce_response(state, announce, '10.0.0.0')),
+        ]
+        for name, function in cases:
+            print(f"{size:8d} {name:<22} {timed(function, repeat) * 1e6:10.1f}us")
+
+
+if __name__ == '__main__':
+    main()
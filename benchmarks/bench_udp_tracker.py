@@ -0,0 +1,139 @@
+# bench_udp_tracker.py
+#
+# Per-announce cost of the HTTP and UDP (BEP 15) trackers. Runs
+# simple_tracker.py with its UDP endpoint in a subprocess and drives it with
+# multi-process load generators: 'http' announces the way NodeClient did,
+# one requests.get (and so one TCP connection) per announce; 'keep-alive'
+# reuses an HTTP/1.1 connection; 'udp' uses UDPTrackerClient, which reuses
+# its connection ID for a minute. Reports tracker CPU per announce and IP
+# bytes per announce (Linux /proc counters for this network namespace, so
+# TCP handshakes, ACKs and headers are included; run on an idle host).
+#
+#   python benchmarks/bench_udp_tracker.py --clients 4 --duration 5
+#   python benchmarks/bench_udp_tracker.py --torrents 10 --numwant 50
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests
+from udp_tracker import UDPTrackerClient
+from bench_tracker import cpu_time, wait_for_port
+
+SERVER = "import simple_tracker; simple_tracker.run_tracker(port={port}, udp_port={port})"
+
+
+def ip_octets():
+    # Bytes received by IP in this network namespace (Linux only; None elsewhere)
+    try:
+        with open('/proc/net/netstat') as f:
+            lines = [line.split() for line in f if line.startswith('IpExt:')]
+    except OSError:
+        return None
+    names, values = lines[0], lines[1]
+    return int(values[names.index('InOctets')])
+
+
+def announce_args(rnd, seed, torrents):
+    info_hash = f'torrent{rnd.randrange(torrents)}'.ljust(20).encode('latin-1')
+    peer_id = f'peer{seed}-{rnd.randrange(50)}'.ljust(20).encode('latin-1')
+    return info_hash, peer_id, rnd.randrange(2)
+
+
+def load_client(mode, port, torrents, numwant, duration, seed, results):
+    rnd = random.Random(seed)
+    url = f'http://127.0.0.1:{port}/announce'
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    udp = UDPTrackerClient(f'udp://127.0.0.1:{port}', timeout=1)
+    deadline = time.time() + duration
+    done = 0
+    while time.time() < deadline:
+        info_hash, peer_id, left = announce_args(rnd, seed, torrents)
+        if mode == 'udp':
+            udp.announce(info_hash, peer_id, 6881, 0, left, 0, numwant=numwant)
+            done += 1
+            continue
+        params = {'info_hash': info_hash, 'peer_id': peer_id, 'port': 6881, 'uploaded': 0, 'downloaded': 0,
+                  'left': left, 'compact': 1, 'numwant': numwant}
+        if mode == 'http':
+            status = requests.get(url, params=params).status_code
+        else:
+            connection.request('GET', '/announce?' + urllib.parse.urlencode(params))
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        if status == 200:
+            done += 1
+    results.put(done)
+
+
+def bench_mode(mode, tracker, port, clients, torrents, numwant, duration):
+    cpu_before = cpu_time(tracker.pid)
+    octets_before = ip_octets()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=load_client,
+                                       args=(mode, port, torrents, numwant, duration, seed, results))
+               for seed in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(duration + 10)
+    done = sum(results.get(timeout=1) for worker in workers if worker.exitcode == 0)
+    cpu_after = cpu_time(tracker.pid)
+    octets_after = ip_octets()
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+    line = f"  {mode:<10} {done / duration:8.0f} announces/s"
+    cpu = bytes_each = None
+    if done and cpu_before is not None:
+        cpu = (cpu_after - cpu_before) / done
+        line += f", {cpu * 1e6:6.1f} us tracker CPU each"
+    if done and octets_before is not None:
+        bytes_each = (octets_after - octets_before) / done
+        line += f", {bytes_each:6.0f} IP bytes each"
+    print(line)
+    return cpu, bytes_each
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP vs UDP tracker benchmark')
+    parser.add_argument('--clients', type=int, default=4, help='Load generator processes')
+    parser.add_argument('--torrents', type=int, default=1000)
+    parser.add_argument('--numwant', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=19800)
+    args = parser.parse_args()
+
+    tracker = subprocess.Popen([sys.executable, '-c', SERVER.format(port=args.port)], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+        print(f"{args.clients} clients, {args.torrents} torrents, numwant {args.numwant}, {os.cpu_count()} cores")
+        costs = {mode: bench_mode(mode, tracker, args.port, args.clients, args.torrents, args.numwant,
+                                  args.duration)
+                 for mode in ('http', 'keep-alive', 'udp')}
+    finally:
+        tracker.terminate()
+        tracker.wait()
+    udp_cpu, udp_bytes = costs['udp']
+    for mode in ('http', 'keep-alive'):
+        cpu, bytes_each = costs[mode]
+        if cpu and udp_cpu:
+            print(f"  udp vs {mode}: {cpu / udp_cpu:5.1f}x less CPU", end='')
+            if bytes_each and udp_bytes:
+                print(f", {bytes_each / udp_bytes:5.1f}x fewer bytes", end='')
+            print()
+
+
+if __name__ == '__main__':
+    main()
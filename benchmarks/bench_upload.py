@@ -0,0 +1,95 @@
+# bench_upload.py
+#
+# Compares the old copy-based PIECE upload path against the mmap + sendmsg
+# path used by PeerConnection.send_piece.
+#
+#   python benchmarks/bench_upload.py --size 256
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import FileStorage
+
+BLOCK_SIZE = 16384
+MESSAGE_PIECE = 7
+
+
+def drain(sock, total):
+    buffer = bytearray(1 << 20)
+    received = 0
+    while received < total:
+        n = sock.recv_into(buffer)
+        if not n:
+            break
+        received += n
+
+
+def copy_path(sock, storage, piece_length, total_length):
+    # Equivalent of the previous send_piece: read the block, concatenate
+    # header and payload, then sendall.
+    for offset in range(0, total_length, BLOCK_SIZE):
+        index, begin = divmod(offset, piece_length)
+        block = storage.read(offset, BLOCK_SIZE)
+        payload = struct.pack('!II', index, begin) + block
+        msg = struct.pack('!I', 1 + len(payload)) + struct.pack('!B', MESSAGE_PIECE) + payload
+        sock.sendall(msg)
+
+
+def zero_copy_path(sock, storage, piece_length, total_length):
+    for offset in range(0, total_length, BLOCK_SIZE):
+        index, begin = divmod(offset, piece_length)
+        header = struct.pack('!IBII', 9 + BLOCK_SIZE, MESSAGE_PIECE, index, begin)
+        buffers = [memoryview(header)] + storage.get_buffers(offset, BLOCK_SIZE)
+        while buffers:
+            sent = sock.sendmsg(buffers)
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and sent:
+                buffers[0] = buffers[0][sent:]
+
+
+def run(name, sender, storage, piece_length, total_length):
+    a, b = socket.socketpair()
+    blocks = total_length // BLOCK_SIZE
+    receiver = threading.Thread(target=drain, args=(b, total_length + blocks * 13))
+    receiver.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    sender(a, storage, piece_length, total_length)
+    receiver.join()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    a.close()
+    b.close()
+    mb = total_length / (1 << 20)
+    print(f"{name:<10} {mb / elapsed:8.1f} MB/s  {cpu * 1000 / mb:6.2f} ms CPU per MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PIECE upload path.')
+    parser.add_argument('--size', type=int, default=256, help='Payload size in MiB')
+    parser.add_argument('--piece-length', type=int, default=524288, help='Piece length in bytes')
+    args = parser.parse_args()
+
+    total_length = args.size << 20
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'payload.bin'), 'wb') as f:
+            f.truncate(total_length)
+        mappings = [{'path': ['payload.bin'], 'length': total_length, 'offset': 0}]
+        storage = FileStorage(mappings, directory)
+        run('copy', copy_path, storage, args.piece_length, total_length)
+        run('zero-copy', zero_copy_path, storage, args.piece_length, total_length)
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# bitfield.py
+#
+# Helpers for holding peer bitfields as Python ints, with bit i set when the
+# peer has piece i. Wire bitfields are MSB-first per byte, so bytes are
+# bit-reversed with a translation table before converting.
+
+REVERSE_BITS = bytes(int(f'{byte:08b}'[::-1], 2) for byte in range(256))
+
+# Positions of the set bits of every byte value, least significant first
+SET_BITS = [tuple(bit for bit in range(8) if (byte >> bit) & 1) for byte in range(256)]
+
+
+def bitfield_to_mask(bitfield, total_pieces):
+    mask = int.from_bytes(bytes(bitfield).translate(REVERSE_BITS), 'little')
+    # Spare bits past the last piece must be ignored
+    return mask & ((1 << total_pieces) - 1)
+
+
+def mask_to_bitfield(mask, total_pieces):
+    return mask.to_bytes((total_pieces + 7) // 8, 'little').translate(REVERSE_BITS)
+
+
+def iter_set_bits(mask, total_pieces):
+    # Walk the mask a byte at a time, skipping empty bytes
+    for byte_index, byte in enumerate(mask.to_bytes((total_pieces + 7) // 8, 'little')):
+        if byte:
+            base = byte_index * 8
+            for bit in SET_BITS[byte]:
+                yield base + bit
@@ -3,42 +3,115 @@
 import os
 import bencodepy
 import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from piece_manager import HASH_WORKERS
 
-def create_torrent(directory_path, tracker_url, torrent_path):
+MIN_PIECE_LENGTH = 16 * 1024  # One block
+MAX_PIECE_LENGTH = 16 * 1024 * 1024
+TARGET_PIECES = 1500  # Aim for about this many pieces when choosing a piece length
+
+
+def choose_piece_length(total_length):
+    """
+    Smallest power of two that keeps the torrent at or below TARGET_PIECES
+    pieces, clamped to [MIN_PIECE_LENGTH, MAX_PIECE_LENGTH].
+    """
+    piece_length = MIN_PIECE_LENGTH
+    while piece_length < MAX_PIECE_LENGTH and piece_length * TARGET_PIECES < total_length:
+        piece_length *= 2
+    return piece_length
+
+
+def get_files(directory_path):
+    """
+    Return (file path, path components, length) for every file under
+    directory_path, in the order PieceManager.create_file_mappings lays them
+    out: sorted by the os.sep-joined path including the torrent name.
+    """
+    name = os.path.basename(os.path.normpath(directory_path))
     files = []
-    total_length = 0
+    for root, dirs, filenames in os.walk(directory_path):
+        for filename in filenames:
+            filepath = os.path.join(root, filename)
+            components = os.path.relpath(filepath, directory_path).split(os.sep)
+            files.append((filepath, components, os.path.getsize(filepath)))
+    files.sort(key=lambda file: os.sep.join([name] + file[1]))
+    return files
+
+
+def read_pieces(files, piece_length):
+    """
+    Yield the payload in piece-sized chunks, reading the files in order and
+    across file boundaries. Each chunk is a new buffer, so it can be hashed
+    while the next one is read.
+    """
+    buffer = bytearray(piece_length)
+    view = memoryview(buffer)
+    filled = 0
+    for filepath, components, length in files:
+        remaining = length
+        with open(filepath, 'rb') as f:
+            while remaining:
+                nbytes = f.readinto(view[filled:filled + min(remaining, piece_length - filled)])
+                if not nbytes:
+                    break
+                filled += nbytes
+                remaining -= nbytes
+                if filled == piece_length:
+                    yield buffer
+                    buffer = bytearray(piece_length)
+                    view = memoryview(buffer)
+                    filled = 0
+        if remaining:
+            raise ValueError(f"File {filepath} changed size while hashing")
+    if filled:
+        yield view[:filled]
+
+
+def hash_pieces(files, piece_length, workers=HASH_WORKERS):
+    """
+    SHA-1 every piece in a thread pool (hashlib releases the GIL) while the
+    next pieces are read. At most 2 * workers pieces are in flight, so
+    memory use does not depend on the payload size.
+    """
+    digests = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk in read_pieces(files, piece_length):
+            if len(pending) >= 2 * workers:
+                digests.append(pending.popleft().result())
+            pending.append(pool.submit(lambda data: hashlib.sha1(data).digest(), chunk))
+        while pending:
+            digests.append(pending.popleft().result())
+    return b''.join(digests)
+
+
+def create_torrent(directory_path, tracker_url, torrent_path, piece_length=None, workers=HASH_WORKERS):
+    name = os.path.basename(os.path.normpath(directory_path))
 
     # Handle single and multi-file torrents
     if os.path.isdir(directory_path):
-        for root, dirs, filenames in os.walk(directory_path):
-            for filename in filenames:
-                filepath = os.path.join(root, filename)
-                file_info = {
-                    b'length': os.path.getsize(filepath),
-                    b'path': [component.encode('utf-8') for component in os.path.relpath(filepath, directory_path).split(os.sep)]
-                }
-                files.append(file_info)
-                total_length += file_info[b'length']
+        files = get_files(directory_path)
     else:
-        file_info = {
-            b'length': os.path.getsize(directory_path),
-            b'name': os.path.basename(directory_path).encode('utf-8')
-        }
-        total_length = file_info[b'length']
+        files = [(directory_path, [name], os.path.getsize(directory_path))]
+    total_length = sum(length for filepath, components, length in files)
+    if piece_length is None:
+        piece_length = choose_piece_length(total_length)
 
     info = {
-        b'name': os.path.basename(directory_path).encode('utf-8'),
-        b'piece length': 524288,  # 512 KiB
+        b'name': name.encode('utf-8'),
+        b'piece length': piece_length,
+        b'pieces': hash_pieces(files, piece_length, workers),
     }
-
-    if files:
-        info[b'files'] = files
+    if os.path.isdir(directory_path):
+        info[b'files'] = [{
+            b'length': length,
+            b'path': [component.encode('utf-8') for component in components]
+        } for filepath, components, length in files]
     else:
         info[b'length'] = total_length
 
-    # Compute piece hashes
-    # Implement piece hashing logic here if needed
-
     torrent = {
         b'announce': tracker_url.encode('utf-8'),
         b'info': info
@@ -46,7 +119,10 @@ def create_torrent(directory_path, tracker_url, torrent_path):
 
     with open(torrent_path, 'wb') as tf:
         tf.write(bencodepy.encode(torrent))
-    print(f"Torrent file created at {torrent_path}")
+    print(f"Torrent file created at {torrent_path} ({len(files)} files, {total_length} bytes, "
+          f"{len(info[b'pieces']) // 20} pieces of {piece_length} bytes)")
+    return torrent
+
 
 if __name__ == '__main__':
     import argparse
@@ -55,6 +131,9 @@ if __name__ == '__main__':
     parser.add_argument('directory', help='Directory or file to create torrent from')
     parser.add_argument('tracker', help='Tracker URL (e.g., http://localhost:8000/announce)')
     parser.add_argument('output', help='Output torrent file path')
+    parser.add_argument('--piece-length', type=int, default=None,
+                        help='Piece length in bytes (default: chosen from the total size)')
+    parser.add_argument('--workers', type=int, default=HASH_WORKERS, help='Hashing threads')
 
     args = parser.parse_args()
-    create_torrent(args.directory, args.tracker, args.output)
+    create_torrent(args.directory, args.tracker, args.output, args.piece_length, args.workers)
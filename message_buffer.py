@@ -0,0 +1,111 @@
+# message_buffer.py
+
+import struct
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+MAX_MESSAGE_LENGTH = 1 << 24  # Refuse messages larger than 16 MiB
+
+
+class MessageBuffer:
+    """
+    Receive buffer for length-prefixed peer wire messages.
+
+    Data is read straight into a preallocated bytearray with recv_into and
+    every complete message already in the buffer is parsed per read. Payloads
+    are handed out as memoryviews into the buffer, so they are only valid
+    until the next read; callers that keep a payload must copy it.
+    """
+
+    def __init__(self, size=DEFAULT_BUFFER_SIZE):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0  # First unconsumed byte
+        self.end = 0  # End of received data
+        self.recv_calls = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, needed):
+        """
+        Make sure at least `needed` bytes of unconsumed data fit in the buffer
+        and return the writable tail.
+        """
+        if self.start and (self.end == len(self.data) or self.start + needed > len(self.data)):
+            # Move the unconsumed tail (less than one message) to the front;
+            # same-length slice assignment never resizes the bytearray
+            pending = len(self)
+            self.data[:pending] = bytes(self.view[self.start:self.end])
+            self.start = 0
+            self.end = pending
+        if needed > len(self.data) or self.end == len(self.data):
+            # Views of the old buffer may still be alive, so never resize in place
+            data = bytearray(max(needed, 2 * len(self.data)))
+            data[:self.end] = self.view[:self.end]
+            self.data = data
+            self.view = memoryview(data)
+        return self.view[self.end:]
+
+    def get_buffer(self):
+        return self.reserve(self.pending_message_length())
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+
+    def recv_into(self, sock):
+        nbytes = sock.recv_into(self.get_buffer())
+        self.recv_calls += 1
+        if not nbytes:
+            raise Exception("Connection closed")
+        self.end += nbytes
+        return nbytes
+
+    def pending_message_length(self):
+        # Bytes needed to complete the next message (at least one more byte)
+        if len(self) < 4:
+            return 4
+        length = struct.unpack_from('!I', self.data, self.start)[0]
+        if length > MAX_MESSAGE_LENGTH:
+            raise Exception(f"Message length {length} exceeds limit")
+        return 4 + length
+
+    def read_exact(self, sock, n):
+        """
+        Read exactly n bytes (e.g. the handshake), keeping any extra data for
+        the messages that follow.
+        """
+        while len(self) < n:
+            self.reserve(n)
+            nbytes = sock.recv_into(self.view[self.end:])
+            self.recv_calls += 1
+            if not nbytes:
+                raise Exception("Connection closed")
+            self.end += nbytes
+        return self.take(n)
+
+    def take(self, n):
+        chunk = self.view[self.start:self.start + n]
+        self.start += n
+        return chunk
+
+    def messages(self):
+        """
+        Yield (msg_id, payload) for every complete message in the buffer;
+        keep-alives yield (None, None).
+        """
+        while len(self) >= 4:
+            length = struct.unpack_from('!I', self.data, self.start)[0]
+            if length > MAX_MESSAGE_LENGTH:
+                raise Exception(f"Message length {length} exceeds limit")
+            if len(self) < 4 + length:
+                return
+            if length == 0:
+                self.start += 4
+                yield None, None
+                continue
+            msg_id = self.data[self.start + 4]
+            payload = self.view[self.start + 5:self.start + 4 + length]
+            self.start += 4 + length
+            yield msg_id, payload
+        if self.start == self.end:
+            self.start = self.end = 0
@@ -8,22 +8,50 @@ import os
 import random
 import string
 from piece_manager import PieceManager
-from peer_connection import PeerConnection
+from peer_connection import PeerConnection, MAX_PIPELINE_DEPTH
+from async_network import AsyncNetwork
+from rate_limiter import TokenBucket
+from super_seeder import SuperSeeder
+from resume_data import ResumeData
+from udp_tracker import UDPTrackerClient
 import bencodepy
 import hashlib
 import sys
-from queue import PriorityQueue, Empty
-import urllib.parse  # Added for URL encoding
+
+AVAILABILITY_CHECK_INTERVAL = 30  # Seconds between availability consistency checks
+HAVE_BATCH_DELAY = 0.05  # Seconds to collect finished pieces into one HAVE batch
+REQUEST_TIMEOUT_CHECK_INTERVAL = 1.0  # Seconds between block deadline checks
+UPLOAD_SLOTS = 4  # Peers unchoked at a time, including the optimistic unchoke
+CHOKE_INTERVAL = 10  # Seconds between choker rounds
+OPTIMISTIC_UNCHOKE_ROUNDS = 3  # Rotate the optimistic unchoke every third round (30 s)
+RESUME_SAVE_INTERVAL = 30  # Seconds between fast-resume saves while downloading
+DEFAULT_ANNOUNCE_INTERVAL = 1800  # Seconds between tracker announces unless the tracker says otherwise
+NUMWANT = 50  # Peers to ask the tracker for per announce
 
 class NodeClient:
-    def __init__(self, torrent_file, listen_port, download_directory, max_download_speed=0, max_upload_speed=0, verbose=False, role='leecher'):
+    def __init__(self, torrent_file, listen_port, download_directory, max_download_speed=0, max_upload_speed=0, verbose=False, role='leecher',
+                 max_pipeline_depth=MAX_PIPELINE_DEPTH, network='thread', max_peer_download_speed=0, max_peer_upload_speed=0,
+                 upload_slots=UPLOAD_SLOTS, super_seed=False, resume=True):
         self.torrent_file = torrent_file
         self.listen_port = listen_port
         self.download_directory = download_directory
         self.max_download_speed = max_download_speed  # Bytes per second
         self.max_upload_speed = max_upload_speed      # Bytes per second
+        self.max_peer_download_speed = max_peer_download_speed  # Per connection, bytes per second
+        self.max_peer_upload_speed = max_peer_upload_speed
+        # Client-wide token buckets shared by every connection (None = unlimited)
+        self.download_bucket = TokenBucket(max_download_speed) if max_download_speed else None
+        self.upload_bucket = TokenBucket(max_upload_speed) if max_upload_speed else None
         self.verbose = verbose
         self.role = role  # 'seeder' or 'leecher'
+        self.max_pipeline_depth = max_pipeline_depth  # Upper bound on outstanding block requests per peer
+        self.network = network  # 'thread' (one thread per peer) or 'asyncio' (single event loop)
+        self.upload_slots = upload_slots  # 0 unchokes every interested peer
+        self.super_seed = super_seed  # Offer pieces one at a time when seeding from scratch (BEP 16)
+        self.super_seeder = None
+        self.resume = resume  # Keep a fast-resume file next to the payload
+        self.resume_data = None
+        self.async_network = None
 
         self.running = True
         self.peers = []
@@ -34,15 +62,39 @@ class NodeClient:
         self.piece_manager = None
         self.connected_peers = []
         self.connected_peer_addresses = set()  # Track connected peer addresses as (ip, port) tuples
-        self.request_queue = PriorityQueue()  # PriorityQueue to manage Rarest First
-        self.request_lock = threading.Lock()  # To synchronize access to the request queue
         self.piece_hashes = []
 
         # Lock for thread safety when modifying connected_peers and connected_peer_addresses
         self.lock = threading.Lock()
 
+        # Verified pieces waiting to be announced to connected peers with HAVE
+        self.pending_haves = []
+        self.have_lock = threading.Lock()
+        self.have_event = threading.Event()
+        self.haves_sent = 0
+        self.haves_suppressed = 0
+        self.cancels_sent = 0  # Endgame CANCELs for blocks that arrived elsewhere
+        self.request_timeouts = 0  # Block requests that missed their deadline
+
+        # Choker state: the optimistically unchoked peer, timed rounds so far
+        # and per-peer (time, bytes downloaded, bytes uploaded) at the last round
+        self.choke_lock = threading.Lock()
+        self.choke_event = threading.Event()
+        self.optimistic_unchoke = None
+        self.choke_rounds = 0
+        self.choke_snapshots = {}
+
+        # Availability consistency checks: number run, counts found wrong on
+        # the last check and counts repaired in total
+        self.availability_checks = 0
+        self.availability_drift = 0
+        self.availability_repairs = 0
+
         # Tracker URL (Assuming it's in the .torrent file)
         self.tracker_url = None
+        self.udp_tracker = None  # Set for udp:// announce URLs
+        # Re-announce this often so the tracker does not expire us
+        self.announce_interval = DEFAULT_ANNOUNCE_INTERVAL
 
         # External IP
         self.external_ip = self.get_external_ip()
@@ -68,10 +120,33 @@ class NodeClient:
             return
 
         # Start listening for peers (both seeders and leechers)
-        threading.Thread(target=self.listen_for_peers, daemon=True).start()
+        if self.network == 'asyncio':
+            self.async_network = AsyncNetwork(self)
+            self.async_network.start()
+            self.listen_for_peers()
+        else:
+            threading.Thread(target=self.listen_for_peers, daemon=True).start()
+
+        # Announce verified pieces to connected peers
+        threading.Thread(target=self.broadcast_haves_loop, daemon=True).start()
+
+        # Tit-for-tat choking over a fixed number of upload slots
+        if self.upload_slots:
+            threading.Thread(target=self.choker_loop, daemon=True).start()
+
+        # Re-queue block requests that miss their deadline
+        threading.Thread(target=self.request_timeout_loop, daemon=True).start()
+
+        # Periodically verify availability against the connected peers
+        threading.Thread(target=self.availability_check_loop, daemon=True).start()
+
+        # Keep the resume file current so a restart skips the full rehash
+        if self.resume_data is not None:
+            threading.Thread(target=self.resume_save_loop, daemon=True).start()
 
         # Announce to tracker
         self.announce_to_tracker(event='started')
+        threading.Thread(target=self.announce_loop, daemon=True).start()
 
         # Start main loop
         self.main_loop()
@@ -93,6 +168,8 @@ class NodeClient:
 
         # Extract tracker URL
         self.tracker_url = self.metainfo.get(b'announce').decode('utf-8')
+        if self.tracker_url.startswith('udp://'):
+            self.udp_tracker = UDPTrackerClient(self.tracker_url)
 
         # Calculate info_hash and extract piece hashes
         info = self.metainfo[b'info']
@@ -101,27 +178,50 @@ class NodeClient:
         pieces = self.metainfo[b'info'][b'pieces']
         self.piece_hashes = [pieces[i:i + 20] for i in range(0, len(pieces), 20)]
 
-        self.piece_manager = PieceManager(self.metainfo, self.download_directory, verbose=self.verbose)
+        self.piece_manager = PieceManager(self.metainfo, self.download_directory, verbose=self.verbose,
+                                          on_piece_verified=self.on_piece_verified)
         self.piece_manager.piece_hashes = self.piece_hashes
 
         # Construct the file path for the shared file/directory
         file_name = self.metainfo[b'info'][b'name'].decode('utf-8')
         file_path = os.path.join(self.download_directory, file_name)
+        if self.resume:
+            resume_path = os.path.join(self.download_directory, f".{file_name}.resume")
+            self.resume_data = ResumeData(self.piece_manager, self.info_hash, resume_path)
 
         if os.path.exists(file_path):
             print(f"{self.role.capitalize()}: File {file_path} exists locally. Loading pieces...")
-            self.piece_manager.load_pieces_from_file(self.download_directory)
-            self.piece_manager.initialize_piece_availability()  # Initialize own pieces
+            # Only pieces in files changed since the resume file was saved
+            # are hashed; without resume data every piece is
+            recheck = self.resume_data.load() if self.resume_data is not None else None
+            self.piece_manager.load_pieces_from_file(recheck)
+            if self.resume_data is not None:
+                self.save_resume_data()
+            if self.super_seed and self.role == 'seeder' and self.piece_manager.is_complete():
+                self.super_seeder = SuperSeeder(self.piece_manager, verbose=self.verbose)
+                print("Super-seeding enabled.")
         else:
             if self.role == 'seeder':
                 print(f"Seeder: File {file_path} does not exist locally. Cannot seed.")
                 return False
             else:
                 print(f"Leecher: File {file_path} does not exist locally. Starting download...")
+                self.piece_manager.storage.allocate()
         return True
 
     def listen_for_peers(self):
+        if self.async_network is not None:
+            try:
+                self.async_network.listen(self.listen_port)
+                if self.verbose:
+                    print(f"Listening for peers on port {self.listen_port}...")
+            except Exception as e:
+                print(f"Failed to bind to port {self.listen_port}: {e}")
+            return
+
         try:
+            # Allow rebinding while connections from a previous run are in TIME_WAIT
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind(('', self.listen_port))
             self.server_socket.listen(5)
             if self.verbose:
@@ -136,46 +236,67 @@ class NodeClient:
                 if self.verbose:
                     print(f"Accepted connection from {addr}")
                 peer_conn = PeerConnection.from_incoming(client_socket, self.piece_manager, self.peer_id, self.info_hash, self, verbose=self.verbose)
-                peer_conn.start()
+                # Register before starting so a connection that fails at once
+                # cannot remove itself before it was added
                 with self.lock:
                     self.connected_peers.append(peer_conn)
+                peer_conn.start()
                 # Note: Peer ID is not known yet; will be updated after handshake
             except Exception as e:
                 if self.verbose:
                     print(f"Error accepting connections: {e}")
 
     def announce_to_tracker(self, event):
-        # URL-encode info_hash and peer_id
-        encoded_info_hash = urllib.parse.quote_from_bytes(self.info_hash)
-        encoded_peer_id = urllib.parse.quote(self.peer_id)
+        # requests URL-encodes the raw info_hash bytes exactly once
         params = {
-            'info_hash': encoded_info_hash,
-            'peer_id': encoded_peer_id,
+            'info_hash': self.info_hash,
+            'peer_id': self.peer_id,
             'port': self.listen_port,
             'uploaded': self.piece_manager.uploaded,
             'downloaded': self.piece_manager.downloaded,
-            'left': self.piece_manager.total_length - self.piece_manager.downloaded,
-            'event': event
+            'left': self.piece_manager.bytes_left(),
+            'event': event,
+            'compact': 1,
+            'numwant': NUMWANT
         }
         try:
-            response = requests.get(self.tracker_url, params=params)
-            if response.status_code == 200:
+            if self.udp_tracker is not None:
+                # BEP 15: two small datagrams instead of an HTTP request
+                data = self.udp_tracker.announce(self.info_hash, self.peer_id.encode('utf-8'), self.listen_port,
+                                                 self.piece_manager.downloaded, self.piece_manager.bytes_left(),
+                                                 self.piece_manager.uploaded, event, NUMWANT)
+            else:
+                response = requests.get(self.tracker_url, params=params)
+                if response.status_code != 200:
+                    print(f"Tracker announce failed with status code {response.status_code}.")
+                    return
                 data = bencodepy.decode(response.content)
-                peers = data.get(b'peers')
-                if isinstance(peers, list):
-                    # Dictionary model
-                    self.peers = [{'ip': peer[b'ip'].decode('utf-8'), 'port': peer[b'port']} for peer in peers]
-                else:
-                    # Binary model (compact representation)
-                    self.peers = self.parse_compact_peers(peers)
-                if self.verbose:
-                    print(f"Received {len(self.peers)} peers from tracker.")
-                    print(f"{self.role.capitalize()} received peers: {self.peers}")
+            if b'failure reason' in data:
+                print(f"Tracker refused announce: {data[b'failure reason'].decode('utf-8', 'replace')}")
+                return
+            interval = data.get(b'interval')
+            if isinstance(interval, int) and interval > 0:
+                self.announce_interval = interval
+            peers = data.get(b'peers')
+            if isinstance(peers, list):
+                # Dictionary model
+                self.peers = [{'ip': peer[b'ip'].decode('utf-8'), 'port': peer[b'port']} for peer in peers]
             else:
-                print(f"Tracker announce failed with status code {response.status_code}.")
+                # Binary model (compact representation)
+                self.peers = self.parse_compact_peers(peers)
+            if self.verbose:
+                print(f"Received {len(self.peers)} peers from tracker.")
+                print(f"{self.role.capitalize()} received peers: {self.peers}")
         except Exception as e:
             print(f"Error announcing to tracker: {e}")
 
+    def announce_loop(self):
+        # Regular announces (no event) keep our tracker entry alive
+        while self.running:
+            time.sleep(self.announce_interval)
+            if self.running:
+                self.announce_to_tracker(event=None)
+
     def parse_compact_peers(self, peers_binary):
         peers = []
         for i in range(0, len(peers_binary), 6):
@@ -190,9 +311,6 @@ class NodeClient:
             while self.running:
                 time.sleep(10)  # Keep the seeder running
         else:
-            # Initialize the request queue with rarest pieces first
-            threading.Thread(target=self.populate_request_queue, daemon=True).start()
-
             # Start connecting to peers
             threading.Thread(target=self.connect_to_peers_loop, daemon=True).start()
 
@@ -205,7 +323,8 @@ class NodeClient:
             if self.piece_manager.is_complete():
                 print("\nDownload complete.")
                 # Reconstruct the files
-                self.piece_manager.reconstruct_files(self.download_directory)
+                self.piece_manager.reconstruct_files()
+                self.save_resume_data()
                 self.announce_to_tracker(event='completed')
                 print(f"Downloaded: {self.piece_manager.downloaded} bytes")
                 print(f"Uploaded: {self.piece_manager.uploaded} bytes")
@@ -215,17 +334,32 @@ class NodeClient:
                 while self.running:
                     time.sleep(10)  # Keep the seeder running
 
-    def populate_request_queue(self):
-        while not self.piece_manager.is_complete() and self.running:
-            with self.piece_manager.lock:
-                rarest_pieces = self.piece_manager.get_rarest_pieces()
-                for index in rarest_pieces:
-                    if index not in self.piece_manager.requested_pieces and index not in self.piece_manager.pieces:
-                        priority = self.piece_manager.piece_availability[index]
-                        self.request_queue.put((priority, index))
-                        if self.verbose:
-                            print(f"Added piece {index} with priority {priority} to the request queue.")
-            time.sleep(5)
+    def stop(self):
+        self.running = False
+        if self.async_network is not None:
+            self.async_network.stop()
+        self.save_resume_data()
+        if self.piece_manager is not None:
+            self.announce_to_tracker(event='stopped')
+            # Queued write-back data would be lost with the writer thread
+            try:
+                self.piece_manager.storage.close()
+            except Exception as e:
+                print(f"Failed to write downloaded data: {e}")
+
+    def resume_save_loop(self):
+        while self.running:
+            time.sleep(RESUME_SAVE_INTERVAL)
+            if self.running and (self.piece_manager.pieces_data_received or self.resume_data.is_dirty()):
+                self.save_resume_data()
+
+    def save_resume_data(self):
+        if self.resume_data is None:
+            return
+        try:
+            self.resume_data.save()
+        except Exception as e:
+            print(f"Failed to save resume data: {e}")
 
     def connect_to_peers_loop(self):
         while self.running and not self.piece_manager.is_complete():
@@ -253,42 +387,217 @@ class NodeClient:
             if self.verbose:
                 print(f"Connecting to peer {ip}:{port}")
             try:
+                if self.async_network is not None:
+                    # The connection registers itself once established
+                    with self.lock:
+                        self.connected_peer_addresses.add(peer_address)
+                    self.async_network.connect(ip, port)
+                    continue
                 peer_conn = PeerConnection(ip, port, self.piece_manager, self.peer_id, self.info_hash, self, verbose=self.verbose)
-                peer_conn.start()
                 with self.lock:
                     self.connected_peers.append(peer_conn)
                     self.connected_peer_addresses.add(peer_address)
+                peer_conn.start()
                 if self.verbose:
                     print(f"Connected to peer {ip}:{port}")
             except Exception as e:
                 if self.verbose:
                     print(f"Failed to connect to peer {ip}:{port} - {e}")
 
-    def request_piece_from_rarest(self):
-        try:
-            priority, piece_index = self.request_queue.get(timeout=10)
-            with self.request_lock:
-                if piece_index in self.piece_manager.requested_pieces or piece_index in self.piece_manager.pieces:
-                    if self.verbose:
-                        print(f"Piece {piece_index} already requested or downloaded. Skipping.")
-                    return None  # Already requested or downloaded
-                self.piece_manager.requested_pieces.add(piece_index)
-                if self.verbose:
-                    print(f"Requesting piece {piece_index} with priority {priority}.")
-                return piece_index
-        except Empty:
-            if self.verbose:
-                print("Request queue is empty. No pieces to request.")
-            return None  # No pieces available to request
+    def request_piece_from_rarest(self, peer_mask=None):
+        # Rarest-first selection straight from the piece manager's
+        # availability index; no queue to populate or drain
+        piece_index = self.piece_manager.pick_piece(peer_mask)
+        if self.verbose:
+            if piece_index is None:
+                print("No pieces available to request.")
+            else:
+                print(f"Requesting piece {piece_index} with availability {self.piece_manager.get_availability(piece_index)}.")
+        return piece_index
+
+    def request_timeout_loop(self):
+        while self.running and not self.piece_manager.is_complete():
+            time.sleep(REQUEST_TIMEOUT_CHECK_INTERVAL)
+            self.expire_requests()
+
+    def expire_requests(self):
+        """
+        Re-queue block requests that stalled past their per-peer deadline,
+        then let the other peers refill their pipelines so the blocks are fetched
+        again (disconnects release their blocks in on_connection_closed).
+        """
+        with self.lock:
+            peers = list(self.connected_peers)
+        now = time.time()
+        expired = 0
+        stalled = set()
+        for peer in peers:
+            count = peer.expire_requests(now)
+            if count:
+                expired += count
+                stalled.add(peer)
+        if stalled:
+            self.request_timeouts += expired
+            # Only peers that are keeping up are woken, so the blocks do not go
+            # straight back to the peer that stalled on them
+            for peer in peers:
+                if peer.running and peer not in stalled:
+                    peer.wake()
+        return expired
+
+    def manage_choking(self, peer):
+        # A peer's interest changed: unchoke it at once if a slot is free,
+        # or give its slot back to the choker
+        with self.choke_lock:
+            if peer.peer_interested:
+                if peer.am_choking and self.count_unchoked() < self.upload_slots:
+                    peer.set_choking(False)
+                return
+            peer.set_choking(True)
+        self.choke_event.set()
+
+    def count_unchoked(self):
+        with self.lock:
+            return sum(1 for peer in self.connected_peers if not peer.am_choking and peer.running)
+
+    def choker_loop(self):
+        while self.running:
+            # Re-evaluate every CHOKE_INTERVAL, or early when a slot is freed
+            woken = self.choke_event.wait(CHOKE_INTERVAL)
+            self.choke_event.clear()
+            if not woken:
+                self.choke_rounds += 1
+            self.rechoke(rotate_optimistic=not woken and self.choke_rounds % OPTIMISTIC_UNCHOKE_ROUNDS == 0,
+                         new_round=not woken)
+
+    def rechoke(self, rotate_optimistic=False, new_round=True):
+        """
+        Unchoke the interested peers we download from fastest (or upload to
+        fastest once seeding), plus one optimistic unchoke, and choke the
+        rest.
+        """
+        now = time.time()
+        with self.lock:
+            peers = [peer for peer in self.connected_peers if peer.running]
+        seeding = self.piece_manager.is_complete()
+        rates = {}
+        snapshots = {}
+        for peer in peers:
+            last_time, last_downloaded, last_uploaded = self.choke_snapshots.get(peer, (now - CHOKE_INTERVAL, 0, 0))
+            transferred = peer.bytes_uploaded - last_uploaded if seeding else peer.bytes_downloaded - last_downloaded
+            rates[peer] = transferred / max(now - last_time, 1e-3)
+            snapshots[peer] = (now, peer.bytes_downloaded, peer.bytes_uploaded)
+        if new_round:
+            self.choke_snapshots = snapshots
+
+        # Fastest first; on equal rates keep currently unchoked peers
+        interested = sorted((peer for peer in peers if peer.peer_interested),
+                            key=lambda peer: (rates[peer], not peer.am_choking), reverse=True)
+        regular_slots = self.upload_slots - 1 if self.upload_slots > 1 else self.upload_slots
+        unchoke = set(interested[:regular_slots])
+        if self.upload_slots > 1:
+            optimistic = self.optimistic_unchoke
+            if rotate_optimistic or optimistic not in interested or optimistic in unchoke:
+                candidates = [peer for peer in interested if peer not in unchoke]
+                optimistic = random.choice(candidates) if candidates else None
+                self.optimistic_unchoke = optimistic
+            if optimistic is not None:
+                unchoke.add(optimistic)
+
+        with self.choke_lock:
+            for peer in peers:
+                peer.set_choking(peer not in unchoke)
+        if self.verbose:
+            print(f"Choker: unchoked {len(unchoke)} of {len(interested)} interested peers"
+                  f" ({'seeding' if seeding else 'leeching'})")
+
+    def cancel_block(self, piece_index, begin, source):
+        # Endgame: a block arrived from `source`, cancel it at every other peer
+        with self.lock:
+            peers = [peer for peer in self.connected_peers if peer is not source]
+        for peer in peers:
+            if peer.cancel_request(piece_index, begin):
+                self.cancels_sent += 1
+
+    def on_piece_verified(self, piece_index, valid):
+        # Called from the piece manager's hash pool
+        if valid:
+            self.notify_piece_downloaded(piece_index)
 
     def notify_piece_downloaded(self, piece_index):
-        with self.request_lock:
-            # Update piece availability since a new peer now has this piece
-            self.piece_manager.piece_availability[piece_index] += 1
-            if self.verbose:
-                print(f"Piece {piece_index} is now available with availability {self.piece_manager.piece_availability[piece_index]}.")
-            # Re-populate the queue as piece availability might have changed
-            # This might be redundant if 'populate_request_queue' is running continuously
+        # Availability only counts connected peers, so our own pieces are not
+        # added to it; a verified piece has already left the availability index
+        if self.verbose:
+            print(f"Piece {piece_index} downloaded and verified.")
+        # Queue a HAVE for every connected peer
+        with self.have_lock:
+            self.pending_haves.append(piece_index)
+        self.have_event.set()
+
+    def broadcast_haves_loop(self):
+        while self.running:
+            self.have_event.wait()
+            # Give pieces finishing together a moment to share one batch
+            time.sleep(HAVE_BATCH_DELAY)
+            self.have_event.clear()
+            self.broadcast_haves()
+
+    def broadcast_haves(self):
+        with self.have_lock:
+            piece_indices = self.pending_haves
+            self.pending_haves = []
+        if not piece_indices:
+            return
+        with self.lock:
+            peers = list(self.connected_peers)
+        for peer in peers:
+            sent = peer.send_haves(piece_indices)
+            self.haves_sent += sent
+            self.haves_suppressed += len(piece_indices) - sent
+
+    def availability_check_loop(self):
+        while self.running:
+            time.sleep(AVAILABILITY_CHECK_INTERVAL)
+            self.check_availability()
+
+    def check_availability(self):
+        """
+        Compare the piece manager's availability counts against the pieces of
+        the peers that are actually connected, repairing any drift.
+        """
+        # Holding self.lock keeps the peer list fixed while counting
+        with self.lock:
+            drift = self.piece_manager.check_availability(list(self.connected_peers))
+        self.availability_checks += 1
+        self.availability_drift = drift
+        if drift:
+            self.availability_repairs += drift
+            print(f"Availability drifted on {drift} pieces; recounted from {len(self.connected_peers)} connected peers.")
+        return drift
+
+    def get_metrics(self):
+        """
+        Scheduler metrics. The request queue is the piece manager's
+        availability index, which holds each wanted piece at most once, so
+        its depth is bounded by the number of pieces.
+        """
+        piece_manager = self.piece_manager
+        with piece_manager.lock:
+            return {
+                'queue_depth': len(piece_manager.availability_index),
+                'pieces_in_progress': len(piece_manager.requested_pieces),
+                'picks': piece_manager.picks,
+                'endgame': piece_manager.endgame,
+                'endgame_requests': piece_manager.endgame_requests,
+                'cancels_sent': self.cancels_sent,
+                'request_timeouts': self.request_timeouts,
+                'redundant_bytes': piece_manager.redundant_bytes,
+                'haves_sent': self.haves_sent,
+                'haves_suppressed': self.haves_suppressed,
+                'availability_checks': self.availability_checks,
+                'availability_drift': self.availability_drift,
+                'availability_repairs': self.availability_repairs,
+            }
 
     def display_statistics(self):
         previous_downloaded = 0
@@ -302,5 +611,7 @@ class NodeClient:
             previous_downloaded = downloaded
             previous_uploaded = uploaded
             progress = (len(self.piece_manager.pieces) / self.piece_manager.total_pieces) * 100
-            print(f"\rProgress: {progress:.2f}% | Downloaded: {downloaded} bytes ({download_speed} B/s) | Uploaded: {uploaded} bytes ({upload_speed} B/s)", end='')
+            metrics = self.get_metrics()
+            print(f"\rProgress: {progress:.2f}% | Downloaded: {downloaded} bytes ({download_speed} B/s) | Uploaded: {uploaded} bytes ({upload_speed} B/s)"
+                  f" | Queue: {metrics['queue_depth']}", end='')
         print("\nDownload statistics display terminated.")
@@ -6,6 +6,10 @@ import struct
 import socket
 import sys
 import time
+from piece_manager import BLOCK_SIZE
+from message_buffer import MessageBuffer
+from rate_limiter import make_buckets, reserve
+from bitfield import bitfield_to_mask, mask_to_bitfield
 
 MESSAGE_CHOKE = 0
 MESSAGE_UNCHOKE = 1
@@ -17,9 +21,30 @@ MESSAGE_REQUEST = 6
 MESSAGE_PIECE = 7
 MESSAGE_CANCEL = 8
 
-class PeerConnection(threading.Thread):
-    def __init__(self, ip, port, piece_manager, peer_id, info_hash, client, sock=None, is_incoming=False, verbose=False):
-        super().__init__()
+# Per-peer request pipeline (number of outstanding block requests)
+INITIAL_PIPELINE_DEPTH = 4
+MIN_PIPELINE_DEPTH = 2
+MAX_PIPELINE_DEPTH = 128
+MIN_RTT = 0.005  # Floor for RTT estimates, in seconds
+
+# Block request deadlines, in seconds
+INITIAL_BLOCK_TIMEOUT = 10.0  # Until the peer has delivered a block
+MIN_BLOCK_TIMEOUT = 2.0
+MAX_BLOCK_TIMEOUT = 60.0
+MAX_TIMEOUT_BACKOFF = 8
+
+PROTOCOL_NAME = b'BitTorrent protocol'
+HANDSHAKE_LENGTH = 49 + len(PROTOCOL_NAME)  # 68 bytes
+KEEP_ALIVE_INTERVAL = 120  # Send keep-alive every 2 minutes
+
+class PeerProtocol:
+    """
+    Transport-independent part of the peer wire protocol: handshake
+    validation, message handling, request pipelining and choking state.
+    Subclasses provide send_message/send_buffers and drive the connection.
+    """
+
+    def __init__(self, ip, port, piece_manager, peer_id, info_hash, client, is_incoming=False, verbose=False):
         self.ip = ip
         self.port = port
         self.piece_manager = piece_manager
@@ -28,188 +53,154 @@ class PeerConnection(threading.Thread):
         self.client = client
         self.is_incoming = is_incoming
         self.running = True
-        self.buffer = b''
-        self.bitfield = b''
+        self.receive_buffer = MessageBuffer()
+        # Bit mask of the pieces the peer has, kept in step with the piece
+        # manager's availability counts (see PieceManager.add_peer_bitfield)
+        self.peer_pieces = 0
+        self.peer_is_seed = False  # Counted in PieceManager.seed_count rather than per piece
         self.remote_peer_id = None  # Store remote peer_id
+        # Pieces we have told the peer about (BITFIELD and HAVE); announcing
+        # starts once the handshake is complete
+        self.announced_pieces = 0
+        self.announcing = False
+        self.announce_lock = threading.Lock()
         self.am_choking = True
         self.am_interested = False
         self.peer_choking = True
         self.peer_interested = False
         self.verbose = verbose
 
-        if not self.is_incoming:
-            if sock is None:
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            else:
-                self.socket = sock
-        else:
-            self.socket = sock
-
-    @classmethod
-    def from_incoming(cls, client_socket, piece_manager, peer_id, info_hash, client, verbose=False):
-        ip, port = client_socket.getpeername()
-        return cls(ip, port, piece_manager, peer_id, info_hash, client, sock=client_socket, is_incoming=True, verbose=verbose)
+        # Block request pipeline
+        self.outstanding_requests = {}  # (piece_index, begin) -> time the request was sent
+        self.max_pipeline_depth = getattr(client, 'max_pipeline_depth', MAX_PIPELINE_DEPTH)
+        self.pipeline_depth = min(INITIAL_PIPELINE_DEPTH, self.max_pipeline_depth)
+        self.min_rtt = None
+        self.download_rate = 0.0  # Smoothed bytes per second received from this peer
+        self.rate_window_start = time.time()
+        self.rate_window_bytes = 0
+        # Block bytes exchanged with this peer, sampled by the client's choker
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        # Rate limits charged by this connection (client-wide and per-peer buckets)
+        self.upload_buckets = make_buckets(getattr(client, 'upload_bucket', None), getattr(client, 'max_peer_upload_speed', 0))
+        self.download_buckets = make_buckets(getattr(client, 'download_bucket', None), getattr(client, 'max_peer_download_speed', 0))
+        # Block round-trip estimate (RFC 6298 style) for request deadlines
+        self.srtt = None
+        self.rttvar = None
+        self.timeout_backoff = 1  # Doubled on each timeout, reset by a delivered block
+        self.request_timeouts = 0
+
+    def build_handshake(self):
+        return struct.pack('!B', len(PROTOCOL_NAME)) + PROTOCOL_NAME + b'\x00' * 8 + self.info_hash + self.peer_id.encode('utf-8')
+
+    def check_handshake(self, data):
+        if len(data) < HANDSHAKE_LENGTH:
+            raise Exception("Invalid handshake message")
+        received_pstrlen = data[0]
+        received_info_hash = data[1 + received_pstrlen + 8:1 + received_pstrlen + 8 + 20]
+        received_peer_id = bytes(data[1 + received_pstrlen + 8 + 20:HANDSHAKE_LENGTH]).decode('utf-8', errors='ignore')
+
+        if received_info_hash != self.info_hash:
+            raise Exception("Info hash does not match")
+        self.remote_peer_id = received_peer_id
+        if self.verbose:
+            print(f"Connected to peer {self.ip}:{self.port} with peer_id {self.remote_peer_id}")
+
+    def on_handshake_complete(self):
+        super_seeder = self.client.super_seeder
+        if super_seeder is not None and super_seeder.active:
+            # Super-seeding: no BITFIELD, pieces are offered one at a time
+            with self.announce_lock:
+                self.announcing = True
+            super_seeder.on_handshake_complete(self)
+            return
+        # Send our BITFIELD after handshake. Pieces verified before this point
+        # are in the BITFIELD, later ones are announced with HAVE
+        with self.announce_lock:
+            have_mask = self.piece_manager.get_have_mask()
+            if have_mask:
+                self.send_message(MESSAGE_BITFIELD, mask_to_bitfield(have_mask, self.piece_manager.total_pieces))
+                if self.verbose:
+                    print(f"Sent BITFIELD to peer {self.ip}:{self.port}")
+            self.announced_pieces = have_mask
+            self.announcing = True
+        # After handshake, update interest state
+        self.update_interest()
 
-    def run(self):
-        try:
-            self.perform_handshake()
-            self.communicate()
-        except Exception as e:
-            if self.verbose:
-                print(f"Connection error with peer {self.ip}:{self.port} - {e}")
-        finally:
-            self.socket.close()
-            # Remove the peer from the connected peers list
+    def on_connection_closed(self):
+        self.running = False
+        self.release_requests()
+        # The peer no longer counts towards availability
+        self.piece_manager.remove_peer(self)
+        if self.client.super_seeder is not None:
+            self.client.super_seeder.on_connection_closed(self)
+        # Remove the peer from the connected peers list
+        with self.client.lock:
             if self in self.client.connected_peers:
                 self.client.connected_peers.remove(self)
             # Remove from connected_peer_addresses to allow reconnections
             self.client.connected_peer_addresses.discard((self.ip, self.port))
-            if self.verbose:
-                print(f"Connection with peer {self.ip}:{self.port} closed.")
-
-    def perform_handshake(self):
-        pstr = 'BitTorrent protocol'
-        pstrlen = len(pstr)
-        reserved = b'\x00' * 8
-        handshake_msg = struct.pack('!B', pstrlen) + pstr.encode('utf-8') + reserved + self.info_hash + self.peer_id.encode('utf-8')
-
-        if not self.is_incoming:
-            if self.verbose:
-                print(f"Outgoing connection to {self.ip}:{self.port}")
-            self.socket.connect((self.ip, self.port))
-            self.socket.sendall(handshake_msg)
-            if self.verbose:
-                print(f"Sent handshake to {self.ip}:{self.port}")
-            response = self.recvall(68)  # Handshake message is 68 bytes
-            if len(response) < 68:
-                raise Exception("Invalid handshake response")
-            received_pstrlen = response[0]
-            received_pstr = response[1:1 + received_pstrlen]
-            received_info_hash = response[1 + pstrlen + 8:1 + pstrlen + 8 + 20]
-            received_peer_id = response[1 + pstrlen + 8 + 20:].decode('utf-8', errors='ignore')
-
-            if received_info_hash != self.info_hash:
-                raise Exception("Info hash does not match")
-            self.remote_peer_id = received_peer_id
-            if self.verbose:
-                print(f"Connected to peer {self.ip}:{self.port} with peer_id {self.remote_peer_id}")
-
-            # Send BITFIELD
-            bitfield = self.piece_manager.get_bitfield()
-            if bitfield:
-                self.send_message(MESSAGE_BITFIELD, bitfield)
-                if self.verbose:
-                    print(f"Sent BITFIELD to peer {self.ip}:{self.port}")
-
-        else:
-            if self.verbose:
-                print(f"Incoming connection from {self.ip}:{self.port}")
-            data = self.recvall(68)
-            if len(data) < 68:
-                raise Exception("Invalid handshake message")
-            received_pstrlen = data[0]
-            received_pstr = data[1:1 + received_pstrlen]
-            received_info_hash = data[1 + received_pstrlen + 8:1 + received_pstrlen + 8 + 20]
-            received_peer_id = data[1 + received_pstrlen + 8 + 20:].decode('utf-8', errors='ignore')
-
-            if received_info_hash != self.info_hash:
-                raise Exception("Info hash does not match")
-            self.remote_peer_id = received_peer_id
-
-            # Send handshake back
-            try:
-                self.socket.sendall(handshake_msg)
-                if self.verbose:
-                    print(f"Sent handshake to peer {self.ip}:{self.port}")
-            except Exception as e:
-                raise Exception(f"Failed to send handshake: {e}")
-
-            # Receive BITFIELD
-            msg_id, payload = self.receive_message()
-            if msg_id == MESSAGE_BITFIELD:
-                self.bitfield = payload
-                self.piece_manager.update_piece_availability(self.bitfield)
-                if self.verbose:
-                    print(f"Received BITFIELD from peer {self.ip}:{self.port}.")
-
-        # Send our BITFIELD after handshake
-        bitfield = self.piece_manager.get_bitfield()
-        if bitfield:
-            self.send_message(MESSAGE_BITFIELD, bitfield)
-            if self.verbose:
-                print(f"Sent BITFIELD to peer {self.ip}:{self.port}")
-
-    def keep_alive(self):
-        while self.running:
-            time.sleep(120)  # Send keep-alive every 2 minutes
-            try:
-                self.socket.sendall(struct.pack('!I', 0))
-                if self.verbose:
-                    print(f"Sent keep-alive to {self.ip}:{self.port}")
-            except Exception as e:
+        if self.verbose:
+            print(f"Connection with peer {self.ip}:{self.port} closed.")
+
+    def send_haves(self, piece_indices):
+        """
+        Announce newly verified pieces with HAVE, skipping pieces the peer
+        already has or was already told about. All HAVEs go out in one write.
+        Returns the number of HAVE messages sent.
+        """
+        with self.announce_lock:
+            if not self.announcing or not self.running:
+                return 0
+            known = self.announced_pieces | self.peer_pieces
+            haves = []
+            for index in piece_indices:
+                bit = 1 << index
+                if not known & bit:
+                    known |= bit
+                    self.announced_pieces |= bit
+                    haves.append(struct.pack('!IBI', 5, MESSAGE_HAVE, index))
+            if haves:
+                try:
+                    self.send_buffers([b''.join(haves)])
+                except Exception as e:
+                    if self.verbose:
+                        print(f"Failed to send HAVE to {self.ip}:{self.port} - {e}")
+                    self.running = False
+                    return 0
                 if self.verbose:
-                    print(f"Error sending keep-alive to {self.ip}:{self.port} - {e}")
-                break
+                    print(f"Sent {len(haves)} HAVE messages to {self.ip}:{self.port}")
+        # The new pieces may leave nothing of interest at this peer
+        self.update_interest()
+        return len(haves)
 
-    def communicate(self):
-        # Start a thread to send keep-alive messages if needed
-        threading.Thread(target=self.keep_alive, daemon=True).start()
+    def send_message(self, msg_id, payload=b''):
+        raise NotImplementedError
 
-        # After handshake, update interest state
-        self.update_interest()
+    def send_buffers(self, buffers):
+        raise NotImplementedError
 
-        while self.running:
-            try:
-                msg_id, payload = self.receive_message()
-                if msg_id is None:
-                    continue  # Keep-alive
-                self.handle_message(msg_id, payload)
-            except Exception as e:
-                if self.verbose:
-                    print(f"Error in communication with peer {self.ip}:{self.port} - {e}")
-                break
+    def send_buffers_after(self, delay, buffers, block=None):
+        # Send once an upload rate limit allows it; block is the
+        # (piece_index, begin, length) being uploaded, if any
+        raise NotImplementedError
 
-    def send_message(self, msg_id, payload=b''):
-        try:
-            # Implement upload speed limiting if needed
-            msg_length = 1 + len(payload)
-            msg = struct.pack('!I', msg_length) + struct.pack('!B', msg_id) + payload
-            self.socket.sendall(msg)
-            if self.verbose:
-                print(f"Sent message ID {msg_id} to {self.ip}:{self.port}")
-        except Exception as e:
-            if self.verbose:
-                print(f"Failed to send message ID {msg_id} to {self.ip}:{self.port} - {e}")
-            self.running = False
+    def cancel_upload(self, piece_index, begin):
+        # Drop a block still waiting for the upload rate limit. Threaded
+        # connections send each block before reading the next message, so
+        # they never have one queued
+        pass
 
-    def receive_message(self):
-        length_bytes = self.recvall(4)
-        if not length_bytes:
-            raise Exception("Connection closed")
-        length = struct.unpack('!I', length_bytes)[0]
-        if length == 0:
-            # Keep-alive message
-            return None, None
-        msg_id_bytes = self.recvall(1)
-        if not msg_id_bytes:
-            raise Exception("Connection closed")
-        msg_id = struct.unpack('!B', msg_id_bytes)[0]
-        payload_length = length - 1
-        payload = self.recvall(payload_length) if payload_length > 0 else b''
-        return msg_id, payload
-
-    def recvall(self, n):
-        data = b''
-        while len(data) < n:
-            packet = self.socket.recv(n - len(data))
-            if not packet:
-                raise Exception("Connection closed")
-            data += packet
-        return data
+    def cancel_uploads(self):
+        # Drop every block still waiting for the upload rate limit
+        pass
 
     def handle_message(self, msg_id, payload):
+        # payload is a memoryview that is only valid until the next read
         if msg_id == MESSAGE_CHOKE:
             self.peer_choking = True
+            # A choking peer discards our pending requests
+            self.release_requests()
             if self.verbose:
                 print(f"Peer {self.ip}:{self.port} choked us.")
         elif msg_id == MESSAGE_UNCHOKE:
@@ -229,16 +220,26 @@ class PeerConnection(threading.Thread):
             self.peer_interested = False
             if self.verbose:
                 print(f"Peer {self.ip}:{self.port} is not interested.")
+            # Free its upload slot
+            self.manage_choking()
         elif msg_id == MESSAGE_HAVE:
             piece_index = struct.unpack('!I', payload)[0]
-            self.piece_manager.update_piece_availability_for_piece(piece_index)
+            if piece_index >= self.piece_manager.total_pieces:
+                raise Exception(f"Invalid HAVE for piece {piece_index}")
+            if not self.peer_is_seed:
+                self.piece_manager.add_peer_piece(self, piece_index)
+            if self.client.super_seeder is not None:
+                self.client.super_seeder.on_have(self, piece_index)
             if self.verbose:
                 print(f"Peer {self.ip}:{self.port} has piece {piece_index}.")
             # Update interest
             self.update_interest()
+            # An idle pipeline to an unchoking peer can start on the new piece
+            self.request_pieces()
         elif msg_id == MESSAGE_BITFIELD:
-            self.bitfield = payload
-            self.piece_manager.update_piece_availability(self.bitfield)
+            self.piece_manager.add_peer_bitfield(self, bitfield_to_mask(payload, self.piece_manager.total_pieces))
+            if self.client.super_seeder is not None:
+                self.client.super_seeder.on_bitfield(self)
             if self.verbose:
                 print(f"Received BITFIELD from peer {self.ip}:{self.port}.")
             # Update interest
@@ -248,36 +249,134 @@ class PeerConnection(threading.Thread):
         elif msg_id == MESSAGE_PIECE:
             self.handle_piece(payload)
         elif msg_id == MESSAGE_CANCEL:
-            # Handle cancel if necessary
-            pass
+            # The block may still be held back by the upload rate limit
+            piece_index, begin, length = struct.unpack('!III', payload)
+            self.cancel_upload(piece_index, begin)
+            if self.verbose:
+                print(f"Peer {self.ip}:{self.port} cancelled piece {piece_index} (offset {begin}, length {length}).")
         else:
             if self.verbose:
                 print(f"Unknown message ID: {msg_id}")
 
     def request_pieces(self):
-        while not self.piece_manager.is_complete() and self.am_interested and not self.peer_choking:
-            piece_index = self.client.request_piece_from_rarest()
-            if piece_index is None:
-                break
-            if not self.has_piece_in_bitfield(self.bitfield, piece_index):
-                if self.verbose:
-                    print(f"Peer {self.ip}:{self.port} does not have piece {piece_index}. Skipping.")
-                continue
-            # Define the begin and length
-            begin = 0
-            length = self.piece_manager.get_piece_length(piece_index)
+        while (not self.piece_manager.is_complete() and
+               self.am_interested and
+               not self.peer_choking and
+               len(self.outstanding_requests) < self.pipeline_depth):
+            block = self.piece_manager.next_block(self.peer_has_piece)
+            if block is None:
+                # No spare blocks in pieces in progress; start the rarest piece this peer has
+                piece_index = self.client.request_piece_from_rarest(self.peer_pieces)
+                if piece_index is None:
+                    # Nothing new to fetch; in endgame, race other peers for their blocks
+                    block = self.piece_manager.next_endgame_block(self.peer_has_piece, self.outstanding_requests)
+                    if block is None:
+                        break
+                else:
+                    self.piece_manager.start_piece(piece_index)
+                    continue
+            piece_index, begin, length = block
+            self.outstanding_requests[(piece_index, begin)] = time.time()
             # Send request message
             payload = struct.pack('!III', piece_index, begin, length)
             self.send_message(MESSAGE_REQUEST, payload)
             if self.verbose:
-                print(f"Requested piece {piece_index} from {self.ip}:{self.port}")
-
-    def has_piece_in_bitfield(self, bitfield, index):
-        byte_index = index // 8
-        bit_index = index % 8
-        if byte_index >= len(bitfield):
+                print(f"Requested piece {piece_index} (offset {begin}, length {length}) from {self.ip}:{self.port}")
+
+    def cancel_request(self, piece_index, begin):
+        """
+        Withdraw an outstanding request for a block that arrived from another
+        peer. Returns True if a CANCEL was sent. May be called from other
+        threads.
+        """
+        if self.outstanding_requests.pop((piece_index, begin), None) is None:
             return False
-        return (bitfield[byte_index] >> (7 - bit_index)) & 1
+        length = self.piece_manager.get_block_length(piece_index, begin)
+        self.send_message(MESSAGE_CANCEL, struct.pack('!III', piece_index, begin, length))
+        if self.verbose:
+            print(f"Cancelled piece {piece_index} (offset {begin}) at {self.ip}:{self.port}")
+        return True
+
+    def release_requests(self):
+        # Hand outstanding blocks back so other peers can request them
+        for piece_index, begin in list(self.outstanding_requests):
+            self.piece_manager.release_block(piece_index, begin)
+        self.outstanding_requests.clear()
+
+    def update_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.timeout_backoff = 1
+
+    def block_timeout(self):
+        """
+        How long a block request may be outstanding: the smoothed block
+        round trip plus four deviations, plus the time to receive the blocks
+        queued ahead of it at the measured rate, backed off after timeouts.
+        """
+        if self.srtt is None:
+            timeout = INITIAL_BLOCK_TIMEOUT
+        else:
+            timeout = self.srtt + 4 * self.rttvar
+            if self.download_rate:
+                timeout += len(self.outstanding_requests) * BLOCK_SIZE / self.download_rate
+        return min(MAX_BLOCK_TIMEOUT, max(MIN_BLOCK_TIMEOUT, timeout * self.timeout_backoff))
+
+    def expire_requests(self, now):
+        """
+        Cancel requests that are past their deadline and hand the blocks back
+        so other peers can fetch them. Called from the client's timeout
+        thread; returns the number of expired requests.
+        """
+        timeout = self.block_timeout()
+        expired = [key for key, sent_time in list(self.outstanding_requests.items()) if now - sent_time > timeout]
+        count = 0
+        for piece_index, begin in expired:
+            if self.cancel_request(piece_index, begin):
+                self.piece_manager.release_block(piece_index, begin)
+                count += 1
+        if count:
+            self.request_timeouts += count
+            self.timeout_backoff = min(MAX_TIMEOUT_BACKOFF, self.timeout_backoff * 2)
+            self.pipeline_depth = max(MIN_PIPELINE_DEPTH, self.pipeline_depth // 2)
+            if self.verbose:
+                print(f"{count} requests to {self.ip}:{self.port} timed out after {timeout:.1f} s")
+        return count
+
+    def wake(self):
+        # Refill the request pipeline from another thread
+        self.request_pieces()
+
+    def update_pipeline_depth(self, rtt, length):
+        """
+        Adapt the number of outstanding requests to the bandwidth-delay
+        product observed for this peer.
+        """
+        now = time.time()
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = max(rtt, MIN_RTT)
+        self.rate_window_bytes += length
+        elapsed = now - self.rate_window_start
+        if elapsed < 1.0:
+            return
+        rate = self.rate_window_bytes / elapsed
+        self.download_rate = rate if not self.download_rate else 0.8 * self.download_rate + 0.2 * rate
+        self.rate_window_start = now
+        self.rate_window_bytes = 0
+        # Keep 1.5x the BDP in flight so the depth can grow until the link is full
+        bdp_blocks = self.download_rate * self.min_rtt / BLOCK_SIZE
+        depth = int(bdp_blocks * 1.5) + MIN_PIPELINE_DEPTH
+        self.pipeline_depth = max(MIN_PIPELINE_DEPTH, min(self.max_pipeline_depth, depth))
+        if self.verbose:
+            print(f"Pipeline depth for {self.ip}:{self.port} is {self.pipeline_depth} "
+                  f"({self.download_rate:.0f} B/s, RTT {self.min_rtt * 1000:.1f} ms)")
+
+    def peer_has_piece(self, index):
+        return (self.peer_pieces >> index) & 1
 
     def has_piece(self, index):
         return self.piece_manager.has_piece(index)
@@ -287,20 +386,24 @@ class PeerConnection(threading.Thread):
         block = payload[8:]
         if self.verbose:
             print(f"Handling Piece {piece_index} (Begin: {begin}, Length: {len(block)})")
+        self.bytes_downloaded += len(block)
+        sent_time = self.outstanding_requests.pop((piece_index, begin), None)
+        if sent_time is not None:
+            rtt = time.time() - sent_time
+            self.update_rtt(rtt)
+            self.update_pipeline_depth(rtt, len(block))
         self.piece_manager.add_piece(piece_index, begin, block)
+        if self.piece_manager.endgame:
+            # Other peers may have been asked for the same block
+            self.client.cancel_block(piece_index, begin, self)
         if self.verbose:
             print(f"Received piece {piece_index} (offset {begin}) from {self.ip}:{self.port}")
+        # A completed piece is hashed in the piece manager's pool; the client
+        # announces it (and updates interest) from on_piece_verified
 
-        # Check if the piece is complete and verified
-        if self.piece_manager.is_piece_complete(piece_index):
-            self.client.notify_piece_downloaded(piece_index)
-            if self.verbose:
-                print(f"Piece {piece_index} is complete and verified.")
-            # Update interest
-            self.update_interest()
-            # Potentially request more pieces
-            if not self.peer_choking:
-                self.request_pieces()
+        # Keep the request pipeline full
+        if not self.peer_choking:
+            self.request_pieces()
 
     def handle_request(self, payload):
         piece_index, begin, length = struct.unpack('!III', payload)
@@ -312,12 +415,14 @@ class PeerConnection(threading.Thread):
 
     def send_piece(self, piece_index, begin, length):
         try:
-            piece_data = self.piece_manager.get_piece(piece_index)
-            if piece_data is not None:
-                block = piece_data[begin:begin + length]
-                payload = struct.pack('!II', piece_index, begin) + block
-                self.send_message(MESSAGE_PIECE, payload)
-                self.piece_manager.uploaded += len(block)
+            buffers = self.piece_manager.get_block_buffers(piece_index, begin, length)
+            if buffers is not None:
+                # 13-byte header followed by the block, served straight from storage
+                header = struct.pack('!IBII', 9 + length, MESSAGE_PIECE, piece_index, begin)
+                delay = reserve(self.upload_buckets, length) if self.upload_buckets else 0.0
+                self.send_buffers_after(delay, [header] + buffers, (piece_index, begin, length))
+                self.piece_manager.uploaded += length
+                self.bytes_uploaded += length
                 if self.verbose:
                     print(f"Uploaded piece {piece_index} (offset {begin}) to {self.ip}:{self.port}. Total uploaded: {self.piece_manager.uploaded} bytes.")
             else:
@@ -326,19 +431,26 @@ class PeerConnection(threading.Thread):
         except Exception as e:
             if self.verbose:
                 print(f"Error sending piece {piece_index} to {self.ip}:{self.port} - {e}")
+            self.running = False
 
     def manage_choking(self):
+        if getattr(self.client, 'upload_slots', 0):
+            # The client's choker owns the upload slots
+            self.client.manage_choking(self)
+            return
         # Simple policy: unchoke interested peers
-        if self.peer_interested and self.am_choking:
-            self.am_choking = False
-            self.send_message(MESSAGE_UNCHOKE)
-            if self.verbose:
-                print(f"Unchoked peer {self.ip}:{self.port}")
-        elif not self.peer_interested and not self.am_choking:
-            self.am_choking = True
-            self.send_message(MESSAGE_CHOKE)
-            if self.verbose:
-                print(f"Choked peer {self.ip}:{self.port}")
+        self.set_choking(not self.peer_interested)
+
+    def set_choking(self, choking):
+        if choking == self.am_choking:
+            return
+        self.am_choking = choking
+        self.send_message(MESSAGE_CHOKE if choking else MESSAGE_UNCHOKE)
+        if choking:
+            # A choked peer discards its requests, so blocks not yet sent are wasted
+            self.cancel_uploads()
+        if self.verbose:
+            print(f"{'Choked' if choking else 'Unchoked'} peer {self.ip}:{self.port}")
 
     def update_interest(self):
         # Check if we are interested in any pieces the peer has
@@ -356,7 +468,144 @@ class PeerConnection(threading.Thread):
                     print(f"Sent NOT INTERESTED to {self.ip}:{self.port}")
 
     def has_pieces_of_interest(self):
-        for index in self.piece_manager.missing_pieces:
-            if self.has_piece_in_bitfield(self.bitfield, index):
-                return True
-        return False
+        # Interesting if the peer has any piece we are missing
+        return (self.peer_pieces & self.piece_manager.missing_mask) != 0
+
+
+class PeerConnection(PeerProtocol, threading.Thread):
+    """
+    Peer wire protocol over a blocking socket, driven by its own thread.
+    """
+
+    def __init__(self, ip, port, piece_manager, peer_id, info_hash, client, sock=None, is_incoming=False, verbose=False):
+        threading.Thread.__init__(self)
+        PeerProtocol.__init__(self, ip, port, piece_manager, peer_id, info_hash, client, is_incoming=is_incoming, verbose=verbose)
+        self.send_lock = threading.Lock()  # Messages may be sent from other threads
+
+        if sock is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            self.socket = sock
+
+    @classmethod
+    def from_incoming(cls, client_socket, piece_manager, peer_id, info_hash, client, verbose=False):
+        ip, port = client_socket.getpeername()
+        return cls(ip, port, piece_manager, peer_id, info_hash, client, sock=client_socket, is_incoming=True, verbose=verbose)
+
+    def run(self):
+        try:
+            self.perform_handshake()
+            self.communicate()
+        except Exception as e:
+            if self.verbose:
+                print(f"Connection error with peer {self.ip}:{self.port} - {e}")
+        finally:
+            self.socket.close()
+            self.on_connection_closed()
+
+    def perform_handshake(self):
+        handshake_msg = self.build_handshake()
+
+        if not self.is_incoming:
+            if self.verbose:
+                print(f"Outgoing connection to {self.ip}:{self.port}")
+            self.socket.connect((self.ip, self.port))
+            self.socket.sendall(handshake_msg)
+            if self.verbose:
+                print(f"Sent handshake to {self.ip}:{self.port}")
+            self.check_handshake(self.receive_buffer.read_exact(self.socket, HANDSHAKE_LENGTH))
+        else:
+            if self.verbose:
+                print(f"Incoming connection from {self.ip}:{self.port}")
+            self.check_handshake(self.receive_buffer.read_exact(self.socket, HANDSHAKE_LENGTH))
+
+            # Send handshake back
+            try:
+                self.socket.sendall(handshake_msg)
+                if self.verbose:
+                    print(f"Sent handshake to peer {self.ip}:{self.port}")
+            except Exception as e:
+                raise Exception(f"Failed to send handshake: {e}")
+
+        self.on_handshake_complete()
+
+    def keep_alive(self):
+        while self.running:
+            time.sleep(KEEP_ALIVE_INTERVAL)
+            try:
+                with self.send_lock:
+                    self.socket.sendall(struct.pack('!I', 0))
+                if self.verbose:
+                    print(f"Sent keep-alive to {self.ip}:{self.port}")
+            except Exception as e:
+                if self.verbose:
+                    print(f"Error sending keep-alive to {self.ip}:{self.port} - {e}")
+                break
+
+    def communicate(self):
+        # Start a thread to send keep-alive messages if needed
+        threading.Thread(target=self.keep_alive, daemon=True).start()
+
+        while self.running:
+            try:
+                # Handle every complete message already buffered, then read more
+                for msg_id, payload in self.receive_buffer.messages():
+                    if msg_id is None:
+                        continue  # Keep-alive
+                    self.handle_message(msg_id, payload)
+                    if not self.running:
+                        break
+                else:
+                    nbytes = self.receive_buffer.recv_into(self.socket)
+                    if self.download_buckets:
+                        # Stop reading until the download limit allows more
+                        delay = reserve(self.download_buckets, nbytes)
+                        if delay > 0:
+                            time.sleep(delay)
+            except Exception as e:
+                if self.verbose:
+                    print(f"Error in communication with peer {self.ip}:{self.port} - {e}")
+                break
+
+    def send_message(self, msg_id, payload=b''):
+        try:
+            # Control messages are not rate limited; block data is (see send_piece)
+            msg_length = 1 + len(payload)
+            msg = struct.pack('!I', msg_length) + struct.pack('!B', msg_id) + payload
+            with self.send_lock:
+                self.socket.sendall(msg)
+            if self.verbose:
+                print(f"Sent message ID {msg_id} to {self.ip}:{self.port}")
+        except Exception as e:
+            if self.verbose:
+                print(f"Failed to send message ID {msg_id} to {self.ip}:{self.port} - {e}")
+            self.running = False
+
+    def send_buffers(self, buffers):
+        """
+        Send a list of buffers with scatter-gather I/O so the payload is not
+        copied into a single message first.
+        """
+        if not hasattr(self.socket, 'sendmsg'):
+            with self.send_lock:
+                self.socket.sendall(b''.join(buffers))
+            return
+        buffers = [memoryview(buffer) for buffer in buffers]
+        with self.send_lock:
+            self.sendmsg_all(buffers)
+
+    def send_buffers_after(self, delay, buffers, block=None):
+        # Requests are served on this connection's thread, so waiting here
+        # also holds back the requests queued behind this one
+        if delay > 0:
+            time.sleep(delay)
+        self.send_buffers(buffers)
+
+    def sendmsg_all(self, buffers):
+        while buffers:
+            sent = self.socket.sendmsg(buffers)
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and sent:
+                buffers[0] = buffers[0][sent:]
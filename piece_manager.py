@@ -3,29 +3,65 @@
 import hashlib
 import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from storage import FileStorage, WriteBackStorage
+from availability_index import AvailabilityIndex
+from bitfield import mask_to_bitfield
+
+BLOCK_SIZE = 16384  # 16 KiB, the unit of received-data tracking
+HASH_WORKERS = os.cpu_count() or 1  # Threads verifying piece hashes; hashlib releases the GIL
 
 class PieceManager:
-    def __init__(self, metainfo, download_directory, verbose=False):
+    def __init__(self, metainfo, download_directory, verbose=False, storage=None,
+                 hash_workers=HASH_WORKERS, on_piece_verified=None):
         self.metainfo = metainfo
         self.download_directory = download_directory
         self.verbose = verbose
         self.piece_length = self.metainfo[b'info'][b'piece length']
         self.total_length = self.calculate_total_length()
         self.total_pieces = (self.total_length + self.piece_length - 1) // self.piece_length
-        self.pieces = {}  # Dictionary to store verified pieces by index
+        self.pieces = set()  # Indices of verified pieces; their data lives in storage
         self.pieces_data = {}  # Temporary storage for assembling piece data
         self.missing_pieces = set(range(self.total_pieces))
+        self.full_mask = (1 << self.total_pieces) - 1
+        self.missing_mask = self.full_mask  # Bit i set while piece i is missing
         self.downloaded = 0
         self.uploaded = 0
-        self.pieces_data_received = {}
+        self.pieces_data_received = {}  # Bitmap (int) of received blocks per in-flight piece
         # Prepare file mappings
         self.file_mappings = self.create_file_mappings()
-
-        # Initialize piece availability for rarest-first
-        self.piece_availability = [0] * self.total_pieces
+        # Storage backend holding verified piece data; pieces are written to
+        # their files by a background writer as soon as they verify
+        if storage is None:
+            storage = WriteBackStorage(FileStorage(self.file_mappings, download_directory),
+                                       on_write_error=self.write_failed)
+        self.storage = storage
+
+        # Peers with every piece are counted here instead of per piece, so a
+        # seeder's BITFIELD costs O(1); true availability is the index's count + seed_count
+        self.seed_count = 0
+        # Availability counts for rarest-first, and the missing, unrequested pieces
+        self.availability_index = AvailabilityIndex(self.total_pieces, wanted=self.missing_mask)
 
         # Initialize requested pieces tracking
         self.requested_pieces = set()
+        # Blocks of requested pieces not yet handed to any peer, as a stack of
+        # offsets per piece so different peers can fetch blocks of one piece
+        self.unrequested_blocks = {}
+        # Scheduler metric: pieces picked
+        self.picks = 0
+        # Endgame: set once blocks already in flight are requested again from
+        # other peers; bytes received for blocks or pieces we already had
+        self.endgame = False
+        self.endgame_requests = 0
+        self.redundant_bytes = 0
+
+        # Complete pieces are hashed by a worker pool off the lock; the
+        # callback gets (index, valid) once a piece has been checked
+        self.hash_pool = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix='hash')
+        self.verifying = set()  # Complete pieces waiting for their hash check
+        self.unstored = set()  # Verifying pieces whose write failed before they were marked
+        self.on_piece_verified = on_piece_verified
 
         # Lock for thread safety
         self.lock = threading.Lock()
@@ -74,45 +110,221 @@ class PieceManager:
 
     def add_piece(self, index, begin, block):
         piece_length = self.get_piece_length(index)
+        if begin < 0 or begin + len(block) > piece_length:
+            if self.verbose:
+                print(f"Block for piece {index} at offset {begin} exceeds piece length. Ignoring.")
+            return
+        block_mask = self.get_block_mask(index, begin, len(block))
         with self.lock:
-            if index in self.pieces:
+            if index in self.pieces or index in self.verifying:
+                self.redundant_bytes += len(block)
                 if self.verbose:
                     print(f"Already have piece {index}. Ignoring.")
                 return  # Already have this piece
 
             if index not in self.pieces_data:
                 self.pieces_data[index] = bytearray(piece_length)
-                self.pieces_data_received[index] = [False] * piece_length  # Track received bytes
+                self.pieces_data_received[index] = 0  # No blocks received yet
                 if self.verbose:
                     print(f"Initialized data structures for piece {index}.")
+            elif block_mask and self.pieces_data_received[index] & block_mask == block_mask:
+                # Another peer delivered this block first (endgame)
+                self.redundant_bytes += len(block)
+                return
 
             self.pieces_data[index][begin:begin + len(block)] = block
-            for i in range(begin, begin + len(block)):
-                self.pieces_data_received[index][i] = True
+            self.pieces_data_received[index] |= block_mask
 
             if self.verbose:
                 print(f"Updated piece {index}: Received {len(block)} bytes at offset {begin}.")
 
-            # Check if all bytes have been received
-            if all(self.pieces_data_received[index]):
-                expected_hash = self.get_piece_hash(index)
-                actual_hash = hashlib.sha1(self.pieces_data[index]).digest()
-                if actual_hash == expected_hash:
-                    self.pieces[index] = bytes(self.pieces_data[index])
-                    del self.pieces_data[index]
-                    self.pieces_data_received.pop(index, None)  # Safe removal
+            # Once all blocks have been received, hand the piece to the pool
+            if self.pieces_data_received[index] != self.get_full_block_mask(index):
+                return
+            piece_data = self.pieces_data.pop(index)
+            self.pieces_data_received.pop(index, None)
+            self.unrequested_blocks.pop(index, None)
+            self.verifying.add(index)
+        self.hash_pool.submit(self.verify_piece, index, piece_data)
+
+    def verify_piece(self, index, piece_data):
+        """
+        Check a complete piece against its hash (in a pool thread, without
+        holding the lock) and store it, or return it to the wanted pieces.
+        """
+        try:
+            valid = hashlib.sha1(piece_data).digest() == self.get_piece_hash(index)
+            if valid:
+                self.storage.write(index * self.piece_length, piece_data)
+            stored = True
+            with self.lock:
+                self.verifying.discard(index)
+                self.requested_pieces.discard(index)
+                if index in self.unstored:
+                    self.unstored.discard(index)
+                    valid = stored = False
+                if valid:
+                    self.pieces.add(index)
                     self.missing_pieces.discard(index)
-                    self.requested_pieces.discard(index)
-                    self.downloaded += piece_length
-                    print(f"Piece {index} verified and added. Total downloaded: {self.downloaded} bytes.")
+                    self.missing_mask &= ~(1 << index)
+                    self.availability_index.discard(index)
+                    self.downloaded += len(piece_data)
                 else:
-                    print(f"Piece {index} failed hash check.")
-                    self.requested_pieces.discard(index)
+                    self.availability_index.add(index)
+            if valid:
+                print(f"Piece {index} verified and added. Total downloaded: {self.downloaded} bytes.")
+            elif stored:
+                print(f"Piece {index} failed hash check.")
+            if self.on_piece_verified is not None:
+                self.on_piece_verified(index, valid)
+        except Exception as e:
+            print(f"Error verifying piece {index}: {e}")
+            # Re-queue it like a failed hash check, unless it was stored
+            # and only the callback failed
+            with self.lock:
+                self.verifying.discard(index)
+                self.unstored.discard(index)
+                if index not in self.pieces:
                     self.pieces_data.pop(index, None)
                     self.pieces_data_received.pop(index, None)
+                    self.requested_pieces.discard(index)
+                    self.availability_index.add(index)
+
+    def write_failed(self, offset, length):
+        # Called by the write-back thread, which must not wait for our lock
+        self.hash_pool.submit(self.unmark_pieces, offset, length)
+
+    def unmark_pieces(self, offset, length):
+        """
+        Return the verified pieces overlapping a range that failed to reach
+        storage to the wanted pieces, so they are neither uploaded nor
+        counted as present and get downloaded again.
+        """
+        first = offset // self.piece_length
+        last = (offset + length - 1) // self.piece_length
+        with self.lock:
+            for index in range(first, min(last, self.total_pieces - 1) + 1):
+                if index in self.verifying:
+                    self.unstored.add(index)  # verify_piece re-queues it
+                if index not in self.pieces:
+                    continue
+                self.pieces.discard(index)
+                self.missing_pieces.add(index)
+                self.missing_mask |= 1 << index
+                self.availability_index.add(index)
+                self.downloaded -= self.get_piece_length(index)
+                print(f"Piece {index} was not stored and will be downloaded again.")
+
+    def get_block_count(self, index):
+        return (self.get_piece_length(index) + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+    def get_full_block_mask(self, index):
+        return (1 << self.get_block_count(index)) - 1
+
+    def get_block_length(self, index, begin):
+        return min(BLOCK_SIZE, self.get_piece_length(index) - begin)
+
+    def start_piece(self, index):
+        """
+        Make the blocks of a newly requested piece available to next_block.
+        """
+        with self.lock:
+            if index in self.pieces or index in self.unrequested_blocks:
+                return
+            received = self.pieces_data_received.get(index, 0)
+            begins = [block * BLOCK_SIZE for block in range(self.get_block_count(index))
+                      if not (received >> block) & 1]
+            begins.reverse()  # Pop from the end to request in ascending order
+            self.unrequested_blocks[index] = begins
+
+    def next_block(self, has_piece):
+        """
+        Hand out an unrequested block of a piece in progress that the peer
+        has, oldest piece first. Returns (index, begin, length) or None.
+        """
+        with self.lock:
+            for index, begins in self.unrequested_blocks.items():
+                if begins and has_piece(index):
+                    begin = begins.pop()
+                    return index, begin, self.get_block_length(index, begin)
+        return None
+
+    def in_endgame(self):
+        # Caller must hold self.lock. True once every block we could still
+        # get from the connected peers has been requested
+        if not self.unrequested_blocks or any(self.unrequested_blocks.values()):
+            return False
+        obtainable = len(self.availability_index)
+        if not self.seed_count:
+            obtainable -= self.availability_index.unavailable()
+        return obtainable == 0
+
+    def next_endgame_block(self, has_piece, outstanding):
+        """
+        In endgame, hand out a block that is still in flight from another
+        peer, so the last pieces do not wait on the slowest peer. Blocks in
+        `outstanding` (the asking peer's own requests) are skipped. Returns
+        (index, begin, length) or None.
+        """
+        with self.lock:
+            if not self.in_endgame():
+                return None
+            for index in self.unrequested_blocks:
+                if not has_piece(index):
+                    continue
+                received = self.pieces_data_received.get(index, 0)
+                for block in range(self.get_block_count(index)):
+                    begin = block * BLOCK_SIZE
+                    if not (received >> block) & 1 and (index, begin) not in outstanding:
+                        self.endgame = True
+                        self.endgame_requests += 1
+                        return index, begin, self.get_block_length(index, begin)
+        return None
+
+    def release_block(self, index, begin):
+        """
+        Return a requested block that will not arrive (peer choked us or
+        disconnected) so another peer can fetch it.
+        """
+        with self.lock:
+            begins = self.unrequested_blocks.get(index)
+            if begins is None or begin in begins:
+                return
+            if (self.pieces_data_received.get(index, 0) >> (begin // BLOCK_SIZE)) & 1:
+                return  # Arrived in the meantime
+            begins.append(begin)
+
+    def get_block_mask(self, index, begin, length):
+        """
+        Bitmap of the blocks fully covered by [begin, begin + length).
+        Partially covered blocks are left unmarked.
+        """
+        end = begin + length
+        first = (begin + BLOCK_SIZE - 1) // BLOCK_SIZE
+        if end >= self.get_piece_length(index):
+            last = self.get_block_count(index)
+        else:
+            last = end // BLOCK_SIZE
+        if last <= first:
+            return 0
+        return ((1 << (last - first)) - 1) << first
 
     def get_piece(self, index):
-        return self.pieces.get(index)
+        if index not in self.pieces:
+            return None
+        return self.storage.read(index * self.piece_length, self.get_piece_length(index))
+
+    def get_block_buffers(self, index, begin, length):
+        """
+        Return buffers referencing the requested range of a verified piece
+        (memory-mapped file ranges where possible) so uploads can avoid
+        copying, or None if the piece or range is not valid.
+        """
+        if index not in self.pieces:
+            return None
+        if begin < 0 or length < 0 or begin + length > self.get_piece_length(index):
+            return None
+        return self.storage.get_buffers(index * self.piece_length + begin, length)
 
     def get_piece_hash(self, index):
         start = index * 20  # Each SHA-1 hash is 20 bytes
@@ -125,15 +337,18 @@ class PieceManager:
         else:
             return self.piece_length
 
-    def next_missing_piece(self):
-        if self.missing_pieces:
-            # Return the rarest piece available
-            missing_pieces = list(self.missing_pieces)
-            missing_pieces.sort(key=lambda index: self.piece_availability[index])
-            for piece in missing_pieces:
-                if piece not in self.requested_pieces:
-                    return piece
-        return None
+    def pick_piece(self, peer_mask=None):
+        """
+        Pick the rarest missing, unrequested piece in the peer's piece mask
+        and mark it as requested. Returns None if there is no such piece.
+        """
+        with self.lock:
+            index = self.availability_index.pick(peer_mask, include_unavailable=self.seed_count > 0)
+            if index is not None:
+                self.picks += 1
+                self.availability_index.discard(index)
+                self.requested_pieces.add(index)
+            return index
 
     def is_piece_complete(self, index):
         """
@@ -142,6 +357,14 @@ class PieceManager:
         with self.lock:
             return index in self.pieces
 
+    def bytes_left(self):
+        # Bytes of the payload not yet verified, for tracker announces
+        with self.lock:
+            left = len(self.missing_pieces) * self.piece_length
+            if self.total_pieces - 1 in self.missing_pieces:
+                left -= self.total_pieces * self.piece_length - self.total_length
+            return left
+
     def is_complete(self):
         """
         Check if all pieces have been downloaded and verified.
@@ -149,99 +372,117 @@ class PieceManager:
         with self.lock:
             return len(self.pieces) == self.total_pieces
 
-    def reconstruct_files(self, base_path):
-        for file_info in self.file_mappings:
-            file_path = os.path.join(base_path, *file_info['path'])  # Paths include root_directory
-            file_dir = os.path.dirname(file_path)
-            if not os.path.exists(file_dir):
-                os.makedirs(file_dir)
-
-            with open(file_path, 'wb') as outfile:
-                file_offset = file_info['offset']
-                remaining = file_info['length']
-                while remaining > 0:
-                    piece_index = file_offset // self.piece_length
-                    piece_offset = file_offset % self.piece_length
-                    piece_data = self.pieces.get(piece_index)
-                    if piece_data is None:
-                        print(f"Missing piece {piece_index}, cannot reconstruct file.")
-                        return
-                    read_length = min(remaining, self.piece_length - piece_offset)
-                    outfile.write(piece_data[piece_offset:piece_offset + read_length])
-                    file_offset += read_length
-                    remaining -= read_length
-        print(f"Files reconstructed at {base_path}")
-
-    def load_pieces_from_file(self, base_path):
-        total_offset = 0
-        total_loaded_length = 0
-        for file_info in self.file_mappings:
-            file_path = os.path.join(base_path, *file_info['path'])  # Paths now include root_directory
+    def reconstruct_files(self):
+        # Verified pieces are written to their files as they complete,
+        # so only queued writes need to reach the disk here.
+        self.storage.sync()
+        print(f"Files reconstructed at {self.download_directory}")
+
+    def mark_piece_loaded(self, index):
+        # Record a piece found on disk; the caller holds self.lock
+        self.pieces.add(index)
+        self.missing_pieces.discard(index)
+        self.missing_mask &= ~(1 << index)
+        self.availability_index.discard(index)
+
+    def check_piece(self, index):
+        # Hash one piece straight from storage (runs in the pool)
+        piece_data = self.storage.read(index * self.piece_length, self.get_piece_length(index))
+        return hashlib.sha1(piece_data).digest() == self.get_piece_hash(index)
+
+    def load_pieces_from_file(self, indices=None):
+        """
+        Hash the given pieces (all of them by default) from storage in the
+        worker pool and mark those that verify as present.
+        """
+        missing_files = 0
+        for file_index, file_info in enumerate(self.file_mappings):
+            file_path = self.storage.file_path(file_index)
             if not os.path.exists(file_path):
                 print(f"File {file_path} does not exist.")
-                continue
-
-            file_length = file_info['length']
-            with open(file_path, 'rb') as f:
-                remaining = file_length
-                while remaining > 0:
-                    piece_index = total_offset // self.piece_length
-                    piece_offset = total_offset % self.piece_length
-                    read_length = min(self.get_piece_length(piece_index) - piece_offset, remaining)
-                    data = f.read(read_length)
-                    if not data:
-                        break
-
-                    if piece_index not in self.pieces_data:
-                        piece_length = self.get_piece_length(piece_index)
-                        self.pieces_data[piece_index] = bytearray(piece_length)
-                        self.pieces_data_received[piece_index] = [False] * piece_length
-                        if self.verbose:
-                            print(f"Initialized data structures for piece {piece_index}.")
-
-                    self.pieces_data[piece_index][piece_offset:piece_offset + len(data)] = data
-
-                    # Update pieces_data_received
-                    for i in range(piece_offset, piece_offset + len(data)):
-                        self.pieces_data_received[piece_index][i] = True
-
-                    total_offset += len(data)
-                    total_loaded_length += len(data)
-                    remaining -= len(data)
-
-        print(f"Total loaded data length: {total_loaded_length}")
-        print(f"Expected total length: {self.total_length}")
-        # Proceed with verifying pieces...
-
-        # After reading all files, verify and store the pieces
-        for index, piece_data in self.pieces_data.copy().items():
-            expected_hash = self.get_piece_hash(index)
-            actual_hash = hashlib.sha1(piece_data).digest()
-            if actual_hash == expected_hash:
-                self.pieces[index] = bytes(piece_data)
-                self.missing_pieces.discard(index)
-                print(f"Piece {index} loaded and verified.")
-                # Remove from temporary storage
-                del self.pieces_data[index]
-                self.pieces_data_received.pop(index, None)
+                missing_files += 1
 
+        indices = range(self.total_pieces) if indices is None else indices
+        for index, valid in zip(indices, self.hash_pool.map(self.check_piece, indices)):
+            if valid:
+                with self.lock:
+                    self.mark_piece_loaded(index)
+                if self.verbose:
+                    print(f"Piece {index} loaded and verified.")
             else:
-                print(f"Piece {index} failed hash check during loading.")
-                self.requested_pieces.discard(index)
-                self.pieces_data.pop(index, None)
-                self.pieces_data_received.pop(index, None)
-
-        for index, piece_data in self.pieces_data.items():
-            expected_length = self.get_piece_length(index)
-            actual_length = len(piece_data)
-            print(f"Piece {index} expected length: {expected_length}, actual length: {actual_length}")
-
-    def update_piece_availability(self, peer_bitfield):
-        for index in range(self.total_pieces):
-            if self.has_piece_in_bitfield(peer_bitfield, index):
-                self.piece_availability[index] += 1
                 if self.verbose:
-                    print(f"Piece {index} availability incremented to {self.piece_availability[index]}")
+                    print(f"Piece {index} failed hash check during loading.")
+
+        print(f"Loaded {len(self.pieces)} of {self.total_pieces} pieces ({missing_files} missing files).")
+
+    def add_peer_bitfield(self, peer, peer_mask):
+        """
+        Count a peer's pieces, given as a bit mask, towards availability. The
+        mask is retained on the connection (peer.peer_pieces) so it can be
+        subtracted again when the peer goes away; a peer with every piece is
+        counted in seed_count instead of per piece.
+        """
+        with self.lock:
+            # A repeated BITFIELD replaces what the peer told us before
+            self.subtract_peer(peer)
+            peer.peer_pieces = peer_mask
+            peer.peer_is_seed = peer_mask == self.full_mask
+            if peer.peer_is_seed:
+                self.seed_count += 1
+                if self.verbose:
+                    print(f"Seed count incremented to {self.seed_count}")
+                return
+            self.availability_index.add_mask(peer_mask)
+
+    def add_peer_piece(self, peer, index):
+        # HAVE from a peer; returns False if it was already counted
+        bit = 1 << index
+        with self.lock:
+            if peer.peer_pieces & bit:
+                return False
+            peer.peer_pieces |= bit
+            self.availability_index.increment(index)
+            availability = self.availability_index.count(index)
+        print(f"Piece {index} availability incremented to {availability}")
+        return True
+
+    def remove_peer(self, peer):
+        # Subtract a disconnected peer's pieces from availability
+        with self.lock:
+            self.subtract_peer(peer)
+
+    def subtract_peer(self, peer):
+        # Caller must hold self.lock
+        if peer.peer_is_seed:
+            self.seed_count -= 1
+        elif peer.peer_pieces:
+            self.availability_index.subtract_mask(peer.peer_pieces)
+        peer.peer_pieces = 0
+        peer.peer_is_seed = False
+
+    def check_availability(self, peers):
+        """
+        Recompute availability from the piece masks of the given (connected)
+        peers and repair any count that has drifted. Returns the number of
+        counts that were wrong, with the seed count counting as one.
+        """
+        expected = AvailabilityIndex(self.total_pieces)
+        seeds = 0
+        drift = 0
+        with self.lock:
+            for peer in peers:
+                if peer.peer_is_seed:
+                    seeds += 1
+                else:
+                    expected.add_mask(peer.peer_pieces)
+            if seeds != self.seed_count:
+                drift += 1
+                self.seed_count = seeds
+            drift += self.availability_index.replace_counts(expected.planes)
+        return drift
+
+    def get_availability(self, index):
+        return self.availability_index.count(index) + self.seed_count
 
     def has_piece_in_bitfield(self, bitfield, index):
         byte_index = index // 8
@@ -250,26 +491,21 @@ class PieceManager:
             return False
         return (bitfield[byte_index] >> (7 - bit_index)) & 1
 
-    def update_piece_availability_for_piece(self, index):
-        self.piece_availability[index] += 1
-        print(f"Piece {index} availability incremented to {self.piece_availability[index]}")
-
     def has_piece(self, index):
         return index in self.pieces
 
     def get_rarest_pieces(self):
-        # Return missing pieces sorted by availability (rarest first)
-        missing_pieces = list(self.missing_pieces)
-        missing_pieces.sort(key=lambda index: self.piece_availability[index])
+        # Return missing, unrequested pieces ordered by availability (rarest first)
+        with self.lock:
+            rarest_pieces = list(self.availability_index)
         if self.verbose:
-            print(f"Rarest pieces sorted: {missing_pieces}")
-        return missing_pieces
+            print(f"Rarest pieces: {rarest_pieces}")
+        return rarest_pieces
+
+    def get_have_mask(self):
+        # Bit mask of the pieces we have verified
+        return self.full_mask & ~self.missing_mask
 
     def get_bitfield(self):
-        bitfield_length = (self.total_pieces + 7) // 8
-        bitfield = bytearray(bitfield_length)
-        for index in self.pieces.keys():
-            byte_index = index // 8
-            bit_index = index % 8
-            bitfield[byte_index] |= 1 << (7 - bit_index)
-        return bytes(bitfield)
+        with self.lock:
+            return mask_to_bitfield(self.get_have_mask(), self.total_pieces)
@@ -0,0 +1,70 @@
+# rate_limiter.py
+
+import threading
+import time
+
+DEFAULT_BURST_TIME = 0.05  # Default burst: 50 ms worth of the rate
+MIN_BURST = 16384  # But at least one block
+
+
+class TokenBucket:
+    """
+    Token bucket limiting a byte rate, shared by any number of connections.
+
+    Bytes are charged up front and the bucket may go into debt; the caller
+    then waits for the returned delay before moving more data. A reservation
+    costs one lock and a few arithmetic operations, so the bucket can be
+    charged on every send or receive call.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)  # Bytes per second
+        self.burst = float(burst) if burst is not None else max(self.rate * DEFAULT_BURST_TIME, MIN_BURST)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes):
+        """
+        Charge nbytes and return how many seconds the caller must wait for
+        the bucket to be out of debt again (0.0 if it is not in debt).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= nbytes
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def refund(self, nbytes):
+        # Give back bytes that were reserved but never sent
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + nbytes)
+
+
+def make_buckets(shared_bucket, per_peer_rate):
+    """
+    Buckets a single connection charges in one direction: the client-wide
+    bucket, if any, plus a bucket of its own if a per-peer rate is set.
+    """
+    buckets = []
+    if shared_bucket is not None:
+        buckets.append(shared_bucket)
+    if per_peer_rate:
+        buckets.append(TokenBucket(per_peer_rate))
+    return buckets
+
+
+def reserve(buckets, nbytes):
+    # Charge every bucket and wait for the one furthest in debt
+    delay = 0.0
+    for bucket in buckets:
+        delay = max(delay, bucket.reserve(nbytes))
+    return delay
+
+
+def refund(buckets, nbytes):
+    for bucket in buckets:
+        bucket.refund(nbytes)
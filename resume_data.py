@@ -0,0 +1,176 @@
+# resume_data.py
+
+import os
+import bencodepy
+from bitfield import bitfield_to_mask, mask_to_bitfield, iter_set_bits
+from piece_manager import BLOCK_SIZE
+
+RESUME_VERSION = 1
+
+
+class ResumeData:
+    """
+    Fast-resume file for a PieceManager, so a restart does not have to hash
+    the whole payload again.
+
+    The file records the verified pieces as a bitfield, the size and mtime of
+    every payload file, and the received-block mask of each piece still being
+    assembled (those blocks are written to storage when the file is saved).
+    On load, a piece is trusted without hashing only if every file it spans
+    is unchanged since the save; pieces touching a changed or missing file
+    are hashed again and their partial blocks are discarded.
+    """
+
+    def __init__(self, piece_manager, info_hash, path):
+        self.piece_manager = piece_manager
+        self.info_hash = info_hash
+        self.path = path
+        self.saved_downloaded = None  # piece_manager.downloaded at the last save
+
+    def file_stats(self):
+        stats = []
+        for file_index in range(len(self.piece_manager.file_mappings)):
+            try:
+                st = os.stat(self.piece_manager.storage.file_path(file_index))
+                stats.append({b'length': st.st_size, b'mtime': st.st_mtime_ns})
+            except OSError:
+                stats.append({})
+        return stats
+
+    def file_pieces(self, file_index):
+        # Range of the pieces that overlap the given file
+        file_info = self.piece_manager.file_mappings[file_index]
+        piece_length = self.piece_manager.piece_length
+        first = file_info['offset'] // piece_length
+        last = (file_info['offset'] + max(file_info['length'], 1) - 1) // piece_length
+        return range(first, min(last + 1, self.piece_manager.total_pieces))
+
+    def is_dirty(self):
+        return self.saved_downloaded != self.piece_manager.downloaded
+
+    def save(self):
+        """
+        Write the partial pieces to storage and the resume file next to the
+        payload. The file is replaced atomically, so a crash while saving
+        leaves the previous resume data in place.
+        """
+        piece_manager = self.piece_manager
+        with piece_manager.lock:
+            downloaded = piece_manager.downloaded
+            have_mask = piece_manager.get_have_mask()
+            partial = []
+            for index, received in piece_manager.pieces_data_received.items():
+                if not received:
+                    continue
+                data = piece_manager.pieces_data[index]
+                block_count = piece_manager.get_block_count(index)
+                for begin, length in self.block_runs(received, block_count, len(data)):
+                    piece_manager.storage.write(index * piece_manager.piece_length + begin,
+                                                memoryview(data)[begin:begin + length])
+                partial.append({b'index': index, b'blocks': mask_to_bitfield(received, block_count)})
+        piece_manager.storage.flush()
+
+        # Stat after writing so the recorded mtimes cover everything above.
+        # Pieces verified meanwhile only make a file look changed on load,
+        # which costs a rehash of that file but never trusts bad data.
+        resume = {
+            b'version': RESUME_VERSION,
+            b'info-hash': self.info_hash,
+            b'piece-length': piece_manager.piece_length,
+            b'pieces': mask_to_bitfield(have_mask, piece_manager.total_pieces),
+            b'files': self.file_stats(),
+            b'partial': partial,
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(bencodepy.encode(resume))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.saved_downloaded = downloaded
+
+    @staticmethod
+    def block_runs(received, block_count, piece_length):
+        # Yield (begin, length) for each run of consecutive received blocks
+        start = None
+        for block in range(block_count + 1):
+            if block < block_count and (received >> block) & 1:
+                if start is None:
+                    start = block
+            elif start is not None:
+                begin = start * BLOCK_SIZE
+                yield begin, min(block * BLOCK_SIZE, piece_length) - begin
+                start = None
+
+    def read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                resume = bencodepy.decode(f.read())
+        except (OSError, ValueError, bencodepy.BencodeDecodeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring unreadable resume file {self.path}: {e}")
+            return None
+        piece_manager = self.piece_manager
+        if (not isinstance(resume, dict)
+                or resume.get(b'version') != RESUME_VERSION
+                or resume.get(b'info-hash') != self.info_hash
+                or resume.get(b'piece-length') != piece_manager.piece_length
+                or not isinstance(resume.get(b'files'), list)
+                or len(resume[b'files']) != len(piece_manager.file_mappings)
+                or not all(isinstance(entry, dict) for entry in resume[b'files'])
+                or not isinstance(resume.get(b'partial'), list)
+                or not all(isinstance(entry, dict) and isinstance(entry.get(b'blocks'), bytes)
+                           for entry in resume[b'partial'])
+                or not isinstance(resume.get(b'pieces'), bytes)
+                or len(resume[b'pieces']) != (piece_manager.total_pieces + 7) // 8):
+            print(f"Resume file {self.path} does not match this torrent. Ignoring.")
+            return None
+        return resume
+
+    def load(self):
+        """
+        Restore the piece manager's state from the resume file. Returns the
+        indices of the pieces that still have to be hashed (those in changed
+        files), or None if there is no usable resume file and everything must
+        be checked.
+        """
+        resume = self.read()
+        if resume is None:
+            return None
+        piece_manager = self.piece_manager
+
+        changed_files = [file_index for file_index, (saved, current)
+                         in enumerate(zip(resume[b'files'], self.file_stats()))
+                         if not saved or saved != current]
+        recheck = set()
+        for file_index in changed_files:
+            recheck.update(self.file_pieces(file_index))
+
+        have_mask = bitfield_to_mask(resume[b'pieces'], piece_manager.total_pieces)
+        partial = {}
+        for entry in resume[b'partial']:
+            index = entry.get(b'index')
+            if (isinstance(index, int) and 0 <= index < piece_manager.total_pieces
+                    and index not in recheck and not (have_mask >> index) & 1):
+                received = bitfield_to_mask(entry[b'blocks'], piece_manager.get_block_count(index))
+                if received:
+                    partial[index] = received
+
+        for index in partial:
+            data = piece_manager.storage.read(index * piece_manager.piece_length,
+                                              piece_manager.get_piece_length(index))
+            partial[index] = (partial[index], bytearray(data))
+
+        with piece_manager.lock:
+            for index in iter_set_bits(have_mask, piece_manager.total_pieces):
+                if index not in recheck:
+                    piece_manager.mark_piece_loaded(index)
+            for index, (received, data) in partial.items():
+                piece_manager.pieces_data[index] = data
+                piece_manager.pieces_data_received[index] = received
+        self.saved_downloaded = piece_manager.downloaded
+
+        print(f"Resumed {len(piece_manager.pieces)} of {piece_manager.total_pieces} pieces and "
+              f"{len(partial)} partial pieces from {self.path}; "
+              f"{len(changed_files)} changed files, {len(recheck)} pieces to recheck.")
+        return sorted(recheck)
@@ -0,0 +1,56 @@
+# run_node.py
+
+import argparse
+from node_client import NodeClient, UPLOAD_SLOTS
+from peer_connection import MAX_PIPELINE_DEPTH
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simple BitTorrent Client')
+    parser.add_argument('torrent_file', help='Path to the .torrent file')
+    parser.add_argument('-p', '--port', type=int, required=True, help='Port number to listen on')
+    parser.add_argument('-o', '--output', required=True, help='Download directory')
+    parser.add_argument('--max-download-speed', type=int, default=0, help='Max download speed in bytes per second')
+    parser.add_argument('--max-upload-speed', type=int, default=0, help='Max upload speed in bytes per second')
+    parser.add_argument('--max-peer-download-speed', type=int, default=0, help='Max download speed per peer in bytes per second')
+    parser.add_argument('--max-peer-upload-speed', type=int, default=0, help='Max upload speed per peer in bytes per second')
+    parser.add_argument('--max-pipeline-depth', type=int, default=MAX_PIPELINE_DEPTH, help='Max outstanding block requests per peer')
+    parser.add_argument('--upload-slots', type=int, default=UPLOAD_SLOTS,
+                        help='Peers to unchoke at a time (tit-for-tat); 0 unchokes every interested peer')
+    parser.add_argument('--super-seed', action='store_true',
+                        help='As the initial seeder, offer pieces one at a time so each is uploaded about once')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Do not use or write a fast-resume file; hash every piece on start')
+    parser.add_argument('--network', choices=['thread', 'asyncio'], default='thread',
+                        help='Networking core: one thread per peer, or a single asyncio event loop')
+    parser.add_argument('--verbose', action='store_true', help='Enable verbose logging')
+    parser.add_argument('--role', choices=['seeder', 'leecher'], default='leecher', help='Role of the peer')
+
+    args = parser.parse_args()
+
+    client = NodeClient(
+        torrent_file=args.torrent_file,
+        listen_port=args.port,
+        download_directory=args.output,
+        max_download_speed=args.max_download_speed,
+        max_upload_speed=args.max_upload_speed,
+        verbose=args.verbose,
+        role=args.role,
+        max_pipeline_depth=args.max_pipeline_depth,
+        network=args.network,
+        max_peer_download_speed=args.max_peer_download_speed,
+        max_peer_upload_speed=args.max_peer_upload_speed,
+        upload_slots=args.upload_slots,
+        super_seed=args.super_seed,
+        resume=not args.no_resume
+    )
+
+    try:
+        client.start()
+    except KeyboardInterrupt:
+        # Save partial progress so the next start resumes where this one stopped
+        client.stop()
+
+
+if __name__ == '__main__':
+    main()
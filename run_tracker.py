@@ -1,5 +1,10 @@
 # run_tracker.py
-from tracker_server import run_tracker_server
+import argparse
+from simple_tracker import run_tracker
 
 if __name__ == '__main__':
-    run_tracker_server(port=8000)
+    parser = argparse.ArgumentParser(description='Simple BitTorrent tracker')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--udp-port', type=int, help='Also serve UDP (BEP 15) announces on this port')
+    args = parser.parse_args()
+    run_tracker(port=args.port, udp_port=args.udp_port)
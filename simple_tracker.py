@@ -1,45 +1,133 @@
 # simple_tracker.py
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import urllib.parse as urlparse
 import bencodepy
+import threading
+from tracker_state import TrackerState, DEFAULT_NUMWANT
+from udp_tracker import UDPTrackerServer
+
+MISSING_PARAMETERS = bencodepy.encode({b'failure reason': b'info_hash, peer_id and port are required'})
 
 class TrackerHandler(BaseHTTPRequestHandler):
-    peers = []
+    # Keep connections open between announces; every response has a Content-Length.
+    # Headers and body go out in separate writes, so Nagle would hold the body
+    # back until the client's delayed ACK
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    # An idle or stalled connection gives up its thread after this many seconds
+    timeout = 5
 
     def do_GET(self):
         parsed_path = urlparse.urlparse(self.path)
-        query = urlparse.parse_qs(parsed_path.query)
-        info_hash = query.get('info_hash', [None])[0]
-        peer_id = query.get('peer_id', [None])[0]
-        port = query.get('port', [None])[0]
-
-        if info_hash and peer_id and port:
-            # Add the peer to the list
-            ip = self.client_address[0]
-            peer = {'ip': ip, 'port': int(port), 'peer_id': peer_id}
-            if peer not in self.peers:
-                self.peers.append(peer)
-
-            # Prepare the response
-            response = {
-                b'interval': 1800,
-                b'peers': [{'ip': ip.encode('utf-8'), 'port': int(port)} for ip, port in [(p['ip'], p['port']) for p in self.peers if p['peer_id'] != peer_id]]
-            }
-
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(bencodepy.encode(response))
+        # info_hash and peer_id are raw bytes; latin-1 maps each escaped byte
+        # to one character, so they survive decoding unchanged
+        query = urlparse.parse_qs(parsed_path.query, encoding='latin-1')
+        if parsed_path.path.rsplit('/', 1)[-1].startswith('scrape'):
+            self.send_body(200, scrape_response(self.server.state, query))
+            return
+        body = announce_response(self.server.state, query, self.client_address[0])
+        if body is not None:
+            self.send_body(200, body)
         else:
-            self.send_response(400)
-            self.end_headers()
+            self.send_body(400, MISSING_PARAMETERS)
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def announce_response(state, query, ip):
+    """
+    Handle an announce given its parsed query string and return the
+    bencoded response, or None if required parameters are missing.
+    """
+    info_hash = query.get('info_hash', [None])[0]
+    peer_id = query.get('peer_id', [None])[0]
+    port = query.get('port', [None])[0]
+    left = query.get('left', [None])[0]
+    event = query.get('event', [None])[0]
+    numwant = query.get('numwant', [None])[0]
+    compact = query.get('compact', [None])[0] == '1'
+
+    try:
+        port = int(port) if port else None
+        left = int(left) if left else None
+        numwant = int(numwant) if numwant else DEFAULT_NUMWANT
+    except ValueError:
+        port = None
+
+    if not (info_hash and peer_id and port):
+        return None
+
+    # Add or refresh the peer; get back a random sample of the others
+    peers, complete, incomplete = state.announce(info_hash, peer_id, ip, port, left, event,
+                                                 numwant=numwant, compact=compact)
+
+    if compact:
+        # BEP 23 peers come from the swarm's cached entries (see
+        # Swarm.compact_sample); only the integers around them are
+        # formatted per request (keys in sorted order)
+        header = b'd8:completei%de10:incompletei%de8:intervali%de5:peers%d:' % (
+            complete, incomplete, state.interval, len(peers))
+        return b''.join((header, peers, b'e'))
+    response = {
+        b'interval': state.interval,
+        b'complete': complete,
+        b'incomplete': incomplete,
+        b'peers': [{'ip': peer.ip.encode('utf-8'), 'port': peer.port} for peer in peers]
+    }
+    return bencodepy.encode(response)
 
-def run_tracker(server_class=HTTPServer, handler_class=TrackerHandler, port=8000):
+
+def scrape_response(state, query):
+    """
+    Return the bencoded scrape response for the info_hash parameters in
+    the query (any number of them), or for every torrent if there are none.
+    """
+    counts = state.scrape(query.get('info_hash'))
+    # Formatted directly like the compact announce; bencoded dict keys are
+    # sorted, and latin-1 strings sort like the raw info hashes
+    parts = [b'd5:filesd']
+    for info_hash in sorted(counts):
+        seeders, completed, leechers = counts[info_hash]
+        key = info_hash.encode('latin-1')
+        parts.append(b'%d:%sd8:completei%de10:downloadedi%de10:incompletei%dee' % (
+            len(key), key, seeders, completed, leechers))
+    parts.append(b'ee')
+    return b''.join(parts)
+
+
+class TrackerServer(ThreadingHTTPServer):
+    # Each connection gets its own thread, so a slow client never blocks
+    # other announces; the peer registry is shared by all of them
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, state=None):
+        super().__init__(server_address, handler_class)
+        self.state = state if state is not None else TrackerState()
+
+
+def run_tracker(server_class=TrackerServer, handler_class=TrackerHandler, port=8000, udp_port=None):
     server_address = ('', port)
     httpd = server_class(server_address, handler_class)
     print(f"Tracker running on port {port}...")
+    if udp_port is not None:
+        # BEP 15 endpoint for udp:// announce URLs, sharing the same peers
+        udp_server = UDPTrackerServer(httpd.state, udp_port)
+        threading.Thread(target=udp_server.serve_forever, daemon=True).start()
+        print(f"UDP tracker running on port {udp_port}...")
     httpd.serve_forever()
 
 if __name__ == '__main__':
-    run_tracker()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Simple BitTorrent tracker')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--udp-port', type=int, help='Also serve UDP (BEP 15) announces on this port')
+    args = parser.parse_args()
+    run_tracker(port=args.port, udp_port=args.udp_port)
@@ -0,0 +1,389 @@
+# storage.py
+
+import bisect
+import mmap
+import os
+import threading
+
+WRITE_BACK_LIMIT = 64 * 1024 * 1024  # Bytes queued before write() waits for the disk
+MAX_COALESCED_WRITE = 4 * 1024 * 1024  # Largest write built by merging adjacent ones
+
+
+class Storage:
+    """
+    Base class for piece storage backends.
+
+    Offsets are absolute positions in the torrent payload, i.e. the
+    concatenation of all files in the order given by the file mappings.
+    """
+
+    def read(self, offset, length):
+        raise NotImplementedError
+
+    def write(self, offset, data):
+        raise NotImplementedError
+
+    def get_buffers(self, offset, length):
+        """
+        Return a list of buffers that together hold the given range. Backends
+        that can expose their data without copying (e.g. through mmap) should
+        override this; the default falls back to a single read.
+        """
+        return [self.read(offset, length)]
+
+    def allocate(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        # Flush and force the data to disk
+        self.flush()
+
+    def close(self):
+        pass
+
+
+class FileStorage(Storage):
+    """
+    Reads and writes blocks in place in the target files described by
+    PieceManager.file_mappings. Files are created and pre-allocated on first
+    write; reading from a file that does not exist yet returns zeros.
+    """
+
+    def __init__(self, file_mappings, base_path):
+        self.file_mappings = file_mappings
+        self.base_path = base_path
+        self.file_offsets = [file_info['offset'] for file_info in file_mappings]
+        self.handles = {}  # file index -> open file object
+        self.writable = set()  # File indices whose handle is open for writing
+        self.retired = []  # Read-only handles replaced by writable ones, closed in close()
+        self.maps = {}  # file index -> (mmap, memoryview) for zero-copy reads
+        self.lock = threading.Lock()
+
+    def file_path(self, file_index):
+        return os.path.join(self.base_path, *self.file_mappings[file_index]['path'])
+
+    def segments(self, offset, length):
+        """
+        Yield (file_index, file_offset, length) tuples covering the given
+        range of the torrent payload.
+        """
+        file_index = max(bisect.bisect_right(self.file_offsets, offset) - 1, 0)
+        while length > 0 and file_index < len(self.file_mappings):
+            file_info = self.file_mappings[file_index]
+            file_offset = offset - file_info['offset']
+            chunk = min(length, file_info['length'] - file_offset)
+            if chunk > 0:
+                yield file_index, file_offset, chunk
+                offset += chunk
+                length -= chunk
+            file_index += 1
+
+    def get_handle(self, file_index, create=False):
+        # Files are opened read-only until the first write (create=True)
+        # reopens them for writing, so seeding needs no write permission
+        # and reading never changes a file
+        handle = self.handles.get(file_index)
+        if handle is not None and (not create or file_index in self.writable):
+            return handle
+        with self.lock:
+            handle = self.handles.get(file_index)
+            if handle is not None and (not create or file_index in self.writable):
+                return handle
+            file_path = self.file_path(file_index)
+            if not create:
+                if not os.path.exists(file_path):
+                    return None
+                handle = open(file_path, 'rb')
+            else:
+                if not os.path.exists(file_path):
+                    file_dir = os.path.dirname(file_path)
+                    if file_dir and not os.path.exists(file_dir):
+                        os.makedirs(file_dir, exist_ok=True)
+                    open(file_path, 'wb').close()
+                if handle is not None:
+                    self.retired.append(handle)  # Another thread may still be reading through it
+                handle = open(file_path, 'r+b')
+                # Pre-allocate so later writes never extend the file
+                length = self.file_mappings[file_index]['length']
+                if os.fstat(handle.fileno()).st_size < length:
+                    handle.truncate(length)
+                self.writable.add(file_index)
+            self.handles[file_index] = handle
+            return handle
+
+    def allocate(self):
+        for file_index in range(len(self.file_mappings)):
+            self.get_handle(file_index, create=True)
+
+    def read(self, offset, length):
+        data = bytearray(length)
+        view = memoryview(data)
+        position = 0
+        for file_index, file_offset, chunk in self.segments(offset, length):
+            handle = self.get_handle(file_index)
+            if handle is not None:
+                read = self.pread(handle, chunk, file_offset)
+                view[position:position + len(read)] = read
+            position += chunk
+        return bytes(data)
+
+    def write(self, offset, data):
+        view = memoryview(data)
+        position = 0
+        for file_index, file_offset, chunk in self.segments(offset, len(data)):
+            handle = self.get_handle(file_index, create=True)
+            self.pwrite(handle, view[position:position + chunk], file_offset)
+            position += chunk
+
+    def get_map(self, file_index):
+        mapped = self.maps.get(file_index)
+        if mapped is not None:
+            return mapped[1]
+        handle = self.get_handle(file_index)
+        if handle is None:
+            return None
+        with self.lock:
+            mapped = self.maps.get(file_index)
+            if mapped is None:
+                length = self.file_mappings[file_index]['length']
+                if os.fstat(handle.fileno()).st_size < length:
+                    return None  # Short file; read() pads it with zeros
+                mm = mmap.mmap(handle.fileno(), length, access=mmap.ACCESS_READ)
+                mapped = (mm, memoryview(mm))
+                self.maps[file_index] = mapped
+            return mapped[1]
+
+    def get_buffers(self, offset, length):
+        buffers = []
+        for file_index, file_offset, chunk in self.segments(offset, length):
+            view = self.get_map(file_index)
+            if view is None:
+                return [self.read(offset, length)]
+            buffers.append(view[file_offset:file_offset + chunk])
+        return buffers
+
+    def pread(self, handle, length, file_offset):
+        if hasattr(os, 'pread'):
+            return os.pread(handle.fileno(), length, file_offset)
+        with self.lock:
+            handle.seek(file_offset)
+            return handle.read(length)
+
+    def pwrite(self, handle, data, file_offset):
+        if hasattr(os, 'pwrite'):
+            while len(data):
+                written = os.pwrite(handle.fileno(), data, file_offset)
+                data = data[written:]
+                file_offset += written
+            return
+        with self.lock:
+            handle.seek(file_offset)
+            handle.write(data)
+            handle.flush()
+
+    def flush(self):
+        with self.lock:
+            for handle in self.handles.values():
+                handle.flush()
+
+    def sync(self):
+        with self.lock:
+            for handle in self.handles.values():
+                handle.flush()
+                os.fsync(handle.fileno())
+
+    def close(self):
+        with self.lock:
+            for mm, view in self.maps.values():
+                try:
+                    view.release()
+                    mm.close()
+                except BufferError:
+                    pass  # A block is still being sent; the map is freed with it
+            self.maps.clear()
+            for handle in list(self.handles.values()) + self.retired:
+                handle.close()
+            self.handles.clear()
+            self.writable.clear()
+            self.retired.clear()
+
+
+def subtract_range(ranges, offset, length):
+    # The (offset, length) ranges minus [offset, offset + length)
+    end = offset + length
+    remaining = []
+    for start, size in ranges:
+        stop = start + size
+        if stop <= offset or end <= start:
+            remaining.append((start, size))
+            continue
+        if start < offset:
+            remaining.append((start, offset - start))
+        if end < stop:
+            remaining.append((end, stop - end))
+    return remaining
+
+
+class WriteBackStorage(Storage):
+    """
+    Queues writes for a background thread that passes them to the wrapped
+    backend, merging writes to adjacent ranges into one larger write. Data
+    still in the queue is served to readers from the queue, so it can be
+    read back as soon as write() returns. write() waits while more than
+    `limit` bytes are queued.
+
+    A failed backend write is recorded in `failed` as (offset, length) and
+    passed to `on_write_error` (called from the writer thread, so it must
+    not block). flush() and sync() raise the first error for as long as any
+    failed range has not been written again successfully.
+    """
+
+    def __init__(self, backend, limit=WRITE_BACK_LIMIT, on_write_error=None):
+        self.backend = backend
+        self.limit = limit
+        self.on_write_error = on_write_error
+        self.failed = []  # (offset, length) of writes that never reached the backend
+        self.pending = {}  # offset -> data not yet taken by the writer
+        self.writing = {}  # offset -> data the writer is writing now
+        self.pending_bytes = 0  # Bytes in pending and writing
+        self.queued_writes = 0
+        self.backend_writes = 0
+        self.error = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+
+    def file_path(self, file_index):
+        return self.backend.file_path(file_index)
+
+    def allocate(self):
+        self.backend.allocate()
+
+    def overlapping(self, queue, offset, length):
+        # Entries of the queue that overlap [offset, offset + length)
+        end = offset + length
+        return [(start, data) for start, data in queue.items()
+                if start < end and offset < start + len(data)]
+
+    def write(self, offset, data):
+        if not self.running:
+            self.backend.write(offset, data)
+            return
+        data = bytes(data)
+        with self.condition:
+            # Writes to one range must reach the disk in order, so an
+            # overlapping write waits for the queued one to be taken first
+            while self.running and (self.pending_bytes > self.limit
+                                    or self.overlapping(self.pending, offset, len(data))):
+                self.condition.wait()
+            self.pending[offset] = data
+            self.pending_bytes += len(data)
+            self.queued_writes += 1
+            self.condition.notify_all()
+
+    def read(self, offset, length):
+        with self.condition:
+            while True:
+                overlaps = (self.overlapping(self.pending, offset, length)
+                            + self.overlapping(self.writing, offset, length))
+                if not overlaps:
+                    break
+                if len(overlaps) == 1:
+                    start, data = overlaps[0]
+                    if start <= offset and offset + length <= start + len(data):
+                        return data[offset - start:offset - start + length]
+                # Spans queued and stored data; wait for it to be written
+                self.condition.wait()
+        return self.backend.read(offset, length)
+
+    def get_buffers(self, offset, length):
+        # Only a range with queued data has to be copied out through read()
+        with self.condition:
+            queued = (self.overlapping(self.pending, offset, length)
+                      or self.overlapping(self.writing, offset, length))
+        if queued:
+            return [self.read(offset, length)]
+        return self.backend.get_buffers(offset, length)
+
+    def writer_loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                self.writing, self.pending = self.pending, {}
+                batch = sorted(self.writing.items())
+            # Merge runs of adjacent writes
+            failed = []
+            written = []
+            run_offset, run = batch[0][0], [batch[0][1]]
+            run_end = run_offset + len(run[0])
+            for offset, data in batch[1:]:
+                if offset == run_end and run_end - run_offset + len(data) <= MAX_COALESCED_WRITE:
+                    run.append(data)
+                else:
+                    self.write_run(run_offset, run, written, failed)
+                    run_offset, run = offset, [data]
+                run_end = offset + len(data)
+            self.write_run(run_offset, run, written, failed)
+            with self.condition:
+                if self.failed:
+                    # Ranges written again, e.g. re-downloaded pieces, have recovered
+                    for offset, length in written:
+                        self.failed = subtract_range(self.failed, offset, length)
+                self.failed += failed
+                if not self.failed:
+                    self.error = None
+                self.pending_bytes -= sum(len(data) for data in self.writing.values())
+                self.writing = {}
+                self.condition.notify_all()
+            if self.on_write_error is not None:
+                for offset, length in failed:
+                    self.on_write_error(offset, length)
+
+    def write_run(self, offset, buffers, written, failed):
+        # Appends (offset, length) to written or failed
+        data = buffers[0] if len(buffers) == 1 else b''.join(buffers)
+        try:
+            self.backend.write(offset, data)
+        except Exception as e:
+            print(f"Write-back of {len(data)} bytes at offset {offset} failed: {e}")
+            if self.error is None:
+                self.error = e
+            failed.append((offset, len(data)))
+            return
+        self.backend_writes += 1
+        written.append((offset, len(data)))
+
+    def flush(self):
+        """
+        Wait until every queued write has reached the backend. Raises the
+        first write error while some failed range is still unwritten.
+        """
+        with self.condition:
+            while self.pending or self.writing:
+                self.condition.wait()
+            error = self.error if self.failed else None
+        if error is not None:
+            raise error
+        self.backend.flush()
+
+    def sync(self):
+        self.flush()
+        self.backend.sync()
+
+    def close(self):
+        # The writer stops and the backend closes even if a write failed
+        try:
+            self.flush()
+        finally:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            self.thread.join()
+            self.backend.close()
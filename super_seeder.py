@@ -0,0 +1,98 @@
+# super_seeder.py
+
+import threading
+
+
+class SuperSeeder:
+    """
+    Super-seeding (BEP 16) for an initial seeder. Instead of a full BITFIELD
+    each peer is offered one piece at a time with HAVE, choosing the piece
+    offered least often. A peer is offered its next piece once another peer
+    announces the previous one, i.e. it has been passed on, so the seeder
+    uploads each piece about once until the swarm holds a full copy.
+    Super-seeding ends once every piece has been seen at some peer.
+    """
+
+    def __init__(self, piece_manager, verbose=False):
+        self.piece_manager = piece_manager
+        self.verbose = verbose
+        self.active = True
+        self.offers = {}  # peer -> piece index currently offered to it
+        self.offer_counts = [0] * piece_manager.total_pieces
+        self.seen = 0  # Mask of the pieces some peer has announced
+        self.lock = threading.Lock()
+
+    def on_handshake_complete(self, peer):
+        # Called instead of sending our BITFIELD
+        self.offer_next(peer)
+
+    def on_bitfield(self, peer):
+        with self.lock:
+            self.seen |= peer.peer_pieces
+        offered = self.offers.get(peer)
+        if offered is None or (peer.peer_pieces >> offered) & 1:
+            # The current offer is of no use to this peer
+            self.offer_next(peer)
+        self.check_complete()
+
+    def on_have(self, peer, index):
+        with self.lock:
+            self.seen |= 1 << index
+            # Peers whose offered piece has now reached someone else get a new one
+            ready = [other for other, offered in self.offers.items() if offered == index and other is not peer]
+            if self.offers.get(peer) == index and not self.others_lacking(peer, index):
+                # Nobody to pass it on to; do not hold the peer back
+                ready.append(peer)
+        for other in ready:
+            self.offer_next(other)
+        self.check_complete()
+
+    def on_connection_closed(self, peer):
+        with self.lock:
+            self.offers.pop(peer, None)
+
+    def others_lacking(self, peer, index):
+        # Caller must hold self.lock
+        return any(not (other.peer_pieces >> index) & 1 for other in self.offers if other is not peer)
+
+    def offer_next(self, peer):
+        """
+        Offer the peer the piece it lacks that has been offered least often
+        and is rarest among the connected peers.
+        """
+        if not self.active:
+            return
+        piece_manager = self.piece_manager
+        with piece_manager.lock:
+            availability = piece_manager.availability_index.counts()
+        with self.lock:
+            best = None
+            best_key = None
+            for index in range(piece_manager.total_pieces):
+                if (peer.peer_pieces >> index) & 1:
+                    continue
+                key = (self.offer_counts[index], availability[index])
+                if best_key is None or key < best_key:
+                    best, best_key = index, key
+            if best is None:
+                return
+            self.offers[peer] = best
+            self.offer_counts[best] += 1
+        if peer.send_haves([best]) and self.verbose:
+            print(f"Super-seeding: offered piece {best} to {peer.ip}:{peer.port}")
+
+    def check_complete(self):
+        """
+        Once every piece has been seen in the swarm, advertise everything to
+        every peer and stop super-seeding.
+        """
+        with self.lock:
+            if not self.active or self.seen != self.piece_manager.full_mask:
+                return
+            self.active = False
+            peers = list(self.offers)
+            self.offers.clear()
+        all_pieces = range(self.piece_manager.total_pieces)
+        for peer in peers:
+            peer.send_haves(all_pieces)
+        print("Super-seeding complete: the swarm has a full copy.")
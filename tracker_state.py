@@ -0,0 +1,234 @@
+# tracker_state.py
+
+import random
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+ANNOUNCE_INTERVAL = 1800  # Seconds clients are told to wait between announces
+PEER_TIMEOUT = ANNOUNCE_INTERVAL + 300  # Peers that miss their re-announce by this much are dropped
+MAX_PEERS = 1000000  # Across all torrents; the least recently announced peer is evicted beyond this
+DEFAULT_NUMWANT = 50  # Peers returned when the client does not ask for a number
+MAX_NUMWANT = 200
+
+
+class Peer:
+    __slots__ = ('peer_id', 'ip', 'port', 'seeding', 'last_seen', 'slot', 'compact', 'compact_offset')
+
+    def __init__(self, peer_id, ip, port, seeding, last_seen):
+        self.peer_id = peer_id
+        self.seeding = seeding
+        self.last_seen = last_seen
+        self.slot = None  # Position in Swarm.slots
+        self.compact_offset = None  # Position of compact in Swarm.compact_peers
+        self.set_address(ip, port)
+
+    def set_address(self, ip, port):
+        self.ip = ip
+        self.port = port
+        # BEP 23 entry (IPv4 address and port), encoded once per address
+        try:
+            self.compact = socket.inet_aton(ip) + struct.pack('!H', port)
+        except (OSError, struct.error):
+            self.compact = None
+
+
+class Swarm:
+    """
+    The peers of one torrent, keyed by peer_id, with a running count of
+    seeders so the complete/incomplete totals never need a scan. Peers are
+    also kept in a dense list (removal swaps the last peer into the gap) so
+    a random sample costs O(sample size) rather than O(swarm size).
+    """
+
+    def __init__(self):
+        self.peers = {}  # peer_id -> Peer
+        self.slots = []  # Every Peer, in no particular order
+        self.seeders = 0
+        self.downloaded = 0  # 'completed' events, for scrapes; dropped with the swarm
+        self.compact_peers = None  # Every peer's BEP 23 entry, joined; None when out of date
+
+    def __len__(self):
+        return len(self.peers)
+
+    def add(self, peer):
+        self.peers[peer.peer_id] = peer
+        peer.slot = len(self.slots)
+        self.slots.append(peer)
+        self.seeders += peer.seeding
+        self.compact_peers = None
+
+    def remove(self, peer_id):
+        peer = self.peers.pop(peer_id, None)
+        if peer is not None:
+            last = self.slots.pop()
+            if last is not peer:
+                last.slot = peer.slot
+                self.slots[peer.slot] = last
+            self.seeders -= peer.seeding
+            self.compact_peers = None
+        return peer
+
+    def set_address(self, peer, ip, port):
+        peer.set_address(ip, port)
+        self.compact_peers = None
+
+    def sample(self, count, exclude=None):
+        """
+        Up to `count` peers other than `exclude`, chosen uniformly at random.
+        """
+        total = len(self.slots)
+        if self.includes(exclude):
+            # Sample from the other total - 1 slots by mapping the
+            # excluded peer's slot to the last one
+            others = total - 1
+            picks = random.sample(range(others), min(count, others))
+            last = others
+            return [self.slots[last if slot == exclude.slot else slot] for slot in picks]
+        return [self.slots[slot] for slot in random.sample(range(total), min(count, total))]
+
+    def includes(self, peer):
+        return peer is not None and peer.slot is not None and self.slots[peer.slot] is peer
+
+    def compact_sample(self, count, exclude=None):
+        """
+        Like sample, but returns the peers' joined BEP 23 entries, which
+        each peer encodes once when its address is set. Peers without an
+        IPv4 address are left out. When every other peer fits in `count`,
+        the swarm's cached blob of all entries is returned (minus the
+        excluded peer's), rebuilt only after the swarm changed; larger
+        swarms are sampled and joined per request.
+        """
+        excluded = self.includes(exclude)
+        if len(self.slots) - excluded > count:
+            return b''.join([peer.compact for peer in self.sample(count, exclude) if peer.compact is not None])
+        if self.compact_peers is None:
+            offset = 0
+            entries = []
+            for peer in self.slots:
+                if peer.compact is not None:
+                    peer.compact_offset = offset
+                    entries.append(peer.compact)
+                    offset += len(peer.compact)
+            self.compact_peers = b''.join(entries)
+        if not excluded or exclude.compact is None:
+            return self.compact_peers
+        offset = exclude.compact_offset
+        return self.compact_peers[:offset] + self.compact_peers[offset + len(exclude.compact):]
+
+
+class TrackerState:
+    """
+    Peer registry for the tracker. Every peer lives in one OrderedDict keyed
+    by (info_hash, peer_id) in order of its last announce, so an announce is
+    an O(1) upsert (move to the end), peers that stopped announcing are
+    expired from the front, and the oldest peer is evicted once max_peers is
+    reached. Each torrent's peers are also indexed by a Swarm for building
+    responses. All methods are safe to call from several threads.
+    """
+
+    def __init__(self, interval=ANNOUNCE_INTERVAL, peer_timeout=PEER_TIMEOUT, max_peers=MAX_PEERS):
+        self.interval = interval
+        self.peer_timeout = peer_timeout
+        self.max_peers = max_peers
+        self.peers = OrderedDict()  # (info_hash, peer_id) -> Peer, least recently announced first
+        self.swarms = {}  # info_hash -> Swarm
+        self.expired = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def announce(self, info_hash, peer_id, ip, port, left=None, event=None, now=None, numwant=DEFAULT_NUMWANT,
+                 compact=False):
+        """
+        Record an announce and return (a random sample of at most numwant
+        other peers of the swarm, seeders, leechers). The sample is a list
+        of Peers, or their joined BEP 23 entries if compact is set. A
+        'stopped' event removes the peer.
+        """
+        numwant = max(0, min(numwant, MAX_NUMWANT))
+        now = time.time() if now is None else now
+        key = (info_hash, peer_id)
+        with self.lock:
+            self.expire(now)
+            peer = self.peers.get(key)
+            if event == 'stopped':
+                swarm = self.swarms.get(info_hash)
+                if swarm is None:
+                    return (b'' if compact else []), 0, 0
+                if peer is not None:
+                    self.remove(key, swarm)
+                peers = swarm.compact_sample(numwant) if compact else swarm.sample(numwant)
+                return peers, swarm.seeders, len(swarm) - swarm.seeders
+            if peer is None and len(self.peers) >= self.max_peers:
+                self.evict()
+            swarm = self.swarms.get(info_hash)
+            if swarm is None:
+                swarm = self.swarms[info_hash] = Swarm()
+            seeding = left == 0 or event == 'completed'
+            if event == 'completed' and not (peer is not None and peer.seeding):
+                swarm.downloaded += 1
+            if peer is None:
+                peer = Peer(peer_id, ip, port, seeding, now)
+                self.peers[key] = peer
+                swarm.add(peer)
+            else:
+                self.peers.move_to_end(key)
+                if ip != peer.ip or port != peer.port:
+                    swarm.set_address(peer, ip, port)
+                peer.last_seen = now
+                if seeding != peer.seeding:
+                    swarm.seeders += seeding - peer.seeding
+                    peer.seeding = seeding
+            if compact:
+                peers = swarm.compact_sample(numwant, exclude=peer)
+            else:
+                peers = swarm.sample(numwant, exclude=peer)
+            return peers, swarm.seeders, len(swarm) - swarm.seeders
+
+    def scrape(self, info_hashes=None):
+        """
+        Return {info_hash: (seeders, completed, leechers)} for the given
+        info hashes, or for every active torrent if none are given. The
+        counts are kept up to date by announce, so a scrape never walks
+        the peers.
+        """
+        with self.lock:
+            if info_hashes is None:
+                info_hashes = list(self.swarms)
+            counts = {}
+            for info_hash in info_hashes:
+                swarm = self.swarms.get(info_hash)
+                if swarm is None:
+                    counts[info_hash] = (0, 0, 0)
+                else:
+                    counts[info_hash] = (swarm.seeders, swarm.downloaded, len(swarm) - swarm.seeders)
+            return counts
+
+    def remove(self, key, swarm):
+        # Caller holds self.lock
+        self.peers.pop(key, None)
+        swarm.remove(key[1])
+        if not swarm.peers:
+            del self.swarms[key[0]]
+
+    def expire(self, now):
+        # Caller holds self.lock. Peers are ordered by last announce, so the
+        # stale ones are all at the front
+        deadline = now - self.peer_timeout
+        while self.peers:
+            key, peer = next(iter(self.peers.items()))
+            if peer.last_seen >= deadline:
+                break
+            self.remove(key, self.swarms[key[0]])
+            self.expired += 1
+
+    def evict(self):
+        # Caller holds self.lock
+        key = next(iter(self.peers))
+        self.remove(key, self.swarms[key[0]])
+        self.evicted += 1
+
+    def __len__(self):
+        return len(self.peers)
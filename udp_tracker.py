@@ -0,0 +1,207 @@
+# udp_tracker.py
+#
+# UDP tracker protocol (BEP 15): a server sharing the HTTP tracker's
+# TrackerState, and the client side used by NodeClient for udp:// announce
+# URLs. All integers are big-endian.
+
+import hashlib
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+from tracker_state import TrackerState, DEFAULT_NUMWANT
+
+PROTOCOL_ID = 0x41727101980
+ACTION_CONNECT = 0
+ACTION_ANNOUNCE = 1
+ACTION_SCRAPE = 2
+ACTION_ERROR = 3
+EVENTS = {0: None, 1: 'completed', 2: 'started', 3: 'stopped'}
+EVENT_IDS = {event: event_id for event_id, event in EVENTS.items()}
+
+CONNECTION_ID_LIFETIME = 60  # Seconds a connection ID may be used (the server accepts up to twice this)
+MAX_SCRAPE_HASHES = 74  # Most info hashes one scrape request may ask about
+UDP_TIMEOUT = 15  # Seconds before the first retry; doubles per retry as in BEP 15
+UDP_RETRIES = 2
+
+CONNECT_REQUEST = struct.Struct('!QII')
+ANNOUNCE_REQUEST = struct.Struct('!QII20s20sQQQIIIiH')
+HEADER = struct.Struct('!II')
+ANNOUNCE_RESPONSE = struct.Struct('!IIIII')
+SCRAPE_ENTRY = struct.Struct('!III')
+
+
+class UDPTrackerServer:
+    """
+    Serves connect, announce and scrape requests from one socket. Connection
+    IDs are a keyed hash of the client's IP address and the current minute,
+    so the server keeps no per-client state. info_hash and peer_id are decoded
+    as latin-1, like the HTTP tracker does, so both share the same swarms.
+    """
+
+    def __init__(self, state=None, port=8000):
+        self.state = state if state is not None else TrackerState()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', port))
+        self.secret = os.urandom(16)
+        self.running = True
+
+    def connection_id(self, address, epoch):
+        # Not bound to the port: clients may announce from a fresh socket
+        key = b'%s:%d' % (address[0].encode('utf-8'), epoch)
+        return int.from_bytes(hashlib.blake2b(key, key=self.secret, digest_size=8).digest(), 'big')
+
+    def valid_connection_id(self, connection_id, address):
+        epoch = int(time.time()) // CONNECTION_ID_LIFETIME
+        return (connection_id == self.connection_id(address, epoch)
+                or connection_id == self.connection_id(address, epoch - 1))
+
+    def serve_forever(self):
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(2048)
+            except OSError:
+                break
+            try:
+                response = self.handle_packet(data, address)
+            except Exception as e:
+                # One bad request must not stop the tracker
+                print(f"Error handling UDP tracker request from {address[0]}:{address[1]}: {e}")
+                continue
+            if response is not None:
+                try:
+                    self.socket.sendto(response, address)
+                except OSError:
+                    pass
+
+    def handle_packet(self, data, address):
+        """
+        Return the response to one request datagram, or None to ignore it.
+        """
+        if len(data) < 16:
+            return None
+        connection_id, action, transaction_id = CONNECT_REQUEST.unpack_from(data)
+        if action == ACTION_CONNECT:
+            if connection_id != PROTOCOL_ID:
+                return None
+            epoch = int(time.time()) // CONNECTION_ID_LIFETIME
+            return HEADER.pack(ACTION_CONNECT, transaction_id) + struct.pack('!Q', self.connection_id(address, epoch))
+        if not self.valid_connection_id(connection_id, address):
+            return self.error(transaction_id, b'Connection ID expired')
+        if action == ACTION_ANNOUNCE:
+            return self.announce(data, address, transaction_id)
+        if action == ACTION_SCRAPE:
+            return self.scrape(data, transaction_id)
+        return self.error(transaction_id, b'Unknown action')
+
+    def announce(self, data, address, transaction_id):
+        if len(data) < ANNOUNCE_REQUEST.size:
+            return self.error(transaction_id, b'Announce too short')
+        (_, _, _, info_hash, peer_id, downloaded, left, uploaded,
+         event, ip, key, numwant, port) = ANNOUNCE_REQUEST.unpack_from(data)
+        if event not in EVENTS:
+            return self.error(transaction_id, b'Unknown event')
+        # The ip field is ignored; peers are reached at the address they sent from
+        peers, complete, incomplete = self.state.announce(
+            info_hash.decode('latin-1'), peer_id.decode('latin-1'), address[0], port, left, EVENTS[event],
+            numwant=numwant if numwant >= 0 else DEFAULT_NUMWANT, compact=True)
+        return ANNOUNCE_RESPONSE.pack(ACTION_ANNOUNCE, transaction_id, self.state.interval,
+                                      incomplete, complete) + peers
+
+    def scrape(self, data, transaction_id):
+        info_hashes = [data[offset:offset + 20].decode('latin-1')
+                       for offset in range(16, min(len(data), 16 + 20 * MAX_SCRAPE_HASHES) - 19, 20)]
+        counts = self.state.scrape(info_hashes)
+        entries = [SCRAPE_ENTRY.pack(*counts[info_hash]) for info_hash in info_hashes]
+        return HEADER.pack(ACTION_SCRAPE, transaction_id) + b''.join(entries)
+
+    def error(self, transaction_id, message):
+        return HEADER.pack(ACTION_ERROR, transaction_id) + message
+
+    def close(self):
+        self.running = False
+        self.socket.close()
+
+
+class UDPTrackerClient:
+    """
+    Client side of BEP 15 for one udp://host:port announce URL. The
+    connection ID is reused for CONNECTION_ID_LIFETIME seconds.
+    """
+
+    def __init__(self, url, timeout=UDP_TIMEOUT, retries=UDP_RETRIES):
+        parsed = urllib.parse.urlsplit(url)
+        self.address = (parsed.hostname, parsed.port or 80)
+        self.timeout = timeout
+        self.retries = retries
+        self.connection_id = None
+        self.connected_at = 0
+        self.lock = threading.Lock()
+
+    def request(self, sock, packet, transaction_id, action):
+        # Send until a response with our transaction ID arrives, backing off per BEP 15
+        for attempt in range(self.retries + 1):
+            sock.settimeout(self.timeout * 2 ** attempt)
+            sock.sendto(packet, self.address)
+            deadline = time.time() + self.timeout * 2 ** attempt
+            while True:
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    break
+                if len(data) >= 8:
+                    response_action, response_transaction = HEADER.unpack_from(data)
+                    if response_transaction == transaction_id:
+                        if response_action == ACTION_ERROR:
+                            self.connection_id = None  # Reconnect next time, e.g. after an expired ID
+                            raise Exception(f"Tracker error: {data[8:].decode('utf-8', 'replace')}")
+                        if response_action == action:
+                            return data
+                sock.settimeout(max(deadline - time.time(), 0.001))
+        raise Exception(f"No response from UDP tracker {self.address[0]}:{self.address[1]}")
+
+    def connect(self, sock):
+        if self.connection_id is not None and time.time() - self.connected_at < CONNECTION_ID_LIFETIME:
+            return self.connection_id
+        transaction_id = random.getrandbits(32)
+        data = self.request(sock, CONNECT_REQUEST.pack(PROTOCOL_ID, ACTION_CONNECT, transaction_id),
+                            transaction_id, ACTION_CONNECT)
+        if len(data) < 16:
+            raise Exception("Short connect response from UDP tracker")
+        self.connection_id = struct.unpack_from('!Q', data, 8)[0]
+        self.connected_at = time.time()
+        return self.connection_id
+
+    def announce(self, info_hash, peer_id, port, downloaded, left, uploaded, event=None, numwant=DEFAULT_NUMWANT):
+        """
+        Announce and return the response as a dict shaped like a bencoded
+        HTTP response: interval, complete, incomplete and compact peers.
+        """
+        with self.lock, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            connection_id = self.connect(sock)
+            transaction_id = random.getrandbits(32)
+            packet = ANNOUNCE_REQUEST.pack(connection_id, ACTION_ANNOUNCE, transaction_id, info_hash,
+                                           peer_id, downloaded, left, uploaded, EVENT_IDS[event], 0,
+                                           random.getrandbits(32), numwant, port)
+            data = self.request(sock, packet, transaction_id, ACTION_ANNOUNCE)
+        if len(data) < ANNOUNCE_RESPONSE.size:
+            raise Exception("Short announce response from UDP tracker")
+        _, _, interval, leechers, seeders = ANNOUNCE_RESPONSE.unpack_from(data)
+        peers = data[ANNOUNCE_RESPONSE.size:]
+        return {b'interval': interval, b'complete': seeders, b'incomplete': leechers,
+                b'peers': peers[:len(peers) - len(peers) % 6]}
+
+    def scrape(self, info_hashes):
+        """
+        Return (seeders, completed, leechers) for each info hash.
+        """
+        with self.lock, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            connection_id = self.connect(sock)
+            transaction_id = random.getrandbits(32)
+            packet = CONNECT_REQUEST.pack(connection_id, ACTION_SCRAPE, transaction_id) + b''.join(info_hashes)
+            data = self.request(sock, packet, transaction_id, ACTION_SCRAPE)
+        return [SCRAPE_ENTRY.unpack_from(data, 8 + SCRAPE_ENTRY.size * i)
+                for i in range(min(len(info_hashes), (len(data) - 8) // SCRAPE_ENTRY.size))]